@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks of the decode, update and render hot paths of Enki.
+
+The benchmarks run offline against synthetic Sparkplug payloads. For each of
+them, the throughput and the peak memory allocated by a run are reported.
+Results can be saved as a baseline and later runs compared to it to catch
+regressions. Baselines depend on the machine they were measured on.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import sparkplug_b_pb2
+from sparkplug_b import MetricDataType
+
+import sp_helpers
+from sp_id import SPId
+from sp_topic import SPTopic
+from sp_network import SPNet
+from metric_watch import Watch
+from shell import get_metric_str
+from bytes_format import iter_hexdump, iter_list
+from sp_dataset import DataSetColumns
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_TOLERANCE = 0.2
+
+# Datatypes and values used to build metrics of every simple datatype
+SIMPLE_VALUES = [
+    (MetricDataType.Int8, -12),
+    (MetricDataType.Int16, -1234),
+    (MetricDataType.Int32, -123456),
+    (MetricDataType.Int64, -1234567890123),
+    (MetricDataType.UInt8, 200),
+    (MetricDataType.UInt16, 60000),
+    (MetricDataType.UInt32, 4000000000),
+    (MetricDataType.UInt64, 2**63 + 12),
+    (MetricDataType.Float, 1.5),
+    (MetricDataType.Double, 2.25),
+    (MetricDataType.Boolean, True),
+    (MetricDataType.String, "value"),
+    (MetricDataType.DateTime, 1700000000000),
+]
+
+
+def add_metric(payload, name, alias, datatype, value):
+    """Adds a metric to a payload using Enki's own value converters."""
+    metric = payload.metrics.add()
+    metric.name = name
+    metric.alias = alias
+    metric.datatype = datatype
+    metric.timestamp = int(time.time() * 1000)
+    sp_helpers.set_typed_value(datatype, metric, value)
+    return metric
+
+
+def make_payload(count, with_names=True, offset=0):
+    """Returns a payload with count metrics cycling through the simple datatypes."""
+    payload = sparkplug_b_pb2.Payload()
+    for idx in range(count):
+        (datatype, value) = SIMPLE_VALUES[idx % len(SIMPLE_VALUES)]
+        if datatype in sp_helpers.int_value_types + sp_helpers.long_value_types:
+            value += offset
+        metric = add_metric(payload, f"metric_{idx}", idx, datatype, value)
+        if not with_names:
+            metric.ClearField("name")
+    return payload
+
+
+def make_bytes_payload(size):
+    """Returns a payload with a single Bytes metric of the given size."""
+    payload = sparkplug_b_pb2.Payload()
+    metric = payload.metrics.add()
+    metric.name = "blob"
+    metric.alias = 0
+    metric.datatype = MetricDataType.Bytes
+    metric.bytes_value = bytes(range(256)) * (size // 256)
+    return payload
+
+
+def make_dataset_payload(rows):
+    """Returns a payload with a single DataSet metric of the given number of rows."""
+    payload = sparkplug_b_pb2.Payload()
+    metric = payload.metrics.add()
+    metric.name = "table"
+    metric.alias = 0
+    metric.datatype = MetricDataType.DataSet
+    dataset = metric.dataset_value
+    types = [MetricDataType.Int32, MetricDataType.Double, MetricDataType.String]
+    dataset.num_of_columns = len(types)
+    dataset.columns.extend(["id", "value", "label"])
+    dataset.types.extend(types)
+    for idx in range(rows):
+        row = dataset.rows.add()
+        for (datatype, value) in zip(types, [idx, idx / 3, f"row {idx}"]):
+            sp_helpers.set_typed_value(datatype, row.elements.add(), value)
+    return payload
+
+
+class Benchmark:  # pylint: disable=too-few-public-methods
+    """A benchmark: a function run repeatedly, each run doing a number of operations."""
+
+    def __init__(self, name, setup, ops):
+        self.name = name
+        self.setup = setup
+        self.ops = ops
+
+    def measure(self, repeat, min_time):
+        """Returns the best operations per second and the peak memory allocated by a run."""
+        func = self.setup()
+        func()
+        best = None
+        for _ in range(repeat):
+            runs = 0
+            start = time.perf_counter()
+            while True:
+                func()
+                runs += 1
+                elapsed = time.perf_counter() - start
+                if elapsed >= min_time:
+                    break
+            rate = runs * self.ops / elapsed
+            best = rate if best is None else max(best, rate)
+        tracemalloc.start()
+        (current, _peak) = tracemalloc.get_traced_memory()
+        func()
+        (_current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return (best, peak - current)
+
+
+def bench_get_typed_value():
+    """Decoding of metric values of all simple datatypes."""
+    metrics = list(make_payload(1000).metrics)
+
+    def run():
+        for metric in metrics:
+            sp_helpers.get_typed_value(metric.datatype, metric)
+    return run
+
+
+def bench_set_typed_value():
+    """Encoding of metric values of all simple datatypes."""
+    values = [SIMPLE_VALUES[idx % len(SIMPLE_VALUES)] for idx in range(1000)]
+    metric = sparkplug_b_pb2.Payload.Metric()
+
+    def run():
+        for (datatype, value) in values:
+            sp_helpers.set_typed_value(datatype, metric, value)
+    return run
+
+
+def bench_convert_column():
+    """Batch conversion of a DataSet column of 1000 Int16 values."""
+    column = array("I", range(0, 1000 * 65, 65))
+
+    def run():
+        sp_helpers.convert_values(MetricDataType.Int16, column)
+    return run
+
+
+def bench_topic_cached():
+    """Parsing of topics already in the parse cache."""
+    topics = [f"spBv1.0/bench/DDATA/eon{idx % 100}/dev{idx}" for idx in range(1000)]
+
+    def run():
+        for topic in topics:
+            SPTopic.from_str(topic)
+    return run
+
+
+def bench_topic_uncached():
+    """Parsing of topics never seen before."""
+    topics = [f"spBv1.0/bench/DDATA/eon{idx % 100}/dev{idx}" for idx in range(1000)]
+
+    def run():
+        SPTopic.cache_clear()
+        for topic in topics:
+            SPTopic.from_str(topic)
+    return run
+
+
+def _birth_fleet(group, eons, devices, metrics):
+    """Births a fleet of EoNs/devices in SPNet, returns the device Ids."""
+    sp_net = SPNet()
+    birth = make_payload(metrics)
+    dev_ids = []
+    for eon in range(eons):
+        sp_net.add_from_birth(SPId(group, f"eon{eon}"), birth.metrics)
+        for dev in range(devices):
+            dev_id = SPId(group, f"eon{eon}", f"dev{dev}")
+            sp_net.add_from_birth(dev_id, birth.metrics)
+            dev_ids.append(dev_id)
+    return dev_ids
+
+
+def bench_small_ddata():
+    """Decoding and fleet update of many small DDATA from a fleet of 10k devices."""
+    dev_ids = _birth_fleet("small", 100, 100, 10)
+    raw = make_payload(10, with_names=False, offset=1).SerializeToString()
+
+    def run():
+        sp_net = SPNet()
+        for dev_id in dev_ids[::10]:
+            payload = sparkplug_b_pb2.Payload()
+            payload.ParseFromString(raw)
+            sp_net.update_metrics(dev_id, payload.metrics)
+    return run
+
+
+def bench_watched_ddata():
+    """Same as small_ddata with a watch on a metric of each device, that never triggers."""
+    dev_ids = _birth_fleet("watched", 100, 100, 10)
+    SPNet().add_watch(Watch("watched/*", "metric_2", "value > 0"))
+    raw = make_payload(10, with_names=False, offset=1).SerializeToString()
+
+    def run():
+        sp_net = SPNet()
+        for dev_id in dev_ids[::10]:
+            payload = sparkplug_b_pb2.Payload()
+            payload.ParseFromString(raw)
+            sp_net.update_metrics(dev_id, payload.metrics)
+    return run
+
+
+def bench_large_birth():
+    """Decoding and fleet registration of a 2000 metrics DBIRTH."""
+    _birth_fleet("large", 1, 0, 10)
+    raw = make_payload(2000).SerializeToString()
+    dev_id = SPId("large", "eon0", "dev0")
+
+    def run():
+        payload = sparkplug_b_pb2.Payload()
+        payload.ParseFromString(raw)
+        SPNet().add_from_birth(dev_id, payload.metrics)
+    return run
+
+
+def bench_large_ddata():
+    """Update of a device with a 2000 metrics DDATA."""
+    dev_id = _birth_fleet("large_data", 1, 1, 2000)[0]
+    payload = make_payload(2000, offset=1)
+
+    def run():
+        SPNet().update_metrics(dev_id, payload.metrics)
+    return run
+
+
+def bench_fleet_lookup():
+    """Lookup of devices by handle in a fleet of 10k devices."""
+    handles = [str(dev_id) for dev_id in _birth_fleet("lookup", 100, 100, 1)]
+
+    def run():
+        sp_net = SPNet()
+        for handle in handles:
+            sp_net.find_handle(handle)
+    return run
+
+
+def bench_fleet_snapshot():
+    """Snapshot of a fleet of 10k devices after a change."""
+    _birth_fleet("snapshot", 100, 100, 1)
+
+    def run():
+        sp_net = SPNet()
+        with sp_net.changing():
+            pass
+        sp_net.get_snapshot()
+    return run
+
+
+def bench_find_metric():
+    """Lookup of a metric exposed by 10 devices in a fleet of 10k devices."""
+    _birth_fleet("find", 100, 100, 10)
+    _birth_fleet("find_rare", 1, 10, 11)
+
+    def run():
+        SPNet().find_metrics("metric_10")
+    return run
+
+
+def _render(payload):
+    metric = payload.metrics[0]
+
+    def run():
+        get_metric_str(metric)
+    return run
+
+
+def bench_hexdump_4m():
+    """Full hexdump of 4 MiB of byte data."""
+    data = bytes(range(256)) * (16 * 1024)
+
+    def run():
+        for _chunk in iter_hexdump(data):
+            pass
+    return run
+
+
+def bench_list_4m():
+    """Full list representation of 4 MiB of byte data."""
+    data = bytes(range(256)) * (16 * 1024)
+
+    def run():
+        for _chunk in iter_list(data):
+            pass
+    return run
+
+
+def bench_dataset_decode():
+    """Columnar decoding of a DataSet of 100k rows."""
+    dataset = make_dataset_payload(100000).metrics[0].dataset_value
+
+    def run():
+        DataSetColumns(dataset)
+    return run
+
+
+def bench_dataset_csv():
+    """CSV export of a DataSet of 100k rows."""
+    columns = DataSetColumns(make_dataset_payload(100000).metrics[0].dataset_value)
+
+    def run():
+        columns.write_csv(io.StringIO())
+    return run
+
+
+BENCHMARKS = [
+    Benchmark("get_typed_value", bench_get_typed_value, 1000),
+    Benchmark("set_typed_value", bench_set_typed_value, 1000),
+    Benchmark("convert_column", bench_convert_column, 1000),
+    Benchmark("topic_cached", bench_topic_cached, 1000),
+    Benchmark("topic_uncached", bench_topic_uncached, 1000),
+    Benchmark("small_ddata", bench_small_ddata, 1000),
+    Benchmark("large_birth", bench_large_birth, 1),
+    Benchmark("large_ddata", bench_large_ddata, 1),
+    Benchmark("fleet_lookup", bench_fleet_lookup, 10000),
+    Benchmark("fleet_snapshot", bench_fleet_snapshot, 1),
+    Benchmark("find_metric", bench_find_metric, 1),
+    Benchmark("render_bytes_64k", lambda: _render(make_bytes_payload(64 * 1024)), 1),
+    Benchmark("hexdump_4m", bench_hexdump_4m, 1),
+    Benchmark("list_4m", bench_list_4m, 1),
+    Benchmark("render_dataset_1k", lambda: _render(make_dataset_payload(1000)), 1),
+    Benchmark("dataset_decode_100k", bench_dataset_decode, 1),
+    Benchmark("dataset_csv_100k", bench_dataset_csv, 1),
+    # Last, as its watch is checked on every later birth
+    Benchmark("watched_ddata", bench_watched_ddata, 1000),
+]
+
+
+def main():
+    """Runs the benchmarks and compares them to the baseline."""
+    parser = argparse.ArgumentParser(description="Run Enki microbenchmarks")
+    parser.add_argument("names", nargs="*", help="Benchmarks to run, all by default")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of measures, the best one is kept")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="Minimum duration of a measure in seconds")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file")
+    parser.add_argument("--save", action="store_true", help="Save the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Relative slowdown from the baseline reported as a regression")
+    args = parser.parse_args()
+
+    if args.list:
+        for bench in BENCHMARKS:
+            print(f"{bench.name}: {bench.setup.__doc__ or ''}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':20} {'ops/s':>14} {'peak bytes':>12} {'baseline':>10}")
+    for bench in BENCHMARKS:
+        if args.names and bench.name not in args.names:
+            continue
+        (rate, allocated) = bench.measure(args.repeat, args.min_time)
+        results[bench.name] = {"ops_per_s": rate, "peak_bytes": allocated}
+        comparison = ""
+        if bench.name in baseline:
+            ratio = rate / baseline[bench.name]["ops_per_s"]
+            comparison = f"{ratio:9.2f}x"
+            if ratio < 1 - args.tolerance:
+                regressions.append(bench.name)
+                comparison += " REGRESSION"
+        print(f"{bench.name:20} {rate:14.1f} {allocated:12.1f} {comparison}")
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Streaming text representations of byte data.
+
+Byte data is read through a memoryview and formatted in chunks with the bytes
+hex() and translate() methods, so that large Bytes/File values are neither
+copied nor formatted one byte at a time.
+"""
+from typing import Iterator
+
+# Number of bytes per hexdump row
+HEXDUMP_ROW_LEN = 16
+# Width of the hexadecimal part of a hexdump row
+HEXDUMP_HEX_WIDTH = 39
+# Number of bytes formatted at once, a multiple of HEXDUMP_ROW_LEN
+CHUNK_LEN = 64 * 1024
+
+# Characters of the ascii part of a hexdump for each byte value: printable
+# characters other than line breaks and tabulations, which would break the rows
+_ASCII_TABLE = bytes(c if 0x20 <= c < 0x7f else ord(".") for c in range(256))
+
+
+def _get_size(view: memoryview, max_len: int) -> int:
+    """Returns the number of bytes to format, max_len being 0 for all of them."""
+    if max_len and max_len < len(view):
+        return max_len
+    return len(view)
+
+
+def iter_list(byte_data, max_len: int = 0) -> Iterator[str]:
+    """
+    Yields the representation of byte data as a list of hexadecimal values, in chunks.
+
+    :param max_len: Maximum number of bytes represented, 0 for all of them.
+    """
+    view = memoryview(byte_data)
+    size = _get_size(view, max_len)
+    yield "["
+    for start in range(0, size, CHUNK_LEN):
+        chunk = view[start:min(start + CHUNK_LEN, size)]
+        prefix = " ,0x" if start else "0x"
+        yield prefix + chunk.hex(" ").upper().replace(" ", " ,0x")
+    if size < len(view):
+        yield " ..."
+    yield "]"
+
+
+def _hexdump_row(offset: int, row: memoryview) -> str:
+    """Returns a hexdump row of up to HEXDUMP_ROW_LEN bytes."""
+    hex_str = row.hex(" ", -2).upper()
+    ascii_str = row.tobytes().translate(_ASCII_TABLE).decode("ascii")
+    return f"{offset:08X}: {hex_str:{HEXDUMP_HEX_WIDTH}}  {ascii_str}"
+
+
+def iter_hexdump(byte_data, max_len: int = 0) -> Iterator[str]:
+    """
+    Yields the hexadecimal dump of byte data, in chunks of rows.
+
+    Whole rows of a chunk are formatted together: the hexadecimal and ascii
+    parts of the chunk are computed at once and sliced into rows.
+
+    :param max_len: Maximum number of bytes represented, 0 for all of them.
+    """
+    view = memoryview(byte_data)
+    size = _get_size(view, max_len)
+    full_size = size - size % HEXDUMP_ROW_LEN
+    # 2 hexadecimal digits per byte and a separator every 2 bytes
+    hex_row_len = HEXDUMP_HEX_WIDTH + 1
+    for start in range(0, full_size, CHUNK_LEN):
+        chunk = view[start:min(start + CHUNK_LEN, full_size)]
+        hex_str = chunk.hex(" ", 2).upper()
+        ascii_str = chunk.tobytes().translate(_ASCII_TABLE).decode("ascii")
+        rows = [f"{start + pos:08X}: "
+                f"{hex_str[row * hex_row_len:row * hex_row_len + HEXDUMP_HEX_WIDTH]}  "
+                f"{ascii_str[pos:pos + HEXDUMP_ROW_LEN]}"
+                for (row, pos) in enumerate(range(0, len(chunk), HEXDUMP_ROW_LEN))]
+        yield ("\n" if start else "") + "\n".join(rows)
+    if full_size < size:
+        yield ("\n" if full_size else "") + _hexdump_row(full_size, view[full_size:size])
@@ -0,0 +1,171 @@
+"""
+Recording and reading of raw MQTT traffic captures.
+
+A capture is made of three files:
+- <file>: a header followed by the records, each record being a
+  (timestamp, topic length, payload length) header, the topic and the payload.
+- <file>.idx: a header followed by one fixed-size entry per record holding its
+  timestamp, its offset in the capture and the Id of its topic. Entries are
+  ordered by time so a reader can memory-map the index and search it.
+- <file>.topics: the topics of the capture, one per line, in the order of their Id.
+
+Timestamps are in ns since the epoch.
+"""
+import mmap
+import os
+import struct
+import threading
+from typing import Iterator, Optional
+
+CAPTURE_MAGIC = b"ENKICAP1"
+INDEX_MAGIC = b"ENKIIDX1"
+INDEX_SUFFIX = ".idx"
+TOPICS_SUFFIX = ".topics"
+
+# timestamp, topic length, payload length
+RECORD_HEADER = struct.Struct("<qHI")
+# timestamp, record offset, topic Id
+INDEX_ENTRY = struct.Struct("<qQI")
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+# pylint: disable=too-many-instance-attributes
+class CaptureWriter:
+    """Appends received messages to a capture with buffered writes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        # pylint: disable=consider-using-with
+        self.capture = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+        self.index = open(path + INDEX_SUFFIX, "wb", buffering=WRITE_BUFFER_SIZE)
+        self.topics = open(path + TOPICS_SUFFIX, "w", encoding="utf-8")
+        self.topic_ids: dict[str, int] = {}
+        self.capture.write(CAPTURE_MAGIC)
+        self.index.write(INDEX_MAGIC)
+        self.offset = len(CAPTURE_MAGIC)
+        self.count = 0
+
+    def write(self, timestamp: int, topic: str, payload: bytes) -> None:
+        """Appends a message to the capture."""
+        with self.lock:
+            if self.capture.closed:
+                return
+            topic_id = self.topic_ids.get(topic)
+            if topic_id is None:
+                topic_id = len(self.topic_ids)
+                self.topic_ids[topic] = topic_id
+                self.topics.write(topic + "\n")
+            topic_bytes = topic.encode()
+            self.capture.write(RECORD_HEADER.pack(timestamp, len(topic_bytes), len(payload)))
+            self.capture.write(topic_bytes)
+            self.capture.write(payload)
+            self.index.write(INDEX_ENTRY.pack(timestamp, self.offset, topic_id))
+            self.offset += RECORD_HEADER.size + len(topic_bytes) + len(payload)
+            self.count += 1
+
+    def close(self) -> None:
+        """Flushes and closes the capture files."""
+        with self.lock:
+            self.capture.close()
+            self.index.close()
+            self.topics.close()
+
+
+class CaptureReader:
+    """
+    Reads a capture through memory maps, so that records are streamed
+    whatever the size of the capture.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.capture = self._map(path, required=True)
+        assert self.capture is not None and self.capture[:len(CAPTURE_MAGIC)] == CAPTURE_MAGIC, \
+            f"{path} is not an Enki capture"
+        self.index = self._map(path + INDEX_SUFFIX)
+        if self.index is not None and self.index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            self.index = None
+        self.topics: list[str] = []
+        if os.path.exists(path + TOPICS_SUFFIX):
+            with open(path + TOPICS_SUFFIX, encoding="utf-8") as topics:
+                self.topics = topics.read().splitlines()
+
+    @staticmethod
+    def _map(path: str, required: bool = False) -> Optional[mmap.mmap]:
+        if not required and not os.path.exists(path):
+            return None
+        if os.path.getsize(path) == 0:
+            return None
+        with open(path, "rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+    def close(self) -> None:
+        """Unmaps the capture files."""
+        self.capture.close()
+        if self.index is not None:
+            self.index.close()
+
+    def get_size(self) -> int:
+        """Returns the size of the capture in bytes."""
+        return len(self.capture)
+
+    def get_index_len(self) -> int:
+        """Returns the number of entries of the index, 0 if there is no index."""
+        if self.index is None:
+            return 0
+        return (len(self.index) - len(INDEX_MAGIC)) // INDEX_ENTRY.size
+
+    def get_index_entry(self, idx: int) -> tuple[int, int, int]:
+        """Returns the (timestamp, offset, topic Id) of an index entry."""
+        return INDEX_ENTRY.unpack_from(self.index, len(INDEX_MAGIC) + idx * INDEX_ENTRY.size)
+
+    def find_time(self, timestamp: int) -> int:
+        """Returns the offset of the first record received at or after timestamp."""
+        (low, high) = (0, self.get_index_len())
+        while low < high:
+            mid = (low + high) // 2
+            if self.get_index_entry(mid)[0] < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        if low == self.get_index_len():
+            return len(self.capture)
+        return self.get_index_entry(low)[1]
+
+    def iter_topic_offsets(self, topic: str) -> Iterator[int]:
+        """Yields the offsets of the records received on a topic, using the index."""
+        if topic not in self.topics:
+            return
+        topic_id = self.topics.index(topic)
+        for idx in range(self.get_index_len()):
+            entry = self.get_index_entry(idx)
+            if entry[2] == topic_id:
+                yield entry[1]
+
+    def read(self, offset: int) -> tuple[int, str, bytes, int]:
+        """Returns the (timestamp, topic, payload, next record offset) of a record."""
+        (timestamp, topic_len, payload_len) = RECORD_HEADER.unpack_from(self.capture, offset)
+        start = offset + RECORD_HEADER.size
+        topic = self.capture[start:start + topic_len].decode()
+        start += topic_len
+        payload = self.capture[start:start + payload_len]
+        return (timestamp, topic, payload, start + payload_len)
+
+    def iter_records(self, offset: int = len(CAPTURE_MAGIC)) -> Iterator[tuple[int, str, bytes]]:
+        """Yields the (timestamp, topic, payload) of the records from offset."""
+        size = len(self.capture)
+        while offset + RECORD_HEADER.size <= size:
+            (_timestamp, topic_len, payload_len) = RECORD_HEADER.unpack_from(self.capture, offset)
+            if offset + RECORD_HEADER.size + topic_len + payload_len > size:
+                # Truncated record
+                return
+            (timestamp, topic, payload, offset) = self.read(offset)
+            yield (timestamp, topic, payload)
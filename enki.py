@@ -4,30 +4,77 @@ import os
 import sys
 import argparse
 import signal
+import time
 
 from sparkplug_b_pb2 import Payload
 
 from mqtt_if import MQTTInterface
+from ingest import DEFAULT_QUEUE_SIZE, OVERFLOW_BLOCK, OVERFLOW_POLICIES
 from sp_topic import SPTopic
 from sp_network import SPNet
 from sp_helpers import MsgType
+from ingest_filter import IngestFilter, LIFECYCLE_MSG_TYPES
+from ingest_stats import IngestStats, STAGE_TOPIC, STAGE_DECODE, STAGE_UPDATE
+from ingest_stats import COUNTER_RECEIVED, COUNTER_PARSED, COUNTER_DROPPED, COUNTER_UNKNOWN
+from ui import TimedUI
+from exporter import Exporter, DEFAULT_EXPORTER_ADDRESS
+from fleet_store import FleetStore, DEFAULT_STORE_INTERVAL
 from shell import SPShell
+from replay import replay
+
+# Message types whose payload is decoded and handled
+HANDLED_MSG_TYPES = (MsgType.BIRTH, MsgType.DATA, MsgType.DEATH)
 
 
 def on_message(_mqtt_client: MQTTInterface, msg) -> None:
-    """Callback called by the MQTT interface when a message is received."""
+    """Callback called by the MQTT interface when a message is received.
+
+    Messages rejected by the ingest filter are skipped before their payload is
+    decoded, except for BIRTH and DEATH of already tracked EoNs/devices.
+    The time spent in each stage is accounted for in the ingest statistics.
+    """
+    stats = IngestStats()
+    start = time.perf_counter_ns()
     topic = SPTopic.from_str(msg.topic)
     if not topic:
         return
 
+    msg_type = topic.get_msg_type()
+    stats.add_count(COUNTER_RECEIVED, msg_type)
+    ingest_filter = IngestFilter()
+    if msg_type not in HANDLED_MSG_TYPES or not (
+            ingest_filter.accepts(topic)
+            or (msg_type in LIFECYCLE_MSG_TYPES
+                and SPNet().find_id(topic.get_id()) is not None)):
+        ingest_filter.skipped += 1
+        stats.add_stage_time(STAGE_TOPIC, time.perf_counter_ns() - start)
+        return
+
+    ingest_filter.decoded += 1
+    decode_start = time.perf_counter_ns()
+    stats.add_stage_time(STAGE_TOPIC, decode_start - start)
     payload = Payload()
     payload.ParseFromString(msg.payload)
-    if topic.get_msg_type() == MsgType.BIRTH:
-        SPNet().add_from_birth(topic.get_id(), payload.metrics)
-    elif topic.get_msg_type() == MsgType.DATA:
-        SPNet().update_metrics(topic.get_id(), payload.metrics)
-    elif topic.get_msg_type() == MsgType.DEATH:
-        SPNet().remove_by_id(topic.get_id())
+    update_start = time.perf_counter_ns()
+    stats.add_stage_time(STAGE_DECODE, update_start - decode_start)
+    stats.add_count(COUNTER_PARSED, msg_type)
+    seq = payload.seq if payload.HasField("seq") else None
+    if msg_type == MsgType.BIRTH:
+        known = SPNet().add_from_birth(topic.get_id(), payload.metrics, seq)
+    elif msg_type == MsgType.DATA:
+        known = SPNet().update_metrics(topic.get_id(), payload.metrics, seq)
+    else:
+        known = SPNet().remove_by_id(topic.get_id())
+    stats.add_stage_time(STAGE_UPDATE, time.perf_counter_ns() - update_start)
+    if not known:
+        stats.add_count(COUNTER_UNKNOWN, msg_type)
+
+
+def on_dropped(_mqtt_client: MQTTInterface, msg) -> None:
+    """Callback called by the MQTT interface when a received message is discarded."""
+    topic = SPTopic.from_str(msg.topic)
+    if topic:
+        IngestStats().add_count(COUNTER_DROPPED, topic.get_msg_type())
 
 
 def handle_signal(_sig_num, _frame):
@@ -35,11 +82,19 @@ def handle_signal(_sig_num, _frame):
     sys.exit(1)
 
 
-def main():
-    """Main function of the enki application."""
-    if os.name != "nt":
-        signal.signal(signal.SIGHUP, handle_signal)
+def positive_float(value: str) -> float:
+    """Argument type of floats greater than 0."""
+    try:
+        res = float(value)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(f"invalid float value: '{value}'") from err
+    if res <= 0:
+        raise argparse.ArgumentTypeError(f"should be greater than 0: '{value}'")
+    return res
+
 
+def parse_args() -> argparse.Namespace:
+    """Parses the command line arguments."""
     parser = argparse.ArgumentParser(description="View and send Sparkplug payloads")
     parser.add_argument('--host',
                         help='MQTT broker address', default='localhost')
@@ -48,19 +103,96 @@ def main():
     parser.add_argument('--ca-certificate',
                         help='Provide CA Certificate of broker. When this option is provided the '
                         'connection will be made with TLS', default=None, type=str)
-    args = parser.parse_args()
+    parser.add_argument('--queue-size',
+                        help='Maximum number of received messages waiting to be handled',
+                        default=DEFAULT_QUEUE_SIZE, type=int)
+    parser.add_argument('--overflow-policy',
+                        help='What to do with received messages when the queue is full',
+                        default=OVERFLOW_BLOCK, choices=OVERFLOW_POLICIES)
+    parser.add_argument('--loopback', action='store_true',
+                        help='Use an in-process stand-in for the broker: published messages '
+                        'are received back, e.g. to run the "simulate" command')
+    parser.add_argument('--exporter-port', type=int, default=None,
+                        help='Serve the fleet and ingest statistics to Prometheus on this port')
+    parser.add_argument('--exporter-address', default=DEFAULT_EXPORTER_ADDRESS,
+                        help='Address the statistics are served on')
+    parser.add_argument('--fleet-store', metavar='FILE', default=None,
+                        help='Load the EoNs and devices from this file at startup, and write '
+                        'their changes to it periodically')
+    parser.add_argument('--fleet-store-interval', type=float, default=DEFAULT_STORE_INTERVAL,
+                        help='Interval between two writes of the fleet, in seconds')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='Replay a capture written by the "record" command without '
+                        'connecting to the broker, then exit', default=None)
+    replay_pace = parser.add_mutually_exclusive_group()
+    replay_pace.add_argument('--speed',
+                             help='Replay speed relative to the original pacing',
+                             default=1.0, type=positive_float)
+    replay_pace.add_argument('--max', action='store_true',
+                             help='Replay as fast as possible')
+    return parser.parse_args()
+
+
+def start_fleet_store(path: str, interval: float) -> FleetStore:
+    """Restores the fleet from a fleet store and starts writing its changes to it."""
+    fleet_store = FleetStore(path, interval)
+    try:
+        print(f"Restored {fleet_store.load()} EoNs/devices from '{path}'")
+        fleet_store.start()
+    except (OSError, AssertionError) as err:
+        print(f"Cannot use fleet store '{path}': {err}")
+        sys.exit(1)
+    return fleet_store
+
+
+def main():
+    """Main function of the enki application."""
+    if os.name != "nt":
+        signal.signal(signal.SIGHUP, handle_signal)
+
+    args = parse_args()
 
     mqtt_if = MQTTInterface()
     mqtt_if.set_server(args.host, args.port, args.ca_certificate)
+    if args.loopback:
+        mqtt_if.set_loopback()
+    mqtt_if.set_ingest_queue(args.queue_size, args.overflow_policy)
     mqtt_if.message_callback = on_message
+    mqtt_if.drop_callback = on_dropped
+
+    if args.exporter_port is not None:
+        try:
+            Exporter().start(args.exporter_port, args.exporter_address)
+        except OSError as err:
+            print(f"Cannot serve statistics on port {args.exporter_port}: {err}")
+            sys.exit(1)
+
+    if args.replay is not None:
+        try:
+            print(replay(args.replay, mqtt_if, None if args.max else args.speed))
+        except (OSError, AssertionError) as err:
+            print(f"Cannot replay '{args.replay}': {err}")
+            sys.exit(1)
+        finally:
+            MQTTInterface().join()
+        sys.exit(0)
+
+    fleet_store = None
+    if args.fleet_store is not None:
+        fleet_store = start_fleet_store(args.fleet_store, args.fleet_store_interval)
 
     user_interface = SPShell(mqtt_if)
     mqtt_if.connect_callback = user_interface.on_broker_connected
     mqtt_if.disconnect_callback = user_interface.on_broker_disconnected
-    SPNet().set_ui(user_interface)
+    SPNet().set_ui(TimedUI(user_interface))
 
     ret = user_interface.run()
     MQTTInterface().join()
+    if fleet_store is not None:
+        try:
+            fleet_store.stop()
+        except OSError as err:
+            print(f"Cannot write the fleet to '{args.fleet_store}': {err}")
     if ret is not None:
         sys.exit(ret)
     sys.exit(0)
@@ -0,0 +1,190 @@
+"""Prometheus/OpenMetrics exporter of the fleet and ingest statistics."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from ingest_stats import IngestStats, COUNTERS
+from ingest_stats import COUNTER_RECEIVED, COUNTER_PARSED, COUNTER_DROPPED, COUNTER_UNKNOWN
+from mqtt_if import MQTTInterface
+from sp_dev import SPDev
+from sp_network import SPNet
+
+DEFAULT_EXPORTER_ADDRESS = "127.0.0.1"
+DEFAULT_EXPORTER_PORT = 9108
+
+# Help of the received message counters
+_COUNTER_HELP = {
+    COUNTER_RECEIVED: "Number of Sparkplug messages received by type",
+    COUNTER_PARSED: "Number of received Sparkplug messages decoded by type",
+    COUNTER_DROPPED: "Number of received Sparkplug messages dropped because the queue was full",
+    COUNTER_UNKNOWN: "Number of Sparkplug messages received from unknown EoNs/devices by type",
+}
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    """Escapes a label value."""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _family(name: str, kind: str, help_str: str, samples: list[tuple[str, object]]) -> list[str]:
+    """
+    Returns the lines of a metric family.
+
+    :param samples: The label sets, as formatted between braces, and values of
+    the samples. A label set may be prefixed by a suffix of the name, e.g.
+    '_bucket{le="1"}'.
+    """
+    lines = [f"# HELP {name} {help_str}", f"# TYPE {name} {kind}"]
+    for (labels, value) in samples:
+        lines.append(f"{name}{labels} {value}")
+    return lines
+
+
+def _read_gauge(sp_dev: SPDev, metric_name: str) -> Optional[float]:
+    """Returns the value of a numeric or boolean metric, None if it has no such value."""
+    slot = sp_dev.get_slot(metric_name)
+    store = sp_dev.store
+    if slot is None or not store.is_numeric(slot):
+        return None
+    value = store.get_typed_value(slot)
+    return None if value is None else float(value)
+
+
+def _render_histograms(stats: IngestStats) -> list[str]:
+    """Returns the lines of the stage duration histograms."""
+    samples = []
+    for (stage, histogram) in stats.histograms.items():
+        for (bound, count) in histogram.get_cumulative():
+            samples.append((f"_bucket{{stage=\"{stage}\",le=\"{bound / 1e9:g}\"}}", count))
+        samples.append((f"_bucket{{stage=\"{stage}\",le=\"+Inf\"}}", histogram.count))
+        samples.append((f"_sum{{stage=\"{stage}\"}}", histogram.total / 1e9))
+        samples.append((f"_count{{stage=\"{stage}\"}}", histogram.count))
+    return _family("enki_ingest_stage_seconds", "histogram",
+                   "Time spent in each stage of the handling of received messages, "
+                   "decode being the payload decoding and ui the UI callbacks", samples)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves the statistics on /metrics."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Sends the statistics."""
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = Exporter().render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):  # pylint: disable=arguments-differ
+        """Requests are not logged, not to clutter the shell."""
+
+
+class Exporter:
+    """
+    HTTP endpoint exposing the fleet and ingest statistics in the Prometheus
+    text format, along with the values of selected metrics as gauges.
+
+    The statistics are rendered from counters maintained as messages are
+    handled, so that a scrape does not walk the fleet.
+    """
+    __instance = None
+
+    def __new__(cls):
+        if Exporter.__instance is None:
+            Exporter.__instance = object.__new__(cls)
+        return Exporter.__instance
+
+    def __init__(self):
+        if "server" not in self.__dict__:
+            self.server: Optional[ThreadingHTTPServer] = None
+            self.thread: Optional[threading.Thread] = None
+            # Handles and names of the metrics exposed as gauges
+            self.gauges: dict[tuple[str, str], None] = {}
+
+    def start(self, port: int = DEFAULT_EXPORTER_PORT,
+              address: str = DEFAULT_EXPORTER_ADDRESS) -> None:
+        """Starts serving the statistics. Raises OSError if the port cannot be bound."""
+        self.stop()
+        self.server = ThreadingHTTPServer((address, port), _Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name="enki-exporter", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stops serving the statistics."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+
+    def get_address(self) -> Optional[tuple[str, int]]:
+        """Returns the address and port the statistics are served on, None if not started."""
+        if self.server is None:
+            return None
+        return self.server.server_address[:2]
+
+    def add_gauge(self, handle: str, metric_name: str) -> None:
+        """Exposes the value of a metric as a gauge."""
+        self.gauges[(handle, metric_name)] = None
+
+    def remove_gauge(self, handle: str, metric_name: str) -> bool:
+        """Stops exposing the value of a metric. Returns False if it was not exposed."""
+        if (handle, metric_name) not in self.gauges:
+            return False
+        del self.gauges[(handle, metric_name)]
+        return True
+
+    def get_gauges(self) -> list[tuple[str, str]]:
+        """Returns the handles and names of the metrics exposed as gauges."""
+        return list(self.gauges)
+
+    def _render_gauges(self) -> list[str]:
+        """Returns the lines of the metrics exposed as gauges."""
+        samples = []
+        for (handle, metric_name) in self.get_gauges():
+            sp_dev = SPNet().find_handle(handle)
+            value = sp_dev.read_consistent(_read_gauge, sp_dev, metric_name) \
+                if sp_dev is not None else None
+            if value is not None:
+                samples.append((f"{{handle=\"{_escape(handle)}\","
+                                f"metric=\"{_escape(metric_name)}\"}}", value))
+        if not samples:
+            return []
+        return _family("enki_metric_value", "gauge",
+                       "Value of a metric of an EoN or device", samples)
+
+    def render(self) -> str:
+        """Returns the statistics in the Prometheus text format."""
+        (eons, devices) = SPNet().get_counts()
+        stats = IngestStats()
+        ingest = MQTTInterface().ingest
+        lines = _family("enki_eons_online", "gauge", "Number of online EoNs", [("", eons)])
+        lines += _family("enki_devices_online", "gauge", "Number of online devices",
+                         [("", devices)])
+        counters = stats.get_counts()
+        for counter in COUNTERS:
+            lines += _family(f"enki_messages_{counter}_total", "counter", _COUNTER_HELP[counter],
+                             [(f"{{type=\"{msg_type.name}\"}}", count)
+                              for (msg_type, count) in counters[counter].items()])
+        lines += _family("enki_ingest_queue_depth", "gauge",
+                         "Number of received messages waiting to be handled",
+                         [("", ingest.get_depth())])
+        lines += _family("enki_ingest_queue_capacity", "gauge",
+                         "Maximum number of received messages waiting to be handled",
+                         [("", ingest.get_capacity())])
+        lines += _family("enki_ingest_dropped_total", "counter",
+                         "Number of received messages dropped because the queue was full",
+                         [("", ingest.dropped)])
+        lines += _render_histograms(stats)
+        lines += self._render_gauges()
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,249 @@
+"""
+Persistence of the fleet of EoNs and devices, to warm start Enki.
+
+The fleet is persisted to a single file made of a header followed by records,
+each record being a (kind, handle length, payload length) header, the handle
+and the payload. An entry record holds a Sparkplug payload with the metrics of
+an EoN/Device, as in a BIRTH message, its last sequence number and the time it
+was written. A removal record marks an EoN/Device as gone.
+
+Records are appended for the EoNs/devices that changed since the last write,
+the last record of a handle wins. The file is rewritten from the fleet once it
+holds too many outdated records.
+"""
+import os
+import struct
+import threading
+import time
+from typing import Optional
+
+from sparkplug_b_pb2 import Payload
+
+from sp_dev import SPDev
+from sp_id import SPId
+from sp_network import SPNet
+
+STORE_MAGIC = b"ENKIFLT1"
+
+RECORD_ENTRY = 1
+RECORD_REMOVAL = 2
+# kind, handle length, payload length
+RECORD_HEADER = struct.Struct("<BHI")
+
+# Interval between two writes, in seconds
+DEFAULT_STORE_INTERVAL = 10.0
+# The file is rewritten when it is this many times larger than the live records
+COMPACT_RATIO = 2
+# ... and larger than this size, in bytes
+COMPACT_MIN_SIZE = 1024 * 1024
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def _read_entry(sp_dev: SPDev) -> tuple[int, bytes]:
+    """Returns the version of an EoN/Device and the payload of its entry record."""
+    def read():
+        payload = Payload()
+        payload.timestamp = int(time.time() * 1000)
+        if sp_dev.seq is not None:
+            payload.seq = sp_dev.seq
+        store = sp_dev.store
+        for slot in range(len(store)):
+            store.build_metric(slot, payload.metrics.add())
+        return (sp_dev.version, payload.SerializeToString())
+    return sp_dev.read_consistent(read)
+
+
+def _pack(kind: int, sp_id: SPId, payload: bytes = b"") -> bytes:
+    handle = str(sp_id).encode()
+    return RECORD_HEADER.pack(kind, len(handle), len(payload)) + handle + payload
+
+
+def _read_records(data: bytes) -> tuple[dict[SPId, bytes], int]:
+    """
+    Returns the payload of the last entry record of each EoN/Device that is
+    not removed afterwards, and the offset of the end of the last whole record.
+    """
+    entries: dict[SPId, bytes] = {}
+    offset = len(STORE_MAGIC)
+    while offset + RECORD_HEADER.size <= len(data):
+        (kind, handle_len, payload_len) = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + handle_len + payload_len
+        if end > len(data):
+            # Truncated record
+            break
+        sp_id = SPId.from_handle(data[start:start + handle_len].decode())
+        if sp_id is not None:
+            if kind == RECORD_ENTRY:
+                entries[sp_id] = data[start + handle_len:end]
+            else:
+                entries.pop(sp_id, None)
+        offset = end
+    return (entries, offset)
+
+
+# pylint: disable=too-many-instance-attributes
+class FleetStore:
+    """
+    Loads the fleet from a file at startup and writes its changes to the file
+    periodically, in a thread of its own so that the handling of received
+    messages is not slowed down.
+
+    Changed EoNs/devices are found by comparing their version with the one of
+    their last written record, without any bookkeeping by the ingest thread.
+    """
+
+    def __init__(self, path: str, interval: float = DEFAULT_STORE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.file = None
+        # Size of the file, and of the last entry record of each EoN/Device
+        self.size = 0
+        self.live_size = 0
+        self.written: dict[SPId, tuple[SPDev, int, int]] = {}
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def load(self) -> int:
+        """
+        Restores the EoNs/devices of the file in the fleet, returns their number.
+        A truncated last record, as left by a crash during a write, is ignored.
+        """
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return 0
+        with open(self.path, "rb") as file:
+            data = file.read()
+        assert data[:len(STORE_MAGIC)] == STORE_MAGIC, f"{self.path} is not an Enki fleet store"
+        (entries, self.size) = _read_records(data)
+        # EoNs first, as devices are added to them
+        net = SPNet()
+        with net.changing():
+            for (sp_id, entry) in sorted(entries.items(), key=lambda item: item[0].is_dev()):
+                payload = Payload()
+                payload.ParseFromString(entry)
+                seq = payload.seq if payload.HasField("seq") else None
+                if net.restore(sp_id, payload.metrics, seq):
+                    sp_dev = net.find_id(sp_id)
+                    size = RECORD_HEADER.size + len(str(sp_id).encode()) + len(entry)
+                    self.written[sp_id] = (sp_dev, sp_dev.version, size)
+                    self.live_size += size
+        return len(self.written)
+
+    def start(self) -> None:
+        """Opens the file and starts writing the changes of the fleet periodically."""
+        if self.thread is not None:
+            return
+        self._open()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="enki-fleet-store", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stops the periodic writes, writes the last changes and closes the file."""
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        with self.lock:
+            self._write()
+            self.file.close()
+            self.file = None
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.write()
+            except OSError as err:
+                print(f"Cannot write the fleet to '{self.path}': {err}")
+
+    def _open(self) -> None:
+        """Opens the file for appending, dropping any truncated record at its end."""
+        # pylint: disable=consider-using-with
+        if self.size:
+            self.file = open(self.path, "r+b", buffering=WRITE_BUFFER_SIZE)
+            self.file.seek(self.size)
+            self.file.truncate()
+        else:
+            self.file = open(self.path, "wb", buffering=WRITE_BUFFER_SIZE)
+            self.file.write(STORE_MAGIC)
+            self.size = len(STORE_MAGIC)
+
+    def write(self) -> int:
+        """
+        Appends records for the EoNs/devices that changed since the last write,
+        or rewrites the file if it holds too many outdated records.
+        Returns the number of records written.
+        """
+        with self.lock:
+            if self.file is None:
+                return 0
+            if self.size > COMPACT_MIN_SIZE and self.size > COMPACT_RATIO * self.live_size:
+                return self._compact()
+            return self._write()
+
+    def _write(self) -> int:
+        """Appends records for the EoNs/devices that changed since the last write."""
+        (records, size, live_size) = self._write_records(self.file, self.written)
+        self.size += size
+        self.live_size += live_size
+        return records
+
+    @staticmethod
+    def _write_records(file, written: dict[SPId, tuple[SPDev, int, int]]) -> tuple[int, int, int]:
+        """
+        Writes records for the EoNs/devices that changed since they were
+        written, according to written, which is updated.
+        Returns the number of records, their size and the change of the size
+        of the live records.
+        """
+        index = SPNet().get_snapshot().index
+        records = 0
+        size = 0
+        live_size = 0
+        for (sp_id, sp_dev) in index.items():
+            last = written.get(sp_id)
+            if last is not None and last[0] is sp_dev and last[1] == sp_dev.version:
+                continue
+            (version, payload) = _read_entry(sp_dev)
+            record = _pack(RECORD_ENTRY, sp_id, payload)
+            file.write(record)
+            size += len(record)
+            live_size += len(record) - (last[2] if last is not None else 0)
+            written[sp_id] = (sp_dev, version, len(record))
+            records += 1
+        for sp_id in [sp_id for sp_id in written if sp_id not in index]:
+            record = _pack(RECORD_REMOVAL, sp_id)
+            file.write(record)
+            size += len(record)
+            live_size -= written.pop(sp_id)[2]
+            records += 1
+        file.flush()
+        return (records, size, live_size)
+
+    def _compact(self) -> int:
+        """
+        Rewrites the file with the entry records of the fleet only, returns their number.
+        The file and what was written to it are unchanged if the rewrite fails.
+        """
+        self.file.close()
+        tmp_path = self.path + ".tmp"
+        written: dict[SPId, tuple[SPDev, int, int]] = {}
+        try:
+            with open(tmp_path, "wb", buffering=WRITE_BUFFER_SIZE) as file:
+                file.write(STORE_MAGIC)
+                (records, size, live_size) = self._write_records(file, written)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            # pylint: disable=consider-using-with
+            self.file = open(self.path, "ab", buffering=WRITE_BUFFER_SIZE)
+        self.written = written
+        self.size = len(STORE_MAGIC) + size
+        self.live_size = live_size
+        return records
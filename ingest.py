@@ -0,0 +1,136 @@
+"""Bounded queue and worker thread handling the messages received from the broker."""
+import queue
+import threading
+from typing import Optional
+
+# Policies applied when a message is received while the queue is full
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_DROP_NEWEST = "drop-newest"
+OVERFLOW_POLICIES = [OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST]
+
+DEFAULT_QUEUE_SIZE = 10000
+
+# Queued to make the worker thread exit
+_STOP = object()
+
+
+# pylint: disable=too-many-instance-attributes
+class IngestQueue:
+    """
+    Hands messages received in the MQTT network thread to a dedicated worker thread.
+
+    The queue is bounded, messages received while it is full are handled according to
+    the overflow policy:
+    - block: the network thread waits for room in the queue.
+    - drop-oldest: the oldest queued message is discarded.
+    - drop-newest: the received message is discarded.
+    """
+
+    def __init__(self, handler, maxsize: int = DEFAULT_QUEUE_SIZE,
+                 policy: str = OVERFLOW_BLOCK, drop_handler=None):
+        assert policy in OVERFLOW_POLICIES, f"Unknown overflow policy {policy}"
+        self.handler = handler
+        self.drop_handler = drop_handler
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.policy = policy
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.thread = None
+        # cProfile profiler the handler is run under, in the worker thread
+        self.profiler = None
+        self.profiler_lock = threading.Lock()
+
+    def put(self, msg) -> None:
+        """Queues a message according to the overflow policy."""
+        self.received += 1
+        if self.policy == OVERFLOW_BLOCK:
+            self.queue.put(msg)
+        elif self.policy == OVERFLOW_DROP_NEWEST:
+            try:
+                self.queue.put_nowait(msg)
+            except queue.Full:
+                self._drop(msg)
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(msg)
+                    break
+                except queue.Full:
+                    try:
+                        dropped = self.queue.get_nowait()
+                        self.queue.task_done()
+                        self._drop(dropped)
+                    except queue.Empty:
+                        pass
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _drop(self, msg) -> None:
+        """Accounts for a discarded message."""
+        self.dropped += 1
+        if self.drop_handler is not None and msg is not _STOP:
+            self.drop_handler(msg)
+
+    def get_depth(self) -> int:
+        """Returns the number of messages waiting in the queue."""
+        return self.queue.qsize()
+
+    def get_capacity(self) -> int:
+        """Returns the maximum number of messages the queue can hold."""
+        return self.queue.maxsize
+
+    def wait_empty(self) -> None:
+        """Waits until all the queued messages are handled."""
+        self.queue.join()
+
+    def get_thread_id(self) -> Optional[int]:
+        """Returns the identifier of the worker thread, None if it is not started."""
+        return self.thread.ident if self.thread is not None else None
+
+    def set_profiler(self, profiler) -> None:
+        """
+        Sets the cProfile profiler messages are handled under, None to stop profiling.
+        Returns once the message being handled under the previous profiler, if any, is handled.
+        """
+        with self.profiler_lock:
+            self.profiler = profiler
+
+    def _handle_profiled(self, msg) -> None:
+        with self.profiler_lock:
+            if self.profiler is not None:
+                self.profiler.runcall(self.handler, msg)
+            else:
+                self.handler(msg)
+
+    def start(self) -> None:
+        """Starts the worker thread."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="enki-ingest", daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """Stops the worker thread once the queued messages are handled."""
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        while True:
+            msg = self.queue.get()
+            if msg is _STOP:
+                self.queue.task_done()
+                return
+            try:
+                if self.profiler is None:
+                    self.handler(msg)
+                else:
+                    self._handle_profiled(msg)
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"Error while handling message on '{msg.topic}': {err}")
+            self.processed += 1
+            self.queue.task_done()
@@ -0,0 +1,123 @@
+"""Filtering of received messages on their topic, before their payload is decoded."""
+from fnmatch import fnmatchcase
+from typing import Optional
+
+from sp_helpers import MsgType
+from sp_id import SPId
+from sp_topic import SPTopic, TOPIC_CACHE_SIZE
+
+FILTER_INCLUDE = "include"
+FILTER_EXCLUDE = "exclude"
+FILTER_ACTIONS = [FILTER_INCLUDE, FILTER_EXCLUDE]
+
+# Message types that make EoNs and devices tracked or untracked
+LIFECYCLE_MSG_TYPES = (MsgType.BIRTH, MsgType.DEATH)
+
+
+class FilterRule:
+    """
+    Includes or excludes the messages of EoNs/devices whose handle matches a pattern.
+
+    The pattern is a glob matched against handles (group_id/eon_id[/device_id]).
+    A pattern matching an EoN also matches its devices.
+    The rule may be restricted to one message type.
+    """
+
+    def __init__(self, action: str, pattern: str, msg_type: Optional[MsgType] = None):
+        assert action in FILTER_ACTIONS, f"Unknown filter action {action}"
+        self.action = action
+        self.pattern = pattern
+        self.msg_type = msg_type
+
+    def __str__(self) -> str:
+        res = f"{self.action} {self.pattern}"
+        if self.msg_type is not None:
+            res += f" ({self.msg_type.name})"
+        return res
+
+    def applies_to(self, msg_type: MsgType) -> bool:
+        """
+        Returns True if the rule applies to the given message type.
+
+        Include rules restricted to a message type also apply to BIRTH and DEATH,
+        so that the EoNs/devices whose messages are included are tracked.
+        """
+        if self.msg_type is None or self.msg_type == msg_type:
+            return True
+        return self.action == FILTER_INCLUDE and msg_type in LIFECYCLE_MSG_TYPES
+
+    def matches_id(self, sp_id: SPId) -> bool:
+        """Returns True if the pattern matches the Id or the Id of its EoN."""
+        return (fnmatchcase(str(sp_id), self.pattern)
+                or (sp_id.is_dev() and fnmatchcase(str(sp_id.get_eon_id()), self.pattern)))
+
+
+class IngestFilter:
+    """
+    Decides which received messages are decoded.
+
+    A message is skipped if an exclude rule matches it, or if there are include
+    rules and none of them matches it. Messages are accepted when there are no rules.
+    Decisions are cached per topic so that a filtered-out message only costs a
+    topic lookup.
+    """
+    __instance = None
+
+    def __new__(cls):
+        if IngestFilter.__instance is None:
+            IngestFilter.__instance = object.__new__(cls)
+        return IngestFilter.__instance
+
+    def __init__(self):
+        if "rules" not in self.__dict__:
+            self.rules: list[FilterRule] = []
+            self.decisions: dict[SPTopic, bool] = {}
+            self.decoded = 0
+            self.skipped = 0
+
+    def add_rule(self, rule: FilterRule) -> None:
+        """Adds a rule to the filter."""
+        self.rules = self.rules + [rule]
+        self.decisions = {}
+
+    def remove_rule(self, index: int) -> FilterRule:
+        """Removes the rule at the given index and returns it."""
+        rules = list(self.rules)
+        rule = rules.pop(index)
+        self.rules = rules
+        self.decisions = {}
+        return rule
+
+    def reset_counters(self) -> None:
+        """Resets the decoded and skipped messages counters."""
+        self.decoded = 0
+        self.skipped = 0
+
+    def accepts(self, topic: SPTopic) -> bool:
+        """Returns True if messages received on the topic must be decoded."""
+        # Rules are replaced before the decisions, so a decision is never
+        # cached in the decisions of newer rules.
+        decisions = self.decisions
+        decision = decisions.get(topic)
+        if decision is None:
+            decision = self._decide(topic, self.rules)
+            if len(decisions) >= TOPIC_CACHE_SIZE:
+                decisions.clear()
+            decisions[topic] = decision
+        return decision
+
+    @staticmethod
+    def _decide(topic: SPTopic, rules: list[FilterRule]) -> bool:
+        msg_type = topic.get_msg_type()
+        sp_id = topic.get_id()
+        has_includes = False
+        included = False
+        for rule in rules:
+            if rule.action == FILTER_INCLUDE:
+                has_includes = True
+            if not rule.applies_to(msg_type) or not rule.matches_id(sp_id):
+                continue
+            if rule.action == FILTER_EXCLUDE:
+                return False
+            included = True
+        return included or not has_includes
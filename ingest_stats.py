@@ -0,0 +1,133 @@
+"""Statistics about the handling of received messages."""
+import time
+from bisect import bisect_left
+
+from sp_helpers import MsgType
+
+# Stages of the handling of a received message
+STAGE_TOPIC = "topic"
+STAGE_DECODE = "decode"
+STAGE_UPDATE = "update"
+# Time spent in the UI callbacks, which is also part of the update stage
+STAGE_UI = "ui"
+STAGES = [STAGE_TOPIC, STAGE_DECODE, STAGE_UPDATE, STAGE_UI]
+
+# Counters of received messages, by message type
+COUNTER_RECEIVED = "received"
+COUNTER_PARSED = "parsed"
+COUNTER_DROPPED = "dropped"
+COUNTER_UNKNOWN = "unknown"
+COUNTERS = [COUNTER_RECEIVED, COUNTER_PARSED, COUNTER_DROPPED, COUNTER_UNKNOWN]
+
+# Upper bounds, in ns, of the buckets of the stage duration histograms
+DURATION_BUCKETS = (1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+                    1000000, 2500000, 5000000, 10000000, 25000000, 100000000)
+
+
+class DurationHistogram:
+    """Distribution of durations in fixed buckets, along with their count and sum."""
+
+    def __init__(self, bounds: tuple[int, ...] = DURATION_BUCKETS):
+        self.bounds = bounds
+        # One more bucket for the durations above the last bound
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+
+    def add(self, duration: int) -> None:
+        """Accounts for a duration, in ns."""
+        self.buckets[bisect_left(self.bounds, duration)] += 1
+        self.count += 1
+        self.total += duration
+
+    def get_cumulative(self) -> list[tuple[int, int]]:
+        """
+        Returns the number of durations lower than or equal to each bound,
+        the durations above the last bound being only in the count.
+        """
+        res = []
+        count = 0
+        for (bound, bucket) in zip(self.bounds, self.buckets):
+            count += bucket
+            res.append((bound, count))
+        return res
+
+    def get_quantile(self, quantile: float) -> float:
+        """
+        Returns an estimate of a quantile of the durations, in ns, interpolated
+        within the bucket it falls in. Durations above the last bound are
+        estimated to be the last bound.
+        """
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        count = 0
+        lower = 0
+        for (bound, bucket) in zip(self.bounds, self.buckets):
+            if bucket and count + bucket >= rank:
+                return lower + (bound - lower) * (rank - count) / bucket
+            count += bucket
+            lower = bound
+        return float(self.bounds[-1])
+
+
+class IngestStats:
+    """
+    Number of received messages of each type, and time spent in each stage
+    of the handling of received messages.
+
+    Counters are messages received from the broker, parsed (payload decoded),
+    dropped (discarded because the queue was full) and coming from unknown
+    EoNs/devices.
+
+    Stage times are only accounted for by the thread handling received
+    messages, so that they are updated without locking.
+    """
+    __instance = None
+
+    def __new__(cls):
+        if IngestStats.__instance is None:
+            IngestStats.__instance = object.__new__(cls)
+        return IngestStats.__instance
+
+    def __init__(self):
+        if "stage_time" not in self.__dict__:
+            self.stage_time: dict[str, int] = {}
+            self.stage_count: dict[str, int] = {}
+            self.histograms: dict[str, DurationHistogram] = {}
+            self.counters: dict[str, dict[MsgType, int]] = {}
+            self.reset_time = 0.0
+            self.reset()
+
+    def reset(self) -> None:
+        """Resets all the statistics."""
+        self.stage_time = {stage: 0 for stage in STAGES}
+        self.stage_count = {stage: 0 for stage in STAGES}
+        self.histograms = {stage: DurationHistogram() for stage in STAGES}
+        self.counters = {counter: {msg_type: 0 for msg_type in MsgType} for counter in COUNTERS}
+        self.reset_time = time.monotonic()
+
+    def add_count(self, counter: str, msg_type: MsgType) -> None:
+        """Accounts for a message in a counter."""
+        self.counters[counter][msg_type] += 1
+
+    def get_counts(self) -> dict[str, dict[MsgType, int]]:
+        """Returns a copy of the counters."""
+        return {counter: dict(counts) for (counter, counts) in self.counters.items()}
+
+    def add_stage_time(self, stage: str, duration: int) -> None:
+        """Accounts for a duration, in ns, spent in a stage."""
+        self.stage_time[stage] += duration
+        self.stage_count[stage] += 1
+        self.histograms[stage].add(duration)
+
+    def get_stage_times(self) -> dict[str, tuple[int, int]]:
+        """Returns the total time, in ns, and the number of passes for each stage."""
+        return {stage: (self.stage_time[stage], self.stage_count[stage]) for stage in STAGES}
+
+    @staticmethod
+    def diff_stage_times(after: dict[str, tuple[int, int]],
+                         before: dict[str, tuple[int, int]]) -> dict[str, tuple[int, int]]:
+        """Returns the stage times accounted for between two calls to get_stage_times()."""
+        return {stage: (after[stage][0] - before[stage][0], after[stage][1] - before[stage][1])
+                for stage in STAGES}
@@ -0,0 +1,99 @@
+"""In-process stand-in for an MQTT broker."""
+import threading
+
+import paho.mqtt.client as mqtt
+
+from topic_trie import TopicTrie
+
+
+class LoopbackMessage:  # pylint: disable=too-few-public-methods
+    """Message delivered by the loopback client, with the attributes of an MQTT message."""
+    __slots__ = ("topic", "payload", "qos", "retain", "mid")
+
+    def __init__(self, topic: str, payload: bytes, qos: int, retain: bool, mid: int):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = mid
+
+
+class LoopbackClient:
+    """
+    Drop-in replacement for the paho MQTT client that delivers published
+    messages to its own subscriptions instead of going through a broker.
+
+    Publications are acknowledged immediately, so it can be used to exercise
+    Enki, or to measure it, without a broker.
+    """
+
+    def __init__(self):
+        self.userdata = None
+        self.on_connect = None
+        self.on_message = None
+        self.on_publish = None
+        self.subscriptions = TopicTrie()
+        self.lock = threading.Lock()
+        self.mid = 0
+
+    def user_data_set(self, userdata) -> None:
+        """Sets the user data passed to the callbacks."""
+        self.userdata = userdata
+
+    def username_pw_set(self, _username, _password=None) -> None:
+        """Credentials are not used."""
+
+    def tls_set(self, *_args, **_kwargs) -> None:
+        """TLS is not used."""
+
+    def max_inflight_messages_set(self, _inflight) -> None:
+        """Publications are acknowledged immediately, there are no messages in flight."""
+
+    def connect(self, _host, _port=1883, _keepalive=60) -> int:
+        """Calls the connect callback as if the broker had accepted the connection."""
+        if self.on_connect is not None:
+            self.on_connect(self, self.userdata, {}, 0)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def disconnect(self) -> int:
+        """Nothing to disconnect from."""
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_start(self) -> None:
+        """Messages are delivered from publish(), there is no network loop."""
+
+    def loop_stop(self) -> None:
+        """Messages are delivered from publish(), there is no network loop."""
+
+    def subscribe(self, topic: str, _qos: int = 0) -> tuple[int, int]:
+        """Subscribes to a topic filter."""
+        self.subscriptions.add(topic, topic)
+        return (mqtt.MQTT_ERR_SUCCESS, self._next_mid())
+
+    def unsubscribe(self, topic: str) -> tuple[int, int]:
+        """Unsubscribes from a topic filter."""
+        try:
+            self.subscriptions.remove(topic)
+        except KeyError:
+            pass
+        return (mqtt.MQTT_ERR_SUCCESS, self._next_mid())
+
+    def _next_mid(self) -> int:
+        with self.lock:
+            self.mid += 1
+            return self.mid
+
+    def publish(self, topic: str, payload=None, qos: int = 0,
+                retain: bool = False) -> mqtt.MQTTMessageInfo:
+        """Delivers a message to the subscriptions matching its topic and acknowledges it."""
+        mid = self._next_mid()
+        if payload is None:
+            payload = b""
+        if self.on_message is not None and self.subscriptions.match(topic):
+            self.on_message(self, self.userdata,
+                            LoopbackMessage(topic, bytes(payload), qos, retain, mid))
+        info = mqtt.MQTTMessageInfo(mid)
+        info.rc = mqtt.MQTT_ERR_SUCCESS
+        if self.on_publish is not None:
+            self.on_publish(self, self.userdata, mid)
+        return info
@@ -0,0 +1,93 @@
+"""Recent history of numeric metric values."""
+from array import array
+from typing import Iterator, Optional
+
+# Memory used by one sample: a timestamp and a value
+SAMPLE_SIZE = 16
+
+DEFAULT_HISTORY_SIZE = 0
+DEFAULT_HISTORY_BUDGET = 64 * 1024 * 1024
+
+
+class MetricHistory:
+    """
+    Fixed-size ring buffer of the latest samples of a metric.
+
+    Timestamps and values are stored in arrays allocated once, appending a
+    sample overwrites the oldest one when the buffer is full.
+    """
+    __slots__ = ("timestamps", "values", "head", "count")
+
+    def __init__(self, size: int):
+        self.timestamps = array("Q", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.head = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def get_size(self) -> int:
+        """Returns the maximum number of samples held."""
+        return len(self.values)
+
+    def append(self, timestamp: int, value: float) -> None:
+        """Appends a sample, timestamp is in ms."""
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % len(self.values)
+        if self.count < len(self.values):
+            self.count += 1
+
+    def iter_recent(self, count: int) -> Iterator[tuple[int, float]]:
+        """Yields the (timestamp, value) of up to count samples, from the most recent."""
+        size = len(self.values)
+        for idx in range(1, min(count, self.count) + 1):
+            pos = (self.head - idx) % size
+            yield (self.timestamps[pos], self.values[pos])
+
+    def get_stats(self) -> Optional[tuple[float, float, float, float]]:
+        """
+        Returns the min, max, mean and rate of change per second of the samples,
+        or None if there are no samples.
+        The buffer is read in place, without copying it.
+        """
+        if not self.count:
+            return None
+        values = memoryview(self.values)[:self.count]
+        (newest_ts, newest) = next(self.iter_recent(1))
+        oldest_pos = (self.head - self.count) % len(self.values)
+        duration = newest_ts - self.timestamps[oldest_pos]
+        rate = 0.0
+        if duration > 0:
+            rate = 1000 * (newest - self.values[oldest_pos]) / duration
+        return (min(values), max(values), sum(values) / self.count, rate)
+
+
+class HistoryStore:
+    """
+    Allocates history buffers while keeping their memory within a budget.
+
+    A size of 0 disables the history.
+    """
+
+    def __init__(self, size: int = DEFAULT_HISTORY_SIZE, budget: int = DEFAULT_HISTORY_BUDGET):
+        self.size = size
+        self.budget = budget
+        self.used = 0
+
+    def is_enabled(self) -> bool:
+        """Returns True if new history buffers may be allocated."""
+        return self.size > 0
+
+    def allocate(self) -> Optional[MetricHistory]:
+        """Returns a new history buffer, or None if it would exceed the budget."""
+        needed = self.size * SAMPLE_SIZE
+        if not self.size or self.used + needed > self.budget:
+            return None
+        self.used += needed
+        return MetricHistory(self.size)
+
+    def release(self, history: MetricHistory) -> None:
+        """Gives the memory of a history buffer back to the budget."""
+        self.used -= history.get_size() * SAMPLE_SIZE
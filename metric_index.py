@@ -0,0 +1,90 @@
+"""Inverted index of the metrics of the fleet by name."""
+import re
+from fnmatch import translate
+
+from sp_dev import SPDev
+from metric_store import MetricSchema
+
+# Characters making a glob pattern match more than one name
+GLOB_CHARS = "*?["
+
+
+class MetricIndex:
+    """
+    Slot of each metric name in the EoNs/devices that have it, so that the
+    EoNs/devices exposing a metric are found without walking the fleet.
+
+    Names are indexed by schema: as EoNs/devices born with the same metrics
+    share their schema, only the birth of the first one and the death of the
+    last one walk the metrics.
+
+    EoNs/devices are added when they are born and removed when they die, in
+    the thread handling received messages. Readers in other threads only
+    copy the index with single C-level operations, and have to check that the
+    fleet did not change meanwhile.
+    """
+
+    def __init__(self):
+        self.slots: dict[str, dict[MetricSchema, int]] = {}
+        # EoNs/devices of each schema, as an ordered set
+        self.devices: dict[MetricSchema, dict[SPDev, None]] = {}
+
+    def add(self, sp_dev: SPDev) -> None:
+        """Indexes the metrics of an EoN/Device."""
+        schema = sp_dev.store.schema
+        devs = self.devices.get(schema)
+        if devs is None:
+            devs = self.devices[schema] = {}
+            for (name, slot) in schema.slots_by_name.items():
+                schemas = self.slots.get(name)
+                if schemas is None:
+                    schemas = self.slots[name] = {}
+                schemas[schema] = slot
+        devs[sp_dev] = None
+
+    def remove(self, sp_dev: SPDev) -> None:
+        """Removes the metrics of an EoN/Device from the index."""
+        schema = sp_dev.store.schema
+        devs = self.devices.get(schema)
+        if devs is None or sp_dev not in devs:
+            return
+        del devs[sp_dev]
+        if devs:
+            return
+        del self.devices[schema]
+        for name in schema.slots_by_name:
+            schemas = self.slots.get(name)
+            if schemas is not None:
+                schemas.pop(schema, None)
+                if not schemas:
+                    del self.slots[name]
+
+    def get_names(self) -> tuple[str, ...]:
+        """Returns the names of the metrics of the fleet."""
+        return tuple(self.slots)
+
+    def find(self, pattern: str, regex: bool = False) -> list[tuple[SPDev, int]]:
+        """
+        Returns the (EoN/Device, slot) of the metrics whose name matches a pattern.
+
+        A name without glob characters is looked up directly, other patterns are
+        matched against the distinct names of the fleet, not against each metric.
+
+        :param pattern: A glob pattern, or a regular expression matched against
+        the whole name if regex is True. Raises re.error if it is invalid.
+        """
+        if not regex and not any(char in pattern for char in GLOB_CHARS):
+            names: tuple[str, ...] = (pattern,)
+        else:
+            matcher = re.compile(pattern if regex else translate(pattern)).fullmatch
+            names = tuple(name for name in self.get_names() if matcher(name))
+        res = []
+        for name in names:
+            schemas = self.slots.get(name)
+            if schemas is None:
+                continue
+            for (schema, slot) in tuple(schemas.items()):
+                devs = self.devices.get(schema)
+                if devs is not None:
+                    res.extend((sp_dev, slot) for sp_dev in tuple(devs))
+        return res
@@ -0,0 +1,214 @@
+"""Compact storage of the metrics of an EoN/device."""
+from array import array
+from typing import Optional
+from weakref import WeakValueDictionary
+
+import sparkplug_b_pb2
+
+import sp_helpers
+
+# Value fields of a metric, their index is the code stored for each slot
+VALUE_FIELDS = ("int_value", "long_value", "float_value", "double_value", "boolean_value",
+                "string_value", "bytes_value", "dataset_value", "template_value",
+                "extension_value")
+FIELD_CODES = {field: code for (code, field) in enumerate(VALUE_FIELDS)}
+
+# How values are stored according to their field
+KIND_INT = 0
+KIND_FLOAT = 1
+KIND_OBJECT = 2
+_FIELD_KINDS = {
+    "int_value": KIND_INT,
+    "long_value": KIND_INT,
+    "boolean_value": KIND_INT,
+    "float_value": KIND_FLOAT,
+    "double_value": KIND_FLOAT,
+}
+FIELD_KINDS = bytes(_FIELD_KINDS.get(field, KIND_OBJECT) for field in VALUE_FIELDS)
+
+# Value fields holding a message rather than a scalar
+_MESSAGE_FIELDS = ("dataset_value", "template_value", "extension_value")
+
+
+def _get_value_field(metric) -> Optional[str]:
+    """Returns the field holding the value of a metric, or the field expected for its datatype."""
+    field = metric.WhichOneof("value")
+    if field is None:
+        field = sp_helpers.get_value_field(metric.datatype)
+    return field
+
+
+def _get_kind(field: Optional[str]) -> int:
+    """Returns how the values of a field are stored."""
+    return _FIELD_KINDS.get(field, KIND_OBJECT)
+
+
+class MetricSchema:
+    """
+    Description of the metrics of an EoN/device as received in its BIRTH.
+
+    The schema holds, for each slot, the name, alias, datatype and properties of the
+    metric, as well as where its value is stored. It is immutable so that all the
+    EoNs/devices born with the same metrics share the same schema.
+    """
+    # pylint: disable=too-many-instance-attributes
+    __interned: WeakValueDictionary = WeakValueDictionary()
+
+    def __init__(self, metrics):
+        self.names = tuple(metric.name for metric in metrics)
+        self.aliases = tuple(metric.alias if metric.HasField("alias") else None
+                             for metric in metrics)
+        self.datatypes = tuple(metric.datatype for metric in metrics)
+        self.properties = tuple(self._copy_properties(metric) for metric in metrics)
+        self.kinds = bytes(_get_kind(_get_value_field(metric)) for metric in metrics)
+        self.positions = array("I")
+        self.counts = [0, 0, 0]
+        for kind in self.kinds:
+            self.positions.append(self.counts[kind])
+            self.counts[kind] += 1
+        self.slots_by_name: dict[str, int] = {}
+        self.slots_by_alias: dict[int, int] = {}
+        # Aliases of more than one metric, only their first slot is found by alias
+        duplicate_aliases = []
+        for (slot, (name, alias)) in enumerate(zip(self.names, self.aliases)):
+            if name:
+                self.slots_by_name[name] = slot
+            if alias is not None:
+                if alias in self.slots_by_alias:
+                    duplicate_aliases.append(alias)
+                else:
+                    self.slots_by_alias[alias] = slot
+        self.duplicate_aliases = tuple(duplicate_aliases)
+
+    @staticmethod
+    def _copy_properties(metric):
+        if not metric.HasField("properties"):
+            return None
+        properties = sparkplug_b_pb2.Payload.PropertySet()
+        properties.CopyFrom(metric.properties)
+        return properties
+
+    @staticmethod
+    def get(metrics) -> "MetricSchema":
+        """Returns the schema of the given metrics, shared with identical schemas."""
+        metrics = list(metrics)
+        key = tuple((metric.name,
+                     metric.alias if metric.HasField("alias") else None,
+                     metric.datatype,
+                     _get_kind(_get_value_field(metric)),
+                     metric.properties.SerializeToString() if metric.HasField("properties")
+                     else None)
+                    for metric in metrics)
+        schema = MetricSchema.__interned.get(key)
+        if schema is None:
+            schema = MetricSchema(metrics)
+            MetricSchema.__interned[key] = schema
+        return schema
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+# pylint: disable=too-many-instance-attributes
+class MetricStore:
+    """
+    Last values of the metrics of an EoN/device.
+
+    Values are stored in typed arrays according to the schema, along with their
+    timestamp, null flag and value field. DATA updates write them in place.
+    Metric objects are only built on demand.
+    """
+
+    def __init__(self, metrics):
+        metrics = list(metrics)
+        self.schema = MetricSchema.get(metrics)
+        size = len(self.schema)
+        self.ints = array("Q", bytes(8 * self.schema.counts[KIND_INT]))
+        self.floats = array("d", bytes(8 * self.schema.counts[KIND_FLOAT]))
+        self.objects: list = [None] * self.schema.counts[KIND_OBJECT]
+        self.timestamps = array("Q", bytes(8 * size))
+        self.nulls = bytearray(size)
+        self.fields = bytearray(size)
+        for (slot, metric) in enumerate(metrics):
+            self.write(slot, metric)
+
+    def __len__(self) -> int:
+        return len(self.schema)
+
+    def write(self, slot: int, metric) -> bool:
+        """
+        Writes the value and timestamp of a metric in a slot.
+        Returns False if the value cannot be stored in the slot.
+        """
+        field = metric.WhichOneof("value")
+        if field is None or metric.is_null:
+            self.timestamps[slot] = metric.timestamp
+            self.nulls[slot] = 1
+            return True
+        code = FIELD_CODES[field]
+        kind = FIELD_KINDS[code]
+        if kind != self.schema.kinds[slot]:
+            return False
+        self.timestamps[slot] = metric.timestamp
+        self.nulls[slot] = 0
+        self.fields[slot] = code
+        pos = self.schema.positions[slot]
+        if kind == KIND_INT:
+            self.ints[pos] = getattr(metric, field)
+        elif kind == KIND_FLOAT:
+            self.floats[pos] = getattr(metric, field)
+        elif field in _MESSAGE_FIELDS:
+            value = type(getattr(metric, field))()
+            value.CopyFrom(getattr(metric, field))
+            self.objects[pos] = value
+        else:
+            self.objects[pos] = getattr(metric, field)
+        return True
+
+    def get_value(self, slot: int):
+        """Returns the raw value stored in a slot, or None if it is null."""
+        if self.nulls[slot]:
+            return None
+        kind = self.schema.kinds[slot]
+        pos = self.schema.positions[slot]
+        if kind == KIND_INT:
+            return self.ints[pos]
+        if kind == KIND_FLOAT:
+            return self.floats[pos]
+        return self.objects[pos]
+
+    def get_typed_value(self, slot: int):
+        """Returns the value stored in a slot converted to its datatype, or None if it is null."""
+        value = self.get_value(slot)
+        if value is None:
+            return None
+        return sp_helpers.convert_value(self.schema.datatypes[slot], value)
+
+    def is_numeric(self, slot: int) -> bool:
+        """Returns True if the slot holds a numeric value."""
+        return self.schema.kinds[slot] != KIND_OBJECT
+
+    def build_metric(self, slot: int, metric=None):
+        """Builds a metric object from a slot, or fills the given empty one."""
+        if metric is None:
+            metric = sparkplug_b_pb2.Payload.Metric()
+        schema = self.schema
+        metric.name = schema.names[slot]
+        if schema.aliases[slot] is not None:
+            metric.alias = schema.aliases[slot]
+        metric.datatype = schema.datatypes[slot]
+        metric.timestamp = self.timestamps[slot]
+        if schema.properties[slot] is not None:
+            metric.properties.CopyFrom(schema.properties[slot])
+        if self.nulls[slot]:
+            metric.is_null = True
+            return metric
+        field = VALUE_FIELDS[self.fields[slot]]
+        value = self.get_value(slot)
+        if field in _MESSAGE_FIELDS:
+            getattr(metric, field).CopyFrom(value)
+        elif field == "boolean_value":
+            metric.boolean_value = bool(value)
+        else:
+            setattr(metric, field, value)
+        return metric
@@ -0,0 +1,103 @@
+"""Watches of metric values evaluated as DATA messages are received."""
+import queue
+import re
+import threading
+from fnmatch import translate
+from typing import Callable, Optional
+
+from sp_dev import SPDev
+from predicate import compile_predicate
+
+# Number of triggered hooks waiting to run, beyond which hooks are dropped
+HOOK_QUEUE_SIZE = 1000
+
+
+# pylint: disable=too-many-instance-attributes
+class Watch:
+    """
+    Predicate on the metrics whose name matches a pattern, of the EoNs/devices
+    whose handle matches another pattern.
+
+    The predicate is compiled once. A watch is triggered when the value of a
+    metric starts matching it, and again only once it stopped matching.
+    The hook, if any, is called with the EoN/Device, the metric object and
+    its value each time the watch is triggered, by WatchHooks.
+    """
+
+    def __init__(self, handle_pattern: str, metric_pattern: str, expr: str,
+                 regex: bool = False, hook: Optional[Callable] = None):
+        """
+        Raises ValueError if the expression is invalid, re.error if a regular
+        expression is.
+
+        :param regex: The patterns are regular expressions matched against the
+        whole handle/name rather than glob patterns.
+        """
+        self.watch_id = 0
+        self.handle_pattern = handle_pattern
+        self.metric_pattern = metric_pattern
+        self.regex = regex
+        self.expr = expr
+        self.matches = compile_predicate(expr)
+        self.handle_matcher = re.compile(handle_pattern if regex
+                                         else translate(handle_pattern)).fullmatch
+        self.metric_matcher = re.compile(metric_pattern if regex
+                                         else translate(metric_pattern)).fullmatch
+        self.hook = hook
+        self.triggered = 0
+
+    def __str__(self):
+        return f"{self.handle_pattern} {self.metric_pattern}: {self.expr}"
+
+    def applies_to(self, sp_dev: SPDev) -> bool:
+        """Returns True if the handle of an EoN/Device matches the watch."""
+        return self.handle_matcher(sp_dev.get_handle()) is not None
+
+    def get_slots(self, sp_dev: SPDev) -> list[int]:
+        """Returns the slots of the metrics of an EoN/Device whose name matches the watch."""
+        return [slot for (name, slot) in sp_dev.store.schema.slots_by_name.items()
+                if self.metric_matcher(name)]
+
+
+class WatchHooks:
+    """
+    Runs the hooks of triggered watches in a thread of their own, so that a
+    slow hook, such as one running a command, does not delay the handling of
+    received messages. Hooks triggered while the queue is full are dropped.
+    """
+
+    def __init__(self, maxsize: int = HOOK_QUEUE_SIZE):
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def submit(self, hook: Callable, *args) -> None:
+        """Queues a call of a hook, starting the thread running them if needed."""
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait((hook, args))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        """Starts the thread running the hooks."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="enki-watch-hooks",
+                                               daemon=True)
+                self.thread.start()
+
+    def wait_empty(self) -> None:
+        """Waits until all the queued hooks have run."""
+        self.queue.join()
+
+    def _run(self) -> None:
+        while True:
+            (hook, args) = self.queue.get()
+            try:
+                hook(*args)
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"Error while running a watch hook: {err}")
+            self.queue.task_done()
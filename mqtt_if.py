@@ -2,16 +2,24 @@
 import os
 import sys
 import ssl
+import time
 import uritools
 import paho.mqtt.client as mqtt
 
+from ingest import IngestQueue, DEFAULT_QUEUE_SIZE, OVERFLOW_BLOCK
+from topic_trie import TopicTrie
+from capture import CaptureWriter
+from loopback import LoopbackClient
+
 
 MYUSERNAME = "admin"
 MYPASSWORD = "changeme"
 DEFAULT_INSECURE_MQTT_PORT = 1883
 DEFAULT_TLS_MQTT_PORT = 8883
+# Number of QoS 1 and 2 messages that may be waiting for acknowledgement, as in paho
+DEFAULT_MAX_INFLIGHT = 20
 
-# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-instance-attributes, too-many-public-methods
 class MQTTInterface:
     """MQTT Interface management."""
     __instance = None
@@ -32,14 +40,22 @@ class MQTTInterface:
         self.client_name = f"enki_{os.getpid()}"
         self.client = mqtt.Client(self.client_name, 1883, 60)
         self.client.user_data_set(self)
+        self.max_inflight = DEFAULT_MAX_INFLIGHT
+        self.client.max_inflight_messages_set(self.max_inflight)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.client.on_publish = self.on_publish
         self.client.username_pw_set(MYUSERNAME, MYPASSWORD)
         self.subscribed_topics = ["spBv1.0/#"]
         self.forwarded_topics = {}
+        self.forward_trie = TopicTrie()
         self.connect_callback = None
         self.disconnect_callback = None
         self.message_callback = None
+        self.publish_callback = None
+        self.drop_callback = None
+        self.ingest = IngestQueue(self.dispatch_message, drop_handler=self.dispatch_drop)
+        self.recorder = None
 
     def set_server(self, server, port, certificate=None):
         """Set mqtt server address and port."""
@@ -61,6 +77,26 @@ class MQTTInterface:
         host = str(uri.gethost())
         self.set_server(host, port, certificate)
 
+    def set_loopback(self):
+        """Use an in-process stand-in for the broker instead of connecting to one.
+
+        Published messages are received back when their topic is subscribed to.
+        """
+        self.server = "loopback"
+        self.port = 0
+        self.client = LoopbackClient()
+        self.client.user_data_set(self)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_publish = self.on_publish
+
+    def set_ingest_queue(self, maxsize=DEFAULT_QUEUE_SIZE, policy=OVERFLOW_BLOCK):
+        """Set the size and overflow policy of the received messages queue.
+
+        Must be called before start().
+        """
+        self.ingest = IngestQueue(self.dispatch_message, maxsize, policy, self.dispatch_drop)
+
     def get_uri(self) -> str:
         """Returns the broker's URI."""
         scheme = "mqtts" if self.mqtts else "mqtt"
@@ -83,16 +119,40 @@ class MQTTInterface:
             self.subscribed_topics.remove(topic)
 
     def publish(self, topic, byte_array, qos, retain):
-        """Publish message on topic."""
-        self.client.publish(topic, byte_array, qos, retain)
+        """Publish message on topic, returns the paho message info."""
+        return self.client.publish(topic, byte_array, qos, retain)
+
+    def set_max_inflight(self, count):
+        """Set the number of QoS 1 and 2 messages that may be waiting for acknowledgement."""
+        self.max_inflight = count
+        self.client.max_inflight_messages_set(count)
+
+    def get_max_inflight(self):
+        """Returns the number of QoS 1 and 2 messages that may be waiting for acknowledgement."""
+        return self.max_inflight
 
     def forward_topic(self, topic, q_io):
         """Forward messages received on topic to queue"""
         self.forwarded_topics[topic] = q_io
+        self.forward_trie.add(topic, q_io)
 
     def stop_forwarding(self, topic):
         """Stop forwarding messages received on topic"""
         self.forwarded_topics.pop(topic)
+        self.forward_trie.remove(topic)
+
+    def start_recording(self, path):
+        """Record all received messages to a capture file."""
+        self.stop_recording()
+        self.recorder = CaptureWriter(path)
+
+    def stop_recording(self):
+        """Stop recording received messages and close the capture file."""
+        recorder = self.recorder
+        if recorder is not None:
+            self.recorder = None
+            recorder.close()
+        return recorder
 
     @staticmethod
     def on_connect(client, userdata, _flags, ret):
@@ -111,21 +171,47 @@ class MQTTInterface:
 
     @staticmethod
     def on_message(_client, userdata, msg):
-        """The callback for when a PUBLISH message is received from the server."""
-        if userdata.message_callback:
-            userdata.message_callback(userdata, msg)
+        """The callback for when a PUBLISH message is received from the server.
 
-        for (topic, q_io) in userdata.forwarded_topics.items():
-            if mqtt.topic_matches_sub(topic, msg.topic):
+        The message is queued to be handled by the ingest worker thread so that
+        the network loop is never stalled by message handling.
+        The raw message is also written to the capture file when recording.
+        """
+        recorder = userdata.recorder
+        if recorder is not None:
+            recorder.write(time.time_ns(), msg.topic, msg.payload)
+        userdata.ingest.put(msg)
+
+    @staticmethod
+    def on_publish(_client, userdata, mid):
+        """The callback for when a message was sent (QoS 0) or acknowledged (QoS 1 and 2)."""
+        if userdata.publish_callback is not None:
+            userdata.publish_callback(mid)
+
+    def dispatch_message(self, msg):
+        """Hands a received message to the message callback and forwarded queues."""
+        if self.message_callback:
+            self.message_callback(self, msg)
+
+        if self.forwarded_topics:
+            for q_io in self.forward_trie.match(msg.topic):
                 q_io.put(msg)
 
+    def dispatch_drop(self, msg):
+        """Hands a received message discarded because the queue was full to the drop callback."""
+        if self.drop_callback:
+            self.drop_callback(self, msg)
+
     def join(self, _timeout=None):
         """Wait for the MQTT loop to stop."""
         self.client.loop_stop()
+        self.ingest.stop()
+        self.stop_recording()
         MQTTInterface.__instance = None
 
     def start(self):
         """Connect to the broker and start mqtt loop."""
+        self.ingest.start()
         self.client.connect(self.server, self.port, 60)
         self.client.loop_start()
 
@@ -133,3 +219,4 @@ class MQTTInterface:
         """Stop loop and disconnect from the broker."""
         self.client.loop_stop()
         self.client.disconnect()
+        self.ingest.stop()
@@ -0,0 +1,154 @@
+"""
+Sparkplug payloads encoded once and sent repeatedly.
+
+A protobuf message is encoded as the concatenation of its fields, so a payload
+is sent as its timestamp field, the metrics encoded beforehand and its seq
+field. Only the metrics whose value changed are encoded again. Fields are
+written in the order of their number, as protobuf does, so that the payload is
+the same as the one SerializeToString() would return.
+"""
+import time
+from typing import Optional
+
+import sparkplug_b_pb2
+
+import sp_helpers
+
+# Protobuf wire types
+WIRE_VARINT = 0
+WIRE_LEN = 2
+
+# Field numbers of the Payload message
+PAYLOAD_TIMESTAMP = 1
+PAYLOAD_METRICS = 2
+PAYLOAD_SEQ = 3
+# Field number of the timestamp of the Metric message
+METRIC_TIMESTAMP = 3
+
+
+def encode_varint(value: int) -> bytes:
+    """Returns the protobuf varint encoding of an unsigned integer."""
+    res = bytearray()
+    while value > 0x7f:
+        res.append((value & 0x7f) | 0x80)
+        value >>= 7
+    res.append(value)
+    return bytes(res)
+
+
+def encode_key(field: int, wire_type: int) -> bytes:
+    """Returns the protobuf key of a field."""
+    return encode_varint((field << 3) | wire_type)
+
+
+_PAYLOAD_TIMESTAMP_KEY = encode_key(PAYLOAD_TIMESTAMP, WIRE_VARINT)
+_PAYLOAD_METRICS_KEY = encode_key(PAYLOAD_METRICS, WIRE_LEN)
+_PAYLOAD_SEQ_KEY = encode_key(PAYLOAD_SEQ, WIRE_VARINT)
+_METRIC_TIMESTAMP_KEY = encode_key(METRIC_TIMESTAMP, WIRE_VARINT)
+
+
+def _encode_metric(metric) -> tuple[bytes, bytes]:
+    """
+    Returns the encodings of the fields of a metric without timestamp before
+    and after the place of its timestamp.
+    """
+    head = sparkplug_b_pb2.Payload.Metric()
+    if metric.HasField("name"):
+        head.name = metric.name
+    if metric.HasField("alias"):
+        head.alias = metric.alias
+    encoded_head = head.SerializeToString()
+    return (encoded_head, metric.SerializeToString()[len(encoded_head):])
+
+
+class PayloadTemplate:
+    """
+    Metrics of a payload encoded once.
+
+    Metric timestamps are not part of the encoded metrics, they are set to the
+    payload timestamp when encoding the payload if metric_timestamps is True.
+    Each metric is encoded as the fields before its timestamp, i.e. its name
+    and alias, and the fields after it.
+    """
+
+    def __init__(self, metrics, metric_timestamps: bool = True):
+        self.metrics = []
+        self.encoded = []
+        self.metric_timestamps = metric_timestamps
+        for metric in metrics:
+            copy = sparkplug_b_pb2.Payload.Metric()
+            copy.CopyFrom(metric)
+            copy.ClearField("timestamp")
+            self.metrics.append(copy)
+            self.encoded.append(_encode_metric(copy))
+        self.encoded_metrics: Optional[bytes] = None
+        self.joints: Optional[tuple[int, list[bytes]]] = None
+
+    @staticmethod
+    def from_payload(payload, metric_timestamps: bool = True) -> "PayloadTemplate":
+        """Creates a template from the metrics of a payload."""
+        return PayloadTemplate(payload.metrics, metric_timestamps)
+
+    def __len__(self) -> int:
+        return len(self.metrics)
+
+    def find_metric(self, name: str) -> Optional[int]:
+        """Returns the index of the metric with the given name, None if there is none."""
+        for (idx, metric) in enumerate(self.metrics):
+            if metric.name == name:
+                return idx
+        return None
+
+    def set_value(self, idx: int, value) -> None:
+        """Changes the value of a metric, only this metric is encoded again."""
+        metric = self.metrics[idx]
+        sp_helpers.set_typed_value(metric.datatype, metric, value)
+        head = self.encoded[idx][0]
+        self.encoded[idx] = (head, metric.SerializeToString()[len(head):])
+        self.encoded_metrics = None
+        self.joints = None
+
+    def encode(self, timestamp: Optional[int] = None, seq: Optional[int] = None) -> bytes:
+        """
+        Returns the encoded payload.
+
+        :param timestamp: Payload timestamp in ms, the current time if None.
+        :param seq: Sequence number of the payload, no sequence number if None.
+        """
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        res = _PAYLOAD_TIMESTAMP_KEY + encode_varint(timestamp)
+        seq_field = _PAYLOAD_SEQ_KEY + encode_varint(seq) if seq is not None else b""
+        if not self.metric_timestamps:
+            if self.encoded_metrics is None:
+                self.encoded_metrics = b"".join(
+                    _PAYLOAD_METRICS_KEY + encode_varint(len(head) + len(tail)) + head + tail
+                    for (head, tail) in self.encoded)
+            return res + self.encoded_metrics + seq_field
+        metric_timestamp = _METRIC_TIMESTAMP_KEY + encode_varint(timestamp)
+        joints = self._get_joints(len(metric_timestamp))
+        return res + metric_timestamp.join(joints) + seq_field
+
+    def _get_joints(self, timestamp_size: int) -> list[bytes]:
+        """
+        Returns the encoded metrics split around their timestamp field, given
+        the size of this field: the head of the first metric, the tail of each
+        metric followed by the head of the next one, and the tail of the last one.
+        """
+        if self.joints is None or self.joints[0] != timestamp_size:
+            joints = []
+            prev_tail = b""
+            for (head, tail) in self.encoded:
+                joints.append(prev_tail + _PAYLOAD_METRICS_KEY
+                              + encode_varint(len(head) + timestamp_size + len(tail)) + head)
+                prev_tail = tail
+            joints.append(prev_tail)
+            self.joints = (timestamp_size, joints)
+        return self.joints[1]
+
+    def to_payload(self, timestamp: Optional[int] = None,
+                   seq: Optional[int] = None) -> sparkplug_b_pb2.Payload:
+        """Returns the payload as a protobuf message."""
+        payload = sparkplug_b_pb2.Payload()
+        payload.ParseFromString(self.encode(timestamp, seq))
+        return payload
@@ -0,0 +1,92 @@
+"""
+Predicates on metric values, written as Python expressions of 'value'.
+
+Expressions are parsed and only made of comparisons, boolean and arithmetic
+operators, literals and a few functions, so that they cannot run arbitrary
+code. They are compiled once into a function. Multiplications only apply to
+numbers: repeating a sequence, e.g. a string value, could take any amount of
+memory.
+"""
+import ast
+from typing import Any, Callable
+
+# Name of the value in expressions
+VALUE_NAME = "value"
+
+# Functions that expressions may call
+FUNCTIONS = {"abs": abs, "min": min, "max": max, "round": round, "len": len}
+
+# Name of the function multiplications are replaced with, not allowed in expressions
+_MULTIPLY_NAME = "__multiply"
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    ast.Is, ast.IsNot, ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.IfExp, ast.Constant, ast.Name, ast.Load, ast.Tuple, ast.List, ast.Call,
+)
+
+# Errors raised by an expression on a value it does not apply to, e.g. a string
+# compared to a number
+EVALUATION_ERRORS = (TypeError, ValueError, ArithmeticError)
+
+
+def _check(tree: ast.AST) -> None:
+    """Raises ValueError if an expression holds anything else than the allowed nodes."""
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"'{type(node).__name__}' is not allowed")
+        if isinstance(node, ast.Name) and node.id != VALUE_NAME and node.id not in FUNCTIONS:
+            raise ValueError(f"unknown name '{node.id}'")
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name)
+                                           or node.func.id not in FUNCTIONS or node.keywords):
+            raise ValueError(f"only {', '.join(FUNCTIONS)} may be called")
+
+
+def _multiply(left, right):
+    """Multiplies two numbers, raises TypeError for anything else."""
+    if not isinstance(left, (int, float)) or not isinstance(right, (int, float)):
+        raise TypeError("only numbers can be multiplied")
+    return left * right
+
+
+class _MultiplyTransformer(ast.NodeTransformer):
+    """Replaces the multiplications of an expression with calls to _multiply()."""
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:  # pylint: disable=invalid-name
+        """Replaces a multiplication."""
+        self.generic_visit(node)
+        if not isinstance(node.op, ast.Mult):
+            return node
+        return ast.Call(func=ast.Name(id=_MULTIPLY_NAME, ctx=ast.Load()),
+                        args=[node.left, node.right], keywords=[])
+
+
+def compile_predicate(expr: str) -> Callable[[Any], bool]:
+    """
+    Compiles an expression of 'value' into a function returning whether a value
+    matches it. Values the expression does not apply to do not match.
+    Raises ValueError if the expression is invalid.
+
+    :param expr: The expression, e.g. "value > 10 and value != 42".
+    """
+    try:
+        tree = ast.parse(expr.strip(), mode="eval")
+    except SyntaxError as err:
+        raise ValueError(f"invalid expression: {err.msg}") from err
+    _check(tree)
+    body = _MultiplyTransformer().visit(tree.body)
+    args = ast.arguments(posonlyargs=[], args=[ast.arg(arg=VALUE_NAME)], kwonlyargs=[],
+                         kw_defaults=[], defaults=[])
+    lambda_tree = ast.Expression(body=ast.Lambda(args=args, body=body))
+    ast.fix_missing_locations(lambda_tree)
+    # pylint: disable=eval-used
+    func = eval(compile(lambda_tree, "<predicate>", "eval"),
+                {"__builtins__": {}, _MULTIPLY_NAME: _multiply, **FUNCTIONS})
+
+    def matches(value) -> bool:
+        try:
+            return bool(func(value))
+        except EVALUATION_ERRORS:
+            return False
+    return matches
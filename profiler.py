@@ -0,0 +1,131 @@
+"""On-demand profiling of the handling of received messages."""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from typing import Optional
+
+from ingest import IngestQueue
+
+# Interval between two samples of the stack of the worker thread, in seconds
+DEFAULT_SAMPLING_INTERVAL = 0.001
+# Number of functions in the summary
+DEFAULT_TOP = 20
+# Ratio between the sampling interval and the thread switch interval while sampling
+SWITCH_INTERVAL_RATIO = 20
+# Orders of the functions in the summary of a deterministic profile
+SORT_KEYS = ["tottime", "cumulative", "ncalls"]
+
+
+def _get_frame_label(code) -> str:
+    """Returns the label of a function in a collapsed stack."""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class IngestProfiler:  # pylint: disable=too-many-instance-attributes
+    """
+    Profiles the ingest worker thread, which handles the received messages,
+    while the other threads keep running unprofiled.
+
+    The profiling is either deterministic, every message being handled under
+    cProfile, or done by sampling the stack of the worker thread at regular
+    intervals, which costs less to the worker. Deterministic profiles are
+    written as pstats files and sampled profiles as collapsed stacks, as used
+    by flame graph tools.
+
+    While sampling, the interpreter switches threads more often so that the
+    sampler does not wait for the worker to release the GIL, which would
+    only let it see the worker waiting for messages.
+    """
+
+    def __init__(self, ingest: IngestQueue, sampling: bool = False,
+                 interval: float = DEFAULT_SAMPLING_INTERVAL):
+        self.ingest = ingest
+        self.sampling = sampling
+        self.interval = interval
+        self.profile: Optional[cProfile.Profile] = None
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.sampler: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.switch_interval = sys.getswitchinterval()
+
+    def start(self) -> None:
+        """Starts profiling. Raises RuntimeError if the worker thread is not started."""
+        thread_id = self.ingest.get_thread_id()
+        if thread_id is None:
+            raise RuntimeError("the ingest worker thread is not started")
+        if self.sampling:
+            self.switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(self.switch_interval,
+                                      self.interval / SWITCH_INTERVAL_RATIO))
+            self.sampler = threading.Thread(target=self._sample, args=(thread_id,),
+                                            name="enki-profiler", daemon=True)
+            self.sampler.start()
+        else:
+            self.profile = cProfile.Profile()
+            self.ingest.set_profiler(self.profile)
+
+    def stop(self) -> None:
+        """Stops profiling."""
+        if self.sampler is not None:
+            self.stop_event.set()
+            self.sampler.join()
+            self.sampler = None
+            sys.setswitchinterval(self.switch_interval)
+        else:
+            self.ingest.set_profiler(None)
+
+    def _sample(self, thread_id: int) -> None:
+        """
+        Samples the stack of the worker thread, from the message handler down.
+        Samples taken while the worker waits for messages are only counted.
+        """
+        handler_code = self.ingest.handler.__code__
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)  # pylint: disable=protected-access
+            if frame is None:
+                continue
+            self.samples += 1
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                if frame.f_code is handler_code:
+                    self.stacks[tuple(reversed(stack))] += 1
+                    break
+                frame = frame.f_back
+
+    def write(self, path: str) -> None:
+        """Writes the profile to a pstats file, or a collapsed stacks file when sampling."""
+        if not self.sampling:
+            self.profile.dump_stats(path)
+            return
+        with open(path, "w", encoding="utf-8") as file:
+            for (stack, count) in self.stacks.items():
+                file.write(";".join(_get_frame_label(code) for code in stack) + f" {count}\n")
+
+    def get_summary(self, top: int = DEFAULT_TOP, sort: str = SORT_KEYS[0]) -> str:
+        """
+        Returns the hottest functions: sorted by the given key for a deterministic
+        profile, or by the number of samples in which they were running when sampling.
+        """
+        if not self.sampling:
+            if not self.profile.getstats():
+                return "No message handled while profiling"
+            output = io.StringIO()
+            stats = pstats.Stats(self.profile, stream=output)
+            stats.sort_stats(sort).print_stats(top)
+            return output.getvalue()
+        leaves: Counter = Counter()
+        for (stack, count) in self.stacks.items():
+            leaves[stack[-1]] += count
+        busy = sum(leaves.values())
+        res = f"{self.samples} samples every {self.interval * 1000:g}ms, "
+        res += f"{busy} while handling messages"
+        res += f"\n{'samples':>8} {'%':>6}  function"
+        for (code, count) in leaves.most_common(top):
+            res += f"\n{count:8} {100 * count / busy:6.1f}  {_get_frame_label(code)}"
+        return res
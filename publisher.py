@@ -0,0 +1,152 @@
+"""Bulk publishing of messages with tracking of their acknowledgement."""
+import threading
+from collections import Counter
+import time
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+
+from mqtt_if import MQTTInterface
+
+# Time to wait for the acknowledgement of the last messages, in seconds
+DEFAULT_ACK_TIMEOUT = 10.0
+
+
+class PublishReport:
+    """Statistics about published messages."""
+
+    def __init__(self, sent: int, failed: list[str], latencies: list[int],
+                 timed_out: list[str], duration: float):
+        self.sent = sent
+        self.failed = failed
+        self.latencies = sorted(latencies)
+        self.timed_out = timed_out
+        self.duration = duration
+
+    def get_rate(self) -> float:
+        """Returns the number of messages sent per second."""
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def get_latency(self, quantile: float) -> float:
+        """Returns a quantile of the acknowledgement latencies, in ms."""
+        if not self.latencies:
+            return 0.0
+        idx = min(int(quantile * len(self.latencies)), len(self.latencies) - 1)
+        return self.latencies[idx] / 1e6
+
+    def __str__(self) -> str:
+        res = f"Sent {self.sent} messages in {self.duration:.3f}s: {self.get_rate():.0f} msg/s"
+        res += f"\n\t{len(self.latencies)} acked, {len(self.failed)} failed, "
+        res += f"{len(self.timed_out)} timed out"
+        if self.latencies:
+            mean = sum(self.latencies) / len(self.latencies) / 1e6
+            res += f"\n\tack latency: min {self.get_latency(0):.3f}ms, mean {mean:.3f}ms, "
+            res += f"p50 {self.get_latency(.5):.3f}ms, p99 {self.get_latency(.99):.3f}ms, "
+            res += f"max {self.get_latency(1):.3f}ms"
+        for (status, topics) in (("failed", self.failed), ("timed out", self.timed_out)):
+            for (topic, count) in Counter(topics).items():
+                res += f"\n\t{status}: {topic}" + (f" ({count} messages)" if count > 1 else "")
+        return res
+
+
+# pylint: disable=too-many-instance-attributes
+class Publisher:
+    """
+    Publishes messages at a limited rate and measures the time until each of
+    them is acknowledged by the broker, or written to the network for QoS 0.
+
+    With a window, publishing waits while that many messages are waiting for
+    their acknowledgement, so that messages are pipelined without flooding the
+    broker. The maximum number of messages in flight of the MQTT client is set
+    to the window until finish() is called.
+    """
+
+    def __init__(self, mqtt_if: MQTTInterface, qos: int = 0, rate: Optional[float] = None,
+                 window: Optional[int] = None, timeout: float = DEFAULT_ACK_TIMEOUT):
+        self.mqtt_if = mqtt_if
+        self.qos = qos
+        self.rate = rate
+        self.window = window
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.acked = threading.Condition(self.lock)
+        self.sent_times: dict[int, int] = {}
+        self.topics: dict[int, str] = {}
+        # Acknowledgements received before publish() returned the message Id
+        self.early_acks: dict[int, int] = {}
+        self.latencies: list[int] = []
+        self.sent = 0
+        self.failed: list[str] = []
+        self.start = None
+        self.previous_max_inflight: Optional[int] = None
+
+    def on_publish(self, mid: int) -> None:
+        """Accounts for the acknowledgement of a message, called from the network thread."""
+        now = time.perf_counter_ns()
+        with self.lock:
+            sent_time = self.sent_times.pop(mid, None)
+            if sent_time is None:
+                self.early_acks[mid] = now
+            else:
+                self.topics.pop(mid, None)
+                self.latencies.append(now - sent_time)
+                self.acked.notify_all()
+
+    def publish(self, topic: str, payload: bytes) -> None:
+        """Publishes a message, waiting as needed to keep to the rate."""
+        if self.start is None:
+            self.start = time.monotonic()
+            self.mqtt_if.publish_callback = self.on_publish
+            if self.window is not None:
+                self.previous_max_inflight = self.mqtt_if.get_max_inflight()
+                self.mqtt_if.set_max_inflight(self.window)
+        if self.window is not None:
+            self.wait_in_flight(self.window - 1, self.timeout)
+        if self.rate is not None:
+            delay = self.start + self.sent / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        sent_time = time.perf_counter_ns()
+        info = self.mqtt_if.publish(topic, payload, self.qos, False)
+        self.sent += 1
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.failed.append(topic)
+            return
+        with self.lock:
+            ack_time = self.early_acks.pop(info.mid, None)
+            if ack_time is None:
+                self.sent_times[info.mid] = sent_time
+                self.topics[info.mid] = topic
+            else:
+                self.latencies.append(ack_time - sent_time)
+
+    def get_in_flight(self) -> int:
+        """Returns the number of messages waiting for their acknowledgement."""
+        with self.lock:
+            return len(self.sent_times)
+
+    def wait_in_flight(self, limit: int, timeout: float) -> bool:
+        """
+        Waits until at most limit messages are waiting for their acknowledgement.
+        Returns False on timeout.
+        """
+        with self.lock:
+            return self.acked.wait_for(lambda: len(self.sent_times) <= limit, timeout)
+
+    def finish(self) -> PublishReport:
+        """
+        Waits for the pending acknowledgements and returns the statistics,
+        along with the topics of the messages that failed or timed out.
+        The MQTT client is restored as it was before the first message.
+        """
+        self.wait_in_flight(0, self.timeout)
+        duration = time.monotonic() - self.start if self.start is not None else 0.0
+        self.mqtt_if.publish_callback = None
+        if self.previous_max_inflight is not None:
+            self.mqtt_if.set_max_inflight(self.previous_max_inflight)
+            self.previous_max_inflight = None
+        with self.lock:
+            # Acknowledgements of messages published by others meanwhile
+            self.early_acks.clear()
+            return PublishReport(self.sent, self.failed, self.latencies,
+                                 list(self.topics.values()), duration)
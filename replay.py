@@ -0,0 +1,93 @@
+"""Replay of recorded captures through the normal handling of received messages."""
+import time
+from typing import Optional
+
+from capture import CaptureReader
+from ingest_stats import IngestStats, STAGES
+from mqtt_if import MQTTInterface
+
+
+class ReplayMessage:  # pylint: disable=too-few-public-methods
+    """Message read from a capture, with the attributes of a received MQTT message."""
+    __slots__ = ("timestamp", "topic", "payload", "qos", "retain")
+
+    def __init__(self, timestamp: int, topic: str, payload: bytes):
+        self.timestamp = timestamp
+        self.topic = topic
+        self.payload = payload
+        self.qos = 0
+        self.retain = False
+
+
+class ReplayReport:
+    """Throughput and time spent per stage during a replay."""
+
+    def __init__(self, messages: int, size: int, duration: float, dropped: int,
+                 stage_times: dict[str, tuple[int, int]]):
+        self.messages = messages
+        self.size = size
+        self.duration = duration
+        self.dropped = dropped
+        self.stage_times = stage_times
+
+    def get_rate(self) -> float:
+        """Returns the number of messages handled per second."""
+        return self.messages / self.duration if self.duration > 0 else 0.0
+
+    def __str__(self) -> str:
+        res = f"Replayed {self.messages} messages ({self.size} bytes) in {self.duration:.3f}s: "
+        res += f"{self.get_rate():.0f} msg/s"
+        if self.dropped:
+            res += f", {self.dropped} dropped"
+        for stage in STAGES:
+            (total, count) = self.stage_times[stage]
+            mean = total / count / 1000 if count else 0
+            res += f"\n\t{stage}: {total / 1e9:.3f}s total, {mean:.1f}us mean over {count}"
+        return res
+
+
+def _feed(path: str, mqtt_if: MQTTInterface, speed: Optional[float]) -> tuple[int, int]:
+    """Feeds the records of a capture, returns the number of messages and their size."""
+    messages = 0
+    size = 0
+    start = time.monotonic()
+    with CaptureReader(path) as reader:
+        first_timestamp = None
+        try:
+            for (timestamp, topic, payload) in reader.iter_records():
+                if speed is not None:
+                    if first_timestamp is None:
+                        first_timestamp = timestamp
+                    delay = (timestamp - first_timestamp) / 1e9 / speed
+                    delay -= time.monotonic() - start
+                    if delay > 0:
+                        time.sleep(delay)
+                MQTTInterface.on_message(None, mqtt_if,
+                                         ReplayMessage(timestamp, topic, payload))
+                messages += 1
+                size += len(payload)
+        except KeyboardInterrupt:
+            print("Replay interrupted")
+    return (messages, size)
+
+
+def replay(path: str, mqtt_if: MQTTInterface, speed: Optional[float] = 1.0) -> ReplayReport:
+    """
+    Feeds the records of a capture to the MQTT interface as if they were received.
+
+    Records are streamed from the capture and go through the ingest queue and the
+    message callback like live traffic.
+
+    :param speed: Replay speed relative to the original pacing, None to replay as
+    fast as possible.
+    """
+    stats = IngestStats()
+    stages_before = stats.get_stage_times()
+    dropped_before = mqtt_if.ingest.dropped
+    mqtt_if.ingest.start()
+    start = time.monotonic()
+    (messages, size) = _feed(path, mqtt_if, speed)
+    mqtt_if.ingest.wait_empty()
+    duration = time.monotonic() - start
+    return ReplayReport(messages, size, duration, mqtt_if.ingest.dropped - dropped_before,
+                        stats.diff_stage_times(stats.get_stage_times(), stages_before))
@@ -1,7 +1,12 @@
 """Enki shell interface."""
+import itertools
+import re
 import time
+import threading
 from datetime import datetime, timezone
-from string import printable
+import os
+import subprocess
+import sys
 
 import cmd2
 
@@ -10,9 +15,24 @@ from sparkplug_b import MetricDataType, addMetric, addNullMetric, initDatasetMet
 
 import sp_helpers
 from sp_helpers import MsgType
+from bytes_format import iter_list, iter_hexdump
+from sp_dataset import DataSetColumns
 from mqtt_if import MQTTInterface
+from ingest import OVERFLOW_POLICIES
+from ingest_stats import IngestStats, STAGES, COUNTERS, COUNTER_RECEIVED
+from ingest_filter import IngestFilter, FilterRule, FILTER_ACTIONS
 from sp_dev import SPDev
-from sp_network import SPNet
+from sp_topic import SPTopic
+from metric_history import DEFAULT_HISTORY_SIZE, DEFAULT_HISTORY_BUDGET
+from replay import replay
+from exporter import Exporter, DEFAULT_EXPORTER_ADDRESS, DEFAULT_EXPORTER_PORT
+from profiler import IngestProfiler, DEFAULT_SAMPLING_INTERVAL, DEFAULT_TOP, SORT_KEYS
+from simulator import Simulator, DEFAULT_SIM_GROUP
+from payload_template import PayloadTemplate
+from publisher import Publisher
+from predicate import compile_predicate
+from metric_watch import Watch
+from sp_network import SPNet, NOTIFY_EACH, NOTIFY_COALESCED, NOTIFY_MODES
 
 
 # Setting values for displaying of byte data
@@ -22,6 +42,16 @@ BYTE_DATA_DISPLAY_MODE = BYTE_DATA_DISPLAY_LIST
 BYTE_DATA_SHORT_LEN = 10
 BYTE_DATA_MAX_LEN = BYTE_DATA_SHORT_LEN
 
+# Number of dataset rows formatted at once
+DATASET_CHUNK_ROWS = 1000
+
+# Setting values for notification of metric updates
+METRIC_UPDATE_MODE = NOTIFY_EACH
+METRIC_REFRESH_RATE = 5.0
+
+# Maximum number of messages waiting for their acknowledgement when sending to several targets
+SEND_WINDOW = 100
+
 
 def str_to_int(string):
     """Convert string to int.
@@ -47,84 +77,112 @@ def str_to_bool(string):
     return False
 
 
+def str_to_value(datatype, string):
+    """Convert a user string to a value of the given datatype
+
+    Returns None if the datatype is not supported
+    """
+    if datatype in sp_helpers.boolean_value_types:
+        return str_to_bool(string)
+    if datatype in sp_helpers.int_value_types + sp_helpers.long_value_types:
+        return str_to_int(string)
+    if datatype in sp_helpers.float_value_types + sp_helpers.double_value_types:
+        return float(string)
+    if datatype in sp_helpers.string_value_types:
+        return string
+    return None
+
+
 def bytes_to_list_str(byte_data) -> str:
     """Converts an iterable containing bytes to a string representation, using a list format"""
-    size = len(byte_data)
-    if BYTE_DATA_MAX_LEN:
-        byte_data = byte_data[0:BYTE_DATA_MAX_LEN]
-    res = "[" + " ,".join([f"0x{val:02X}" for val in byte_data])
-    if BYTE_DATA_MAX_LEN and size > BYTE_DATA_MAX_LEN:
-        res += " ..."
-    res += "]"
-    return res
+    return "".join(iter_list(byte_data, BYTE_DATA_MAX_LEN))
 
 def bytes_to_hexdump_str(byte_data) -> str:
     """
     Converts an iterable containing bytes to a string representation
     using a hexadecimal dump format
     """
-    offset = 0
-    size = len(byte_data)
-    if BYTE_DATA_MAX_LEN != 0 and BYTE_DATA_MAX_LEN < size:
-        size = BYTE_DATA_MAX_LEN
-    processed = 0
-    res = ""
-    while processed < size:
-        block_size = 16 if size - processed >= 16 else size - processed
-        block = byte_data[offset:offset+block_size]
-        block_str = [f"{b:02X}" for b in block]
-        pairs = zip(block_str[0::2], block_str[1::2])
-        block_str = " ".join(p[0] + p[1] for p in pairs)
-        if block_size % 2 == 1:
-            if block_size > 1:
-                block_str += " "
-            block_str += f"{block[-1]:02X}"
-        block_ascii = "".join(chr(c) if chr(c) in printable else "." for c in block)
-        if res:
-            res += "\n"
-        res += f"{offset:08X}: {block_str:39}  {block_ascii}"
-        offset += block_size
-        processed += block_size
-    return res
+    return "".join(iter_hexdump(byte_data, BYTE_DATA_MAX_LEN))
 
 
-def get_bytearray_str(bytes_array):
-    """String representation of a bytearray value."""
+def iter_bytearray_str(bytes_array):
+    """Yields the string representation of a bytearray value in chunks."""
     size = len(bytes_array)
-    res = f"Bytes array of length {size}"
+    yield f"Bytes array of length {size}"
     if size:
+        yield ":\n"
         if BYTE_DATA_DISPLAY_MODE == BYTE_DATA_DISPLAY_LIST:
-            res += ":\n" + bytes_to_list_str(bytes_array) + "\n"
+            yield from iter_list(bytes_array, BYTE_DATA_MAX_LEN)
         else:
-            res += ":\n" + bytes_to_hexdump_str(bytes_array) + "\n"
-    return res
+            yield from iter_hexdump(bytes_array, BYTE_DATA_MAX_LEN)
+        yield "\n"
+
+
+def get_bytearray_str(bytes_array):
+    """String representation of a bytearray value."""
+    return "".join(iter_bytearray_str(bytes_array))
+
 
+def _get_cell_str(formatter, value) -> str:
+    """String representation of a DataSet cell."""
+    return "<Null>" if value is None else formatter(value)
+
+
+def iter_dataset_str(dataset):
+    """
+    Yields the string representation of a dataset value in chunks of rows,
+    with the values of each column aligned.
+
+    Column widths are computed in a first pass over the values, then rows are
+    formatted chunk by chunk so that only one chunk is held in memory.
+    """
+    columns = DataSetColumns(dataset)
+    yield f"Dataset {len(columns)}x{len(columns.types)}:"
+    headers = [f"{name}({sp_helpers.datatype_to_str(col_type)})"
+               for (name, col_type) in zip(columns.names, columns.types)]
+    formatters = [sp_helpers.string_value_converter
+                  if col_type in sp_helpers.string_value_types else str
+                  for col_type in columns.types]
+    # Numbers are right aligned, other values left aligned
+    numeric_types = (sp_helpers.int_value_types + sp_helpers.long_value_types
+                     + sp_helpers.float_value_types + sp_helpers.double_value_types)
+    aligners = [str.rjust if col_type in numeric_types else str.ljust
+                for col_type in columns.types]
+    widths = [max(len(header), max((len(_get_cell_str(formatter, value))
+                                    for value in columns.iter_column(idx)), default=0))
+              for (idx, (header, formatter)) in enumerate(zip(headers, formatters))]
+    yield "\n\t\t" + "  ".join(header.ljust(width)
+                              for (header, width) in zip(headers, widths)).rstrip()
+    rows = columns.iter_rows()
+    cell_formats = list(zip(formatters, aligners, widths))
+    while True:
+        chunk = list(itertools.islice(rows, DATASET_CHUNK_ROWS))
+        if not chunk:
+            return
+        yield "".join("\n\t\t" + "  ".join(aligner(_get_cell_str(formatter, value), width)
+                                          for ((formatter, aligner, width), value)
+                                          in zip(cell_formats, row)).rstrip()
+                      for row in chunk)
 
-def get_dataset_row_str(dataset, row):
-    """String representation of a dataset row."""
-    return tuple(get_typed_value_str(col_type, row.elements[idx])
-                 for (idx, col_type) in enumerate(dataset.types))
 
 def get_dataset_str(dataset):
     """String representation of a dataset value."""
-    columns = [f"{col}({sp_helpers.datatype_to_str(col_type)})"
-               for (col, col_type)
-               in zip(dataset.columns, dataset.types)]
-    rows = [get_dataset_row_str(dataset, row) for row in dataset.rows]
-    res = f"Dataset {len(dataset.rows)}x{len(dataset.types)}:\n"
-    res += f"\t\tColumns: {columns}\n"
-    res += f"\t\tRows: {rows}"
-    return res
+    return "".join(iter_dataset_str(dataset))
+
+def iter_typed_value_str(datatype, container):
+    """Yields the string representation of a metric/property's value in chunks."""
+    if hasattr(container, "is_null") and container.is_null:
+        yield "<Null>"
+    elif datatype in sp_helpers.bytes_value_types:
+        yield from iter_bytearray_str(container.bytes_value)
+    elif datatype == MetricDataType.DataSet:
+        yield from iter_dataset_str(container.dataset_value)
+    else:
+        yield str(sp_helpers.get_typed_value(datatype, container))
 
 def get_typed_value_str(datatype, container):
     """String representation of a metric/property's value."""
-    if hasattr(container, "is_null") and container.is_null:
-        return "<Null>"
-    if datatype == MetricDataType.Bytes:
-        return get_bytearray_str(container.bytes_value)
-    if datatype == MetricDataType.DataSet:
-        return get_dataset_str(container.dataset_value)
-    return str(sp_helpers.get_typed_value(datatype, container))
+    return "".join(iter_typed_value_str(datatype, container))
 
 def get_property_value_str(prop):
     """String representation of a property."""
@@ -160,11 +218,27 @@ def get_common_info_str(metric):
     return res
 
 
+def iter_metric_str(metric):
+    """Yields a string describing metric in chunks"""
+    yield f"{metric.name}[{metric.alias}]:\n{get_common_info_str(metric)}\n\tvalue: "
+    yield from iter_typed_value_str(metric.datatype, metric)
+    yield "\n"
+
+
 def get_metric_str(metric) -> str:
     """Return a string describing metric if it is known to Device"""
-    value_str: str = get_typed_value_str(metric.datatype, metric)
-    common = get_common_info_str(metric)
-    return f"{metric.name}[{metric.alias}]:\n{common}\n\tvalue: {value_str}\n"
+    return "".join(iter_metric_str(metric))
+
+
+def get_short_value_str(datatype, value) -> str:
+    """One line representation of a typed value, only naming the datatype of non scalar values."""
+    if value is None:
+        return "<Null>"
+    if isinstance(value, str):
+        return sp_helpers.string_value_converter(value)
+    if isinstance(value, (bool, int, float)):
+        return str(value)
+    return f"<{sp_helpers.datatype_to_str(datatype)}>"
 
 
 @cmd2.with_default_category('Enki')
@@ -188,6 +262,43 @@ class SPShell(cmd2.Cmd):
                           "Maximum number of bytes to display for byte data",
                           self, onchange_cb=self._on_change_byte_data_max_len)
         )
+        self.metric_update_mode = METRIC_UPDATE_MODE
+        self.add_settable(
+            cmd2.Settable("metric_update_mode", str,
+                          "Print each metric update or a coalesced summary of updates", self,
+                          choices=NOTIFY_MODES, onchange_cb=self._on_change_metric_update_mode)
+        )
+        self.metric_refresh_rate = METRIC_REFRESH_RATE
+        self.add_settable(
+            cmd2.Settable("metric_refresh_rate", float,
+                          "Number of coalesced summaries of metric updates printed per second",
+                          self, onchange_cb=self._on_change_metric_refresh_rate)
+        )
+        self.refresh_thread = None
+        self.refresh_stop = threading.Event()
+        self.templates: dict[str, tuple[MsgType, str, PayloadTemplate]] = {}
+        # Time and received message counts of the previous "stats" command
+        self.stats_sample = None
+        self.profiler = None
+        self.history_size = DEFAULT_HISTORY_SIZE
+        self.add_settable(
+            cmd2.Settable("history_size", int,
+                          "Number of samples kept per numeric metric, 0 disables the history",
+                          self, onchange_cb=self._on_change_history_size)
+        )
+        self.history_budget_mb = DEFAULT_HISTORY_BUDGET // (1024 * 1024)
+        self.add_settable(
+            cmd2.Settable("history_budget_mb", int,
+                          "Maximum memory used by metric histories, in MiB",
+                          self, onchange_cb=self._on_change_history_budget_mb)
+        )
+        self.ingest_overflow_policy = self.mqtt_if.ingest.policy
+        self.add_settable(
+            cmd2.Settable("ingest_overflow_policy", str,
+                          "What to do with received messages when the queue is full", self,
+                          choices=OVERFLOW_POLICIES,
+                          onchange_cb=self._on_change_ingest_overflow_policy)
+        )
 
     def _on_change_byte_data_display_mode(self, _param_name, _old_value, new_value):
         global BYTE_DATA_DISPLAY_MODE
@@ -201,6 +312,79 @@ class SPShell(cmd2.Cmd):
         else:
             BYTE_DATA_MAX_LEN = new_value
 
+    def _on_change_ingest_overflow_policy(self, _param_name, _old_value, new_value):
+        self.mqtt_if.ingest.policy = new_value
+
+    def _on_change_metric_update_mode(self, _param_name, _old_value, new_value):
+        SPNet().set_notify_mode(new_value)
+        if new_value == NOTIFY_COALESCED:
+            self.start_refresh()
+        else:
+            self.stop_refresh()
+
+    def _on_change_metric_refresh_rate(self, param_name, old_value, new_value):
+        if new_value <= 0:
+            print(f"{param_name} should be greater than 0")
+            setattr(self, param_name, old_value)
+
+    def _on_change_history_size(self, param_name, old_value, new_value):
+        if new_value < 0:
+            print(f"{param_name} should be greater or equal to 0")
+            setattr(self, param_name, old_value)
+        else:
+            SPNet().history.size = new_value
+
+    def _on_change_history_budget_mb(self, param_name, old_value, new_value):
+        if new_value < 0:
+            print(f"{param_name} should be greater or equal to 0")
+            setattr(self, param_name, old_value)
+        else:
+            SPNet().history.budget = new_value * 1024 * 1024
+
+    def start_refresh(self):
+        """Starts the thread printing coalesced metric updates."""
+        if self.refresh_thread is None:
+            self.refresh_stop.clear()
+            self.refresh_thread = threading.Thread(target=self._refresh_loop,
+                                                   name="enki-refresh", daemon=True)
+            self.refresh_thread.start()
+
+    def stop_refresh(self):
+        """Stops the thread printing coalesced metric updates."""
+        if self.refresh_thread is not None:
+            self.refresh_stop.set()
+            self.refresh_thread.join()
+            self.refresh_thread = None
+
+    def _refresh_loop(self):
+        while not self.refresh_stop.wait(1 / self.metric_refresh_rate):
+            SPNet().flush_updates()
+
+    def ppaged_chunks(self, chunks):
+        """
+        Writes text chunks through the pager as they are produced, or to the
+        output when not running in a terminal, like cmd2's ppaged().
+        Mirrors ppaged() of cmd2 2.4.3, which requirements.txt pins, because
+        _redirecting and sigint_protection are not part of cmd2's public API.
+        """
+        functional_terminal = (self.stdin.isatty() and self.stdout.isatty()
+                               and (sys.platform.startswith("win")
+                                    or os.environ.get("TERM") is not None))
+        if (not functional_terminal or self._redirecting or self.in_pyscript()
+                or self.in_script()):
+            for chunk in chunks:
+                self.poutput(chunk, end="")
+            return
+        with self.sigint_protection:
+            with subprocess.Popen(self.pager, shell=True, stdin=subprocess.PIPE) as pager:
+                try:
+                    for chunk in chunks:
+                        pager.stdin.write(chunk.encode("utf-8", "replace"))
+                    pager.stdin.close()
+                except BrokenPipeError:
+                    # The pager was quit before the end of the output
+                    pass
+
     def do_exit(self, *_args):
         """Exits the app."""
         return True
@@ -212,27 +396,18 @@ class SPShell(cmd2.Cmd):
     @cmd2.with_argparser(parser_list)
     def do_list(self, args):
         """Show list of birthed Edge of Network Nodes (EoN) and devices"""
-        sp_net = SPNet()
-        for eon in sp_net.eon_nodes:
-            print(f"- {eon.get_handle()}")
-            for dev in eon.devices:
+        for (eon, devices) in SPNet().get_snapshot().iter_eons():
+            print(f"- {eon.get_handle()}{' (restored)' if eon.restored else ''}")
+            for dev in devices:
+                restored = " (restored)" if dev.restored else ""
                 if not args.short:
-                    print(f"   * {dev.get_handle()}")
+                    print(f"   * {dev.get_handle()}{restored}")
                 else:
-                    print(f"   * {dev.get_id().dev_id}")
+                    print(f"   * {dev.get_id().dev_id}{restored}")
 
     def build_target_list(self, include_eon, include_dev):
         """Returns a list of potential handles for autocompletion purposes."""
-        res = []
-        sp_net = SPNet()
-        for eon in sp_net.eon_nodes:
-            eon_id = f"{eon.get_id().group_id}/{eon.get_id().eon_id}"
-            if include_eon:
-                res.append(eon_id)
-            if include_dev:
-                for dev in eon.devices:
-                    res.append(f"{eon_id}/{dev.get_id().dev_id}")
-        return res
+        return SPNet().get_snapshot().get_handles(include_eon, include_dev)
 
     def get_all_targets(self):
         """Returns all known handles."""
@@ -262,19 +437,19 @@ class SPShell(cmd2.Cmd):
     @cmd2.with_argparser(metrics_parser)
     def do_metrics(self, args):
         """Command to print all metrics of an EoN/device."""
-        sp_dev = SPNet().find_handle(args.handle)
+        sp_dev = SPNet().get_snapshot().find_handle(args.handle)
         if sp_dev is not None:
-            for metric in sp_dev.metrics:
-                print(get_metric_str(metric))
+            self.ppaged_chunks(chunk for metric in sp_dev.read_metrics()
+                               for chunk in itertools.chain(iter_metric_str(metric), ("\n",)))
         else:
             print(f"Error: Invalid handle: {args.handle}")
             self.help_metrics()
 
     def get_metrics_from_handle(self, handle):
         """Returns the list of metrics belonging to the given handle."""
-        sp_dev = SPNet().find_handle(handle)
+        sp_dev = SPNet().get_snapshot().find_handle(handle)
         if sp_dev is not None:
-            return [metric.name for metric in sp_dev.metrics]
+            return list(sp_dev.get_metric_names())
         return []
 
     def choices_dev_metrics_provider(self, arg_tokens):
@@ -290,6 +465,25 @@ class SPShell(cmd2.Cmd):
         for topic in self.mqtt_if.get_subscribed_topics():
             print(topic)
 
+    def broker_queue(self, _args):
+        """Prints the state of the received messages queue."""
+        ingest = self.mqtt_if.ingest
+        print(f"policy: {ingest.policy}")
+        print(f"depth: {ingest.get_depth()}/{ingest.get_capacity()} (max {ingest.max_depth})")
+        print(f"received: {ingest.received}")
+        print(f"processed: {ingest.processed}")
+        print(f"dropped: {ingest.dropped}")
+
+    def broker_cache(self, _args):
+        """Prints the statistics of the topic parse cache."""
+        info = SPTopic.cache_info()
+        lookups = info.hits + info.misses
+        hit_rate = 100 * info.hits / lookups if lookups else 0
+        print(f"topics: {info.currsize}/{info.maxsize}")
+        print(f"hits: {info.hits}")
+        print(f"misses: {info.misses}")
+        print(f"hit rate: {hit_rate:.1f}%")
+
     def broker_sub(self, args):
         """Subscribe to a topic."""
         self.mqtt_if.subscribe(args.topic)
@@ -302,6 +496,12 @@ class SPShell(cmd2.Cmd):
     subparser_broker = parser_broker.add_subparsers(help='broker subcommands')
     parser_list = subparser_broker.add_parser('list', help='List subscribed topics')
     parser_list.set_defaults(func=broker_list_topics)
+    parser_queue = subparser_broker.add_parser('queue',
+                                               help='Show received messages queue counters')
+    parser_queue.set_defaults(func=broker_queue)
+    parser_cache = subparser_broker.add_parser('cache',
+                                               help='Show topic parse cache statistics')
+    parser_cache.set_defaults(func=broker_cache)
     parser_sub = subparser_broker.add_parser('subscribe',
                                              help='Subscribe to topic')
     parser_sub.add_argument('topic', help='Topic to subcribe to')
@@ -322,28 +522,425 @@ class SPShell(cmd2.Cmd):
     @cmd2.with_argparser(parser_print)
     def do_print(self, args):
         """Prints the metric current value for a specific EoN or device."""
-        sp_dev = SPNet().find_handle(args.handle)
+        sp_dev = SPNet().get_snapshot().find_handle(args.handle)
         if sp_dev is not None:
-            metric = sp_dev.get_metric(args.metric_name)
+            metric = sp_dev.read_metric(args.metric_name)
             if metric is not None:
-                print(get_metric_str(metric))
+                self.ppaged_chunks(itertools.chain(iter_metric_str(metric), ("\n",)))
             else:
                 print(f"No metric '{args.metric_name}' belonging to '{args.handle}'")
         else:
             print(f"Unknown handle '{args.handle}'")
 
+    parser_find = cmd2.Cmd2ArgumentParser()
+    parser_find.add_argument("pattern", help="Glob pattern of metric names")
+    parser_find.add_argument('--regex', action='store_true',
+                             help='The pattern is a regular expression matching metric names')
+    parser_find.add_argument('--value-filter', metavar='EXPR', default=None,
+                             help='Only show the metrics whose value matches an expression '
+                             'of "value", e.g. "value > 10"')
+
+    @cmd2.with_argparser(parser_find)
+    def do_find(self, args):
+        """Finds the metrics of the fleet by name, and shows their current value."""
+        matches = None
+        if args.value_filter is not None:
+            try:
+                matches = compile_predicate(args.value_filter)
+            except ValueError as err:
+                print(f"Error: invalid value filter: {err}")
+                return
+        try:
+            found = SPNet().find_metrics(args.pattern, args.regex)
+        except re.error as err:
+            print(f"Error: invalid regular expression: {err}")
+            return
+        lines = []
+        for (sp_dev, slot) in found:
+            value = sp_dev.read_consistent(sp_dev.get_slot_value, slot)
+            if matches is not None and not matches(value):
+                continue
+            schema = sp_dev.store.schema
+            lines.append((sp_dev.get_handle(), schema.names[slot],
+                          get_short_value_str(schema.datatypes[slot], value)))
+        lines.sort()
+        self.ppaged_chunks(itertools.chain((f"{handle} {name}: {value}\n"
+                                            for (handle, name, value) in lines),
+                                           (f"{len(lines)} metric(s) found\n",)))
+
+    def dataset_export(self, args):
+        """Export a DataSet metric to a CSV file."""
+        sp_dev = SPNet().get_snapshot().find_handle(args.handle)
+        if sp_dev is None:
+            print(f"Unknown handle '{args.handle}'")
+            return
+        metric = sp_dev.read_metric(args.metric_name)
+        if metric is None:
+            print(f"No metric '{args.metric_name}' belonging to '{args.handle}'")
+            return
+        if metric.datatype != MetricDataType.DataSet:
+            print(f"Metric '{args.metric_name}' is not a DataSet")
+            return
+        columns = DataSetColumns(metric.dataset_value)
+        try:
+            with open(args.file, "w", newline="", encoding="utf-8") as csv_file:
+                columns.write_csv(csv_file)
+        except OSError as err:
+            print(f"Failed to export to '{args.file}': {err}")
+            return
+        print(f"Exported {len(columns)} rows to '{args.file}'")
+
+    parser_dataset = cmd2.Cmd2ArgumentParser()
+    subparser_dataset = parser_dataset.add_subparsers(help='dataset subcommands')
+    parser_dataset_export = subparser_dataset.add_parser('export',
+                                                         help='Export a DataSet to a CSV file')
+    parser_dataset_export.add_argument("handle",
+                                       choices_provider=choices_dev_metrics_provider,
+                                       help="Handle of a Sparkplug device")
+    parser_dataset_export.add_argument("metric_name",
+                                       choices_provider=choices_dev_metrics_provider,
+                                       help="Metric name")
+    parser_dataset_export.add_argument('file', completer=cmd2.Cmd.path_complete,
+                                       help='CSV file, overwritten if it exists')
+    parser_dataset_export.set_defaults(func=dataset_export)
+
+    @cmd2.with_argparser(parser_dataset)
+    def do_dataset(self, args):
+        """Handle DataSet metrics"""
+        args.func(self, args)
+
+    parser_history = cmd2.Cmd2ArgumentParser()
+    parser_history.add_argument("handle",
+                                choices_provider=choices_dev_metrics_provider,
+                                help="Handle of a Sparkplug device")
+    parser_history.add_argument("metric_name",
+                                choices_provider=choices_dev_metrics_provider,
+                                help="Metric name")
+    parser_history.add_argument("-n", "--count", type=int, default=10,
+                                help="Number of recent samples to print")
+
+    @cmd2.with_argparser(parser_history)
+    def do_history(self, args):
+        """Prints the recent samples of a numeric metric and their statistics."""
+        sp_dev = SPNet().get_snapshot().find_handle(args.handle)
+        if sp_dev is None:
+            print(f"Unknown handle '{args.handle}'")
+            return
+        slot = sp_dev.get_slot(args.metric_name)
+        if slot is None:
+            print(f"No metric '{args.metric_name}' belonging to '{args.handle}'")
+            return
+        history = sp_dev.histories.get(slot)
+        if history is None:
+            print(f"No history for '{args.metric_name}', "
+                  "it is only kept for numeric metrics when history_size is set")
+            return
+        stats = history.get_stats()
+        print(f"{len(history)} samples (max {history.get_size()})")
+        if stats is not None:
+            (min_value, max_value, mean, rate) = stats
+            print(f"min: {min_value}, max: {max_value}, mean: {mean}, rate: {rate}/s")
+        for (timestamp, value) in history.iter_recent(args.count):
+            print(f"\t{get_timestamp_str(timestamp)}: {value}")
+
     @cmd2.with_argparser(parser_broker)
     def do_broker(self, args):
         """Manage broker subscriptions"""
         args.func(self, args)
 
+    def filter_add(self, args):
+        """Adds a rule to the ingest filter."""
+        msg_type = MsgType[args.type] if args.type else None
+        IngestFilter().add_rule(FilterRule(args.action, args.pattern, msg_type))
+
+    def filter_remove(self, args):
+        """Removes a rule from the ingest filter."""
+        try:
+            rule = IngestFilter().remove_rule(args.index)
+            print(f"Removed rule '{rule}'")
+        except IndexError:
+            print(f"No rule at index {args.index}")
+
+    def filter_list(self, _args):
+        """Prints the rules of the ingest filter and its counters."""
+        ingest_filter = IngestFilter()
+        if not ingest_filter.rules:
+            print("No rules, all messages are decoded")
+        for (idx, rule) in enumerate(ingest_filter.rules):
+            print(f"{idx}: {rule}")
+        print(f"decoded: {ingest_filter.decoded}")
+        print(f"skipped: {ingest_filter.skipped}")
+
+    parser_filter = cmd2.Cmd2ArgumentParser()
+    subparser_filter = parser_filter.add_subparsers(help='filter subcommands')
+    parser_filter_add = subparser_filter.add_parser('add', help='Add a filter rule')
+    parser_filter_add.add_argument('action', choices=FILTER_ACTIONS,
+                                   help='Include or exclude the matching messages')
+    parser_filter_add.add_argument('pattern',
+                                   help='Glob matched against handles, '
+                                   'a pattern matching an EoN also matches its devices')
+    parser_filter_add.add_argument('--type', choices=[msg_type.name for msg_type in MsgType],
+                                   help='Only apply the rule to this message type')
+    parser_filter_add.set_defaults(func=filter_add)
+    parser_filter_remove = subparser_filter.add_parser('remove', help='Remove a filter rule')
+    parser_filter_remove.add_argument('index', type=int,
+                                      help='Index of the rule as shown by "filter list"')
+    parser_filter_remove.set_defaults(func=filter_remove)
+    parser_filter_list = subparser_filter.add_parser('list',
+                                                     help='List filter rules and counters')
+    parser_filter_list.set_defaults(func=filter_list)
+
+    @cmd2.with_argparser(parser_filter)
+    def do_filter(self, args):
+        """Manage the filter deciding which received messages are decoded"""
+        args.func(self, args)
+
+    def record_start(self, args):
+        """Starts recording received messages."""
+        try:
+            self.mqtt_if.start_recording(args.file)
+            print(f"Recording to '{args.file}'")
+        except OSError as err:
+            print(f"Cannot record to '{args.file}': {err}")
+
+    def record_stop(self, _args):
+        """Stops recording received messages."""
+        recorder = self.mqtt_if.stop_recording()
+        if recorder is not None:
+            print(f"Recorded {recorder.count} messages to '{recorder.path}'")
+        else:
+            print("Not recording")
+
+    parser_record = cmd2.Cmd2ArgumentParser()
+    subparser_record = parser_record.add_subparsers(help='record subcommands')
+    parser_record_start = subparser_record.add_parser('start',
+                                                      help='Start recording received messages')
+    parser_record_start.add_argument('file', completer=cmd2.Cmd.path_complete,
+                                     help='Capture file, overwritten if it exists')
+    parser_record_start.set_defaults(func=record_start)
+    parser_record_stop = subparser_record.add_parser('stop', help='Stop recording')
+    parser_record_stop.set_defaults(func=record_stop)
+
+    @cmd2.with_argparser(parser_record)
+    def do_record(self, args):
+        """Record the raw received messages to a capture file"""
+        args.func(self, args)
+
+    parser_replay = cmd2.Cmd2ArgumentParser()
+    parser_replay.add_argument('file', completer=cmd2.Cmd.path_complete,
+                               help='Capture file written by "record"')
+    replay_pace = parser_replay.add_mutually_exclusive_group()
+    replay_pace.add_argument('--speed', type=float, default=1.0,
+                             help='Replay speed relative to the original pacing')
+    replay_pace.add_argument('--max', action='store_true',
+                             help='Replay as fast as possible')
+
+    @cmd2.with_argparser(parser_replay)
+    def do_replay(self, args):
+        """Feed a recorded capture through message handling as if it was received"""
+        if args.speed <= 0:
+            print("speed should be greater than 0")
+            return
+        try:
+            report = replay(args.file, self.mqtt_if, None if args.max else args.speed)
+        except (OSError, AssertionError) as err:
+            print(f"Cannot replay '{args.file}': {err}")
+            return
+        print(report)
+
+    def exporter_start(self, args):
+        """Start serving the statistics."""
+        try:
+            Exporter().start(args.port, args.address)
+        except OSError as err:
+            print(f"Cannot serve statistics on port {args.port}: {err}")
+            return
+        (address, port) = Exporter().get_address()
+        print(f"Serving statistics on http://{address}:{port}/metrics")
+
+    def exporter_stop(self, _args):
+        """Stop serving the statistics."""
+        Exporter().stop()
+
+    def exporter_status(self, _args):
+        """Print the exporter address and gauges."""
+        address = Exporter().get_address()
+        if address is not None:
+            print(f"Serving statistics on http://{address[0]}:{address[1]}/metrics")
+        else:
+            print("Not serving statistics")
+        for (handle, metric_name) in Exporter().get_gauges():
+            print(f"gauge: {handle} {metric_name}")
+
+    def exporter_add(self, args):
+        """Expose a metric value as a gauge."""
+        Exporter().add_gauge(args.handle, args.metric_name)
+
+    def exporter_remove(self, args):
+        """Stop exposing a metric value."""
+        if not Exporter().remove_gauge(args.handle, args.metric_name):
+            print(f"No gauge for '{args.metric_name}' of '{args.handle}'")
+
+    parser_exporter = cmd2.Cmd2ArgumentParser()
+    subparser_exporter = parser_exporter.add_subparsers(help='exporter subcommands')
+    parser_exporter_start = subparser_exporter.add_parser('start',
+                                                          help='Start serving the statistics')
+    parser_exporter_start.add_argument('--port', type=int, default=DEFAULT_EXPORTER_PORT,
+                                       help='Port the statistics are served on')
+    parser_exporter_start.add_argument('--address', default=DEFAULT_EXPORTER_ADDRESS,
+                                       help='Address the statistics are served on')
+    parser_exporter_start.set_defaults(func=exporter_start)
+    parser_exporter_stop = subparser_exporter.add_parser('stop',
+                                                         help='Stop serving the statistics')
+    parser_exporter_stop.set_defaults(func=exporter_stop)
+    parser_exporter_status = subparser_exporter.add_parser(
+        'status', help='Show the exporter address and the metrics exposed as gauges')
+    parser_exporter_status.set_defaults(func=exporter_status)
+    parser_exporter_add = subparser_exporter.add_parser('add',
+                                                        help='Expose a metric value as a gauge')
+    parser_exporter_add.add_argument("handle", choices_provider=choices_dev_metrics_provider,
+                                     help="Handle of a Sparkplug EoN or device")
+    parser_exporter_add.add_argument("metric_name", choices_provider=choices_dev_metrics_provider,
+                                     help="Name of a numeric or boolean metric")
+    parser_exporter_add.set_defaults(func=exporter_add)
+    parser_exporter_remove = subparser_exporter.add_parser('remove',
+                                                           help='Stop exposing a metric value')
+    parser_exporter_remove.add_argument("handle", help="Handle of a Sparkplug EoN or device")
+    parser_exporter_remove.add_argument("metric_name", help="Metric name")
+    parser_exporter_remove.set_defaults(func=exporter_remove)
+
+    @cmd2.with_argparser(parser_exporter)
+    def do_exporter(self, args):
+        """Serve the fleet and ingest statistics to Prometheus"""
+        args.func(self, args)
+
+    parser_stats = cmd2.Cmd2ArgumentParser()
+    parser_stats.add_argument('--reset', action='store_true',
+                              help='Reset the statistics once printed')
+
+    @cmd2.with_argparser(parser_stats)
+    def do_stats(self, args):
+        """
+        Print the number of received messages by type and the time spent handling them.
+        Rates are computed since the previous stats command or reset.
+        """
+        stats = IngestStats()
+        now = time.monotonic()
+        counts = stats.get_counts()
+        received = counts[COUNTER_RECEIVED]
+        (since, previous) = self.stats_sample or (stats.reset_time, {})
+        elapsed = now - since
+        print(f"Statistics over {now - stats.reset_time:.1f}s, rates over {elapsed:.1f}s")
+        print(f"{'type':8}" + "".join(f"{counter:>12}" for counter in COUNTERS)
+              + f"{'rate/s':>12}")
+        for msg_type in MsgType:
+            rate = (received[msg_type] - previous.get(msg_type, 0)) / elapsed if elapsed else 0
+            print(f"{msg_type.name:8}"
+                  + "".join(f"{counts[counter][msg_type]:12}" for counter in COUNTERS)
+                  + f"{rate:12.1f}")
+        print(f"{'stage':8}{'count':>12}{'mean us':>12}{'p50 us':>12}{'p99 us':>12}")
+        for stage in STAGES:
+            histogram = stats.histograms[stage]
+            mean = histogram.total / histogram.count / 1e3 if histogram.count else 0
+            print(f"{stage:8}{histogram.count:12}{mean:12.1f}"
+                  f"{histogram.get_quantile(.5) / 1e3:12.1f}"
+                  f"{histogram.get_quantile(.99) / 1e3:12.1f}")
+        if args.reset:
+            stats.reset()
+            self.stats_sample = None
+        else:
+            self.stats_sample = (now, received)
+
+    def profile_start(self, args):
+        """Start profiling the handling of received messages."""
+        if self.profiler is not None:
+            print("Already profiling")
+            return
+        if args.interval <= 0:
+            print("interval should be greater than 0")
+            return
+        profiler = IngestProfiler(self.mqtt_if.ingest, args.sampling, args.interval / 1000)
+        try:
+            profiler.start()
+        except RuntimeError as err:
+            print(f"Cannot profile: {err}")
+            return
+        self.profiler = profiler
+
+    def profile_stop(self, args):
+        """Stop profiling and print the hottest functions."""
+        profiler = self.profiler
+        if profiler is None:
+            print("Not profiling")
+            return
+        self.profiler = None
+        profiler.stop()
+        self.ppaged(profiler.get_summary(args.top, args.sort))
+        if args.out is not None:
+            try:
+                profiler.write(args.out)
+            except OSError as err:
+                print(f"Cannot write the profile to '{args.out}': {err}")
+                return
+            print(f"Profile written to '{args.out}'")
+
+    parser_profile = cmd2.Cmd2ArgumentParser()
+    subparser_profile = parser_profile.add_subparsers(help='profile subcommands')
+    parser_profile_start = subparser_profile.add_parser(
+        'start', help='Start profiling the handling of received messages')
+    parser_profile_start.add_argument('--sampling', action='store_true',
+                                      help='Sample the stack instead of tracing every call')
+    parser_profile_start.add_argument('--interval', type=float,
+                                      default=DEFAULT_SAMPLING_INTERVAL * 1000,
+                                      help='Sampling interval in ms')
+    parser_profile_start.set_defaults(func=profile_start)
+    parser_profile_stop = subparser_profile.add_parser(
+        'stop', help='Stop profiling and print the hottest functions')
+    parser_profile_stop.add_argument('--out', completer=cmd2.Cmd.path_complete,
+                                     help='Profile file: pstats, or collapsed stacks '
+                                     'when sampling')
+    parser_profile_stop.add_argument('--top', type=int, default=DEFAULT_TOP,
+                                     help='Number of functions printed')
+    parser_profile_stop.add_argument('--sort', choices=SORT_KEYS, default=SORT_KEYS[0],
+                                     help='Order of the functions, when not sampling')
+    parser_profile_stop.set_defaults(func=profile_stop)
+
+    @cmd2.with_argparser(parser_profile)
+    def do_profile(self, args):
+        """Profile the thread handling the received messages"""
+        args.func(self, args)
+
+    parser_simulate = cmd2.Cmd2ArgumentParser()
+    parser_simulate.add_argument('eons', type=int, help='Number of EoNs')
+    parser_simulate.add_argument('devices', type=int, help='Number of devices per EoN')
+    parser_simulate.add_argument('metrics', type=int, help='Number of metrics per device')
+    parser_simulate.add_argument('--rate', type=float, default=None,
+                                 help='Messages per second, as fast as possible by default')
+    parser_simulate.add_argument('--duration', type=float, default=10.0,
+                                 help='Duration of the simulation in seconds')
+    parser_simulate.add_argument('--churn', type=float, default=None,
+                                 help='EoN deaths and rebirths per second')
+    parser_simulate.add_argument('--qos', type=int, default=0, choices=[0, 1, 2],
+                                 help='QoS of the published messages')
+    parser_simulate.add_argument('--group', default=DEFAULT_SIM_GROUP,
+                                 help='Group Id of the simulated EoNs')
+
+    @cmd2.with_argparser(parser_simulate)
+    def do_simulate(self, args):
+        """Publish the births and DATA of a simulated fleet of EoNs and devices"""
+        if min(args.eons, args.devices, args.metrics) < 1:
+            print("eons, devices and metrics should be greater than 0")
+            return
+        if (args.rate is not None and args.rate <= 0) or (args.churn is not None
+                                                          and args.churn <= 0):
+            print("rate and churn should be greater than 0")
+            return
+        simulator = Simulator(self.mqtt_if, args.eons, args.devices, args.metrics, args.group)
+        print(simulator.run(args.rate, args.duration, args.churn, args.qos))
+
     def choose_metric(self, sp_dev):
         """Ask the user to choose among the metrics of the given device."""
-        metrics = []
-        for metric in sp_dev.metrics:
-            if metric.name == "bdSeq":
-                continue
-            metrics.append(metric.name)
+        metrics = [name for name in sp_dev.get_metric_names() if name != "bdSeq"]
         metric_name = self.select(metrics, "metric ? ")
         metric = sp_dev.get_metric(metric_name)
         assert metric is not None, "Could not find requested metric"
@@ -365,18 +962,11 @@ class SPShell(cmd2.Cmd):
     def prompt_user_simple_datatype(self, name, datatype):
         """Ask the user to give a value for simple datatypes."""
         prompt = f"[{sp_helpers.datatype_to_str(datatype)}] {name}: "
-        value = None
         try:
             usr_input = self.read_input(prompt)
         except EOFError:
             return None
-        if datatype in sp_helpers.boolean_value_types:
-            value = str_to_bool(usr_input)
-        elif datatype in sp_helpers.int_value_types + sp_helpers.long_value_types:
-            value = str_to_int(usr_input)
-        elif datatype in sp_helpers.string_value_types:
-            value = usr_input
-        return value
+        return str_to_value(datatype, usr_input)
 
     def forge_dataset_metric(self, payload, metric):
         """Ask the user to fill a dataset."""
@@ -421,27 +1011,295 @@ class SPShell(cmd2.Cmd):
                              help='Message type the payload is sent with')
     parser_send.add_argument('handle',
                              choices_provider=get_all_targets,
-                             help='Id of EoN or device as returned by command "list"')
+                             help='Id of EoN or device as returned by command "list", '
+                             'or a glob pattern of Ids')
+    parser_send.add_argument('--regex', action='store_true',
+                             help='The handle is a regular expression matching Ids')
+    parser_send.add_argument('--qos', type=int, default=1, choices=[0, 1, 2],
+                             help='QoS used when sending to several EoNs/devices')
+    parser_send.add_argument('--window', type=int, default=SEND_WINDOW,
+                             help='Maximum number of messages waiting for their '
+                             'acknowledgement when sending to several EoNs/devices')
+
+    def forge_payload(self, sp_dev):
+        """Ask the user to forge a payload from the metrics of the given device."""
+        payload = sparkplug_b_pb2.Payload()
+        new_metric = True
+        while new_metric:
+            metric = self.choose_metric(sp_dev)
+            self.forge_payload_from_metric(payload, metric)
+            new_metric = self.query_yes_no("new metric ?")
+        return payload
 
     @cmd2.with_argparser(parser_send)
     def do_send(self, args):
-        """Forge a payload to send for a particular EoN or device."""
-        sp_dev = SPNet().find_handle(args.handle)
+        """Forge a payload to send for a particular EoN or device, or for all matching ones."""
+        msg_type = MsgType.CMD if args.msg_type == "CMD" else MsgType.DATA
+        if not args.regex and not any(char in args.handle for char in "*?["):
+            sp_dev = SPNet().get_snapshot().find_handle(args.handle)
+            if sp_dev is None:
+                print(f"Error: invalid handle: {args.handle}")
+                return
+            topic = sp_dev.get_msg_topic(msg_type)
+            payload = self.forge_payload(sp_dev)
+            byte_array = bytearray(payload.SerializeToString())
+            self.mqtt_if.publish(str(topic), byte_array, 0, False)
+            return
+
+        if args.window < 1:
+            print("window should be greater than 0")
+            return
+        try:
+            targets = SPNet().find_handles(args.handle, args.regex)
+        except re.error as err:
+            print(f"Error: invalid regular expression: {err}")
+            return
+        if not targets:
+            print(f"Error: no EoN or device matches {args.handle}")
+            return
+        # EoNs/devices born with the same metrics share their schema:
+        # one payload is forged and encoded for each schema
+        groups: dict[object, list[SPDev]] = {}
+        for sp_dev in targets:
+            groups.setdefault(sp_dev.store.schema, []).append(sp_dev)
+        payloads = []
+        for sp_devs in groups.values():
+            print(f"Payload for {len(sp_devs)} EoN(s)/device(s) like {sp_devs[0].get_handle()}:")
+            payloads.append((self.forge_payload(sp_devs[0]).SerializeToString(), sp_devs))
+        publisher = Publisher(self.mqtt_if, args.qos, window=args.window)
+        try:
+            for (payload, sp_devs) in payloads:
+                for sp_dev in sp_devs:
+                    publisher.publish(str(sp_dev.get_msg_topic(msg_type)), payload)
+        except KeyboardInterrupt:
+            print("Sending interrupted")
+        print(publisher.finish())
+
+    def get_template_names(self):
+        """Returns the names of the payload templates."""
+        return list(self.templates)
+
+    def get_template(self, name):
+        """Returns the payload template with the given name, None if there is none."""
+        if name not in self.templates:
+            print(f"Error: unknown template: {name}")
+            return None
+        return self.templates[name]
+
+    def template_save(self, args):
+        """Forges a payload and saves it as a template."""
+        sp_dev = SPNet().get_snapshot().find_handle(args.handle)
         if sp_dev is None:
             print(f"Error: invalid handle: {args.handle}")
             return
-
         msg_type = MsgType.CMD if args.msg_type == "CMD" else MsgType.DATA
-        topic = sp_dev.get_msg_topic(msg_type)
-        payload = sparkplug_b_pb2.Payload()
-        new_metric = True
-        while new_metric:
-            metric = self.choose_metric(sp_dev)
-            self.forge_payload_from_metric(payload, metric)
-            new_metric = self.query_yes_no("new metric ?")
+        payload = self.forge_payload(sp_dev)
+        self.templates[args.name] = (msg_type, args.handle, PayloadTemplate.from_payload(payload))
+
+    def template_list(self, _args):
+        """Lists the payload templates."""
+        for (name, (msg_type, handle, template)) in self.templates.items():
+            print(f"- {name}: {msg_type.name} to {handle}, {len(template)} metric(s)")
+
+    def template_show(self, args):
+        """Prints the metrics of a payload template."""
+        saved = self.get_template(args.name)
+        if saved is not None:
+            for metric in saved[2].metrics:
+                print(get_metric_str(metric))
 
-        byte_array = bytearray(payload.SerializeToString())
-        self.mqtt_if.publish(str(topic), byte_array, 0, False)
+    def template_set(self, args):
+        """Changes the value of a metric of a payload template."""
+        saved = self.get_template(args.name)
+        if saved is None:
+            return
+        template = saved[2]
+        idx = template.find_metric(args.metric_name)
+        if idx is None:
+            print(f"Error: no metric {args.metric_name} in template {args.name}")
+            return
+        datatype = template.metrics[idx].datatype
+        try:
+            value = str_to_value(datatype, args.value)
+        except ValueError:
+            value = None
+        if value is None:
+            print(f"Error: invalid {sp_helpers.datatype_to_str(datatype)} value: {args.value}")
+            return
+        template.set_value(idx, value)
+
+    def template_remove(self, args):
+        """Removes a payload template."""
+        if self.get_template(args.name) is not None:
+            del self.templates[args.name]
+
+    def template_publish(self, args):
+        """Publishes a payload template repeatedly."""
+        saved = self.get_template(args.name)
+        if saved is None:
+            return
+        (msg_type, handle, template) = saved
+        topics = []
+        for target in args.to or [handle]:
+            sp_dev = SPNet().get_snapshot().find_handle(target)
+            if sp_dev is None:
+                print(f"Error: invalid handle: {target}")
+                return
+            topics.append(str(sp_dev.get_msg_topic(msg_type)))
+        if args.count < 1 or (args.rate is not None and args.rate <= 0):
+            print("count and rate should be greater than 0")
+            return
+        publisher = Publisher(self.mqtt_if, args.qos, args.rate)
+        try:
+            for _ in range(args.count):
+                for topic in topics:
+                    publisher.publish(topic, template.encode())
+        except KeyboardInterrupt:
+            print("Publishing interrupted")
+        print(publisher.finish())
+
+    parser_template = cmd2.Cmd2ArgumentParser()
+    subparser_template = parser_template.add_subparsers(help='template subcommands')
+    parser_template_save = subparser_template.add_parser(
+        'save', help='Forge a payload and save it as a template')
+    parser_template_save.add_argument('name', help='Template name')
+    parser_template_save.add_argument('msg_type', choices=send_msg_choices,
+                                      help='Message type the payload is sent with')
+    parser_template_save.add_argument('handle', choices_provider=get_all_targets,
+                                      help='Id of EoN or device as returned by command "list"')
+    parser_template_save.set_defaults(func=template_save)
+    parser_template_list = subparser_template.add_parser('list', help='List the templates')
+    parser_template_list.set_defaults(func=template_list)
+    parser_template_show = subparser_template.add_parser('show',
+                                                         help='Print the metrics of a template')
+    parser_template_show.add_argument('name', choices_provider=get_template_names,
+                                      help='Template name')
+    parser_template_show.set_defaults(func=template_show)
+    parser_template_set = subparser_template.add_parser(
+        'set', help='Change the value of a metric of a template')
+    parser_template_set.add_argument('name', choices_provider=get_template_names,
+                                     help='Template name')
+    parser_template_set.add_argument('metric_name', help='Metric name')
+    parser_template_set.add_argument('value', help='New value')
+    parser_template_set.set_defaults(func=template_set)
+    parser_template_remove = subparser_template.add_parser('remove', help='Remove a template')
+    parser_template_remove.add_argument('name', choices_provider=get_template_names,
+                                        help='Template name')
+    parser_template_remove.set_defaults(func=template_remove)
+    parser_template_publish = subparser_template.add_parser(
+        'publish', help='Publish a template repeatedly')
+    parser_template_publish.add_argument('name', choices_provider=get_template_names,
+                                         help='Template name')
+    parser_template_publish.add_argument('--count', type=int, default=1,
+                                         help='Number of times the template is published')
+    parser_template_publish.add_argument('--rate', type=float, default=None,
+                                         help='Messages per second, as fast as possible by '
+                                         'default')
+    parser_template_publish.add_argument('--qos', type=int, default=0, choices=[0, 1, 2],
+                                         help='QoS of the published messages')
+    parser_template_publish.add_argument('--to', nargs='+', choices_provider=get_all_targets,
+                                         help='EoNs or devices to publish to instead of the '
+                                         'one the template was forged for')
+    parser_template_publish.set_defaults(func=template_publish)
+
+    @cmd2.with_argparser(parser_template)
+    def do_template(self, args):
+        """Save forged payloads as templates and publish them non-interactively"""
+        args.func(self, args)
+
+    def get_watch_hook(self, template_name, command):
+        """
+        Returns the hook of a watch publishing a template and/or running a system
+        command, None if there is neither.
+        """
+        hooks = []
+        if template_name is not None:
+            (msg_type, handle, template) = self.templates[template_name]
+
+            def publish(_sp_dev, _metric, _value):
+                target = SPNet().find_handle(handle)
+                if target is None:
+                    print(f"Error: cannot publish template {template_name} "
+                          f"to unknown handle {handle}")
+                    return
+                self.mqtt_if.publish(str(target.get_msg_topic(msg_type)), template.encode(),
+                                     0, False)
+            hooks.append(publish)
+        if command is not None:
+            def run_command(sp_dev, metric, value):
+                env = dict(os.environ, ENKI_HANDLE=sp_dev.get_handle(), ENKI_METRIC=metric.name,
+                           ENKI_VALUE="" if value is None else str(value))
+                try:
+                    # The command runs in the background, it is reaped by the next one
+                    subprocess.Popen(command, shell=True, env=env)  # pylint: disable=consider-using-with
+                except OSError as err:
+                    print(f"Error: cannot run '{command}': {err}")
+            hooks.append(run_command)
+        if not hooks:
+            return None
+
+        def hook(sp_dev, metric, value):
+            for func in hooks:
+                func(sp_dev, metric, value)
+        return hook
+
+    def watch_add(self, args):
+        """Adds a watch on the metrics of the fleet."""
+        if args.publish is not None and self.get_template(args.publish) is None:
+            return
+        try:
+            watch = Watch(args.handle_pattern, args.metric_pattern, args.predicate, args.regex,
+                          self.get_watch_hook(args.publish, args.command))
+        except ValueError as err:
+            print(f"Error: invalid predicate: {err}")
+            return
+        except re.error as err:
+            print(f"Error: invalid regular expression: {err}")
+            return
+        print(f"Watch {SPNet().add_watch(watch)} added")
+
+    def watch_list(self, _args):
+        """Lists the watches."""
+        for watch in SPNet().get_watches():
+            print(f"- {watch.watch_id}: {watch}, triggered {watch.triggered} time(s)")
+        dropped = SPNet().watch_hooks.dropped
+        if dropped:
+            print(f"{dropped} hook call(s) dropped while too many were waiting")
+
+    def watch_remove(self, args):
+        """Removes a watch."""
+        if not SPNet().remove_watch(args.watch_id):
+            print(f"Error: unknown watch: {args.watch_id}")
+
+    parser_watch = cmd2.Cmd2ArgumentParser()
+    subparser_watch = parser_watch.add_subparsers(help='watch subcommands')
+    parser_watch_add = subparser_watch.add_parser(
+        'add', help='Watch the value of metrics of EoNs/devices')
+    parser_watch_add.add_argument('handle_pattern',
+                                  help='Glob pattern of the handles of the watched EoNs/devices')
+    parser_watch_add.add_argument('metric_pattern',
+                                  help='Glob pattern of the names of the watched metrics')
+    parser_watch_add.add_argument('predicate',
+                                  help='Expression of "value" the watch is triggered by, '
+                                  'e.g. "value > 80"')
+    parser_watch_add.add_argument('--regex', action='store_true',
+                                  help='The patterns are regular expressions')
+    parser_watch_add.add_argument('--publish', metavar='TEMPLATE', default=None,
+                                  help='Publish this payload template when triggered')
+    parser_watch_add.add_argument('--command', default=None,
+                                  help='Run this system command when triggered, with the '
+                                  'ENKI_HANDLE, ENKI_METRIC and ENKI_VALUE environment variables')
+    parser_watch_add.set_defaults(func=watch_add)
+    parser_watch_list = subparser_watch.add_parser('list', help='List the watches')
+    parser_watch_list.set_defaults(func=watch_list)
+    parser_watch_remove = subparser_watch.add_parser('remove', help='Remove a watch')
+    parser_watch_remove.add_argument('watch_id', type=int, help='Id of the watch')
+    parser_watch_remove.set_defaults(func=watch_remove)
+
+    @cmd2.with_argparser(parser_watch)
+    def do_watch(self, args):
+        """Be notified when the value of metrics matches a predicate"""
+        args.func(self, args)
 
     def on_broker_connected(self) -> None:
         """Callback used when the broker connection is established."""
@@ -459,14 +1317,30 @@ class SPShell(cmd2.Cmd):
         """Called when an EoN/Device is removed."""
         print(f"Removed device '{sp_dev.get_handle()}'")
 
-    def on_metric_updated(self, sp_dev: SPDev, metric) -> None:
+    def on_metric_updated(self, sp_dev: SPDev, slot: int) -> None:
         """Called when a metric is updated on the device."""
         print(f"{sp_dev.get_handle()}: metric update:")
-        print(get_metric_str(metric))
+        print(get_metric_str(sp_dev.build_metric(slot)))
+
+    def on_metrics_updated(self, updates) -> None:
+        """Called with a coalesced batch of metric updates."""
+        for (sp_dev, metrics) in updates.items():
+            print(f"{sp_dev.get_handle()}: {len(metrics)} metric(s) updated:")
+            for (metric, suppressed) in metrics:
+                value_str = get_typed_value_str(metric.datatype, metric)
+                suppressed_str = f" (+{suppressed} suppressed)" if suppressed else ""
+                print(f"\t{metric.name}[{metric.alias}]: {value_str}{suppressed_str}")
+
+    def on_watch_triggered(self, watch, sp_dev: SPDev, metric) -> None:
+        """Called when the updated value of a metric starts matching a watch."""
+        value_str = get_typed_value_str(metric.datatype, metric)
+        print(f"Watch {watch.watch_id} ({watch.expr}): "
+              f"{sp_dev.get_handle()} {metric.name}: {value_str}")
 
     def run(self) -> int:
         """Run this interface."""
         self.mqtt_if.start()
         time.sleep(.1)
         ret = self.cmdloop("Sparkplug Shell")
+        self.stop_refresh()
         return ret
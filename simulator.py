@@ -0,0 +1,199 @@
+"""Simulation of a fleet of Sparkplug EoNs and devices to load a broker."""
+import time
+from collections import deque
+from typing import Iterator, Optional
+
+import paho.mqtt.client as mqtt
+from sparkplug_b import MetricDataType
+import sparkplug_b_pb2
+
+import sp_helpers
+from sp_helpers import MsgType
+from sp_id import SPId
+from sp_topic import SPTopic
+from mqtt_if import MQTTInterface
+from payload_template import PayloadTemplate
+
+# Datatypes of the simulated metrics, in turn
+SIM_DATATYPES = [MetricDataType.Int32, MetricDataType.Int64, MetricDataType.Float,
+                 MetricDataType.Double, MetricDataType.Boolean, MetricDataType.String]
+# Number of distinct DATA payloads sent by the devices, in turn
+SIM_VARIANTS = 16
+DEFAULT_SIM_GROUP = "enki_sim"
+
+
+def _sim_value(datatype, variant: int):
+    """Returns the value of a simulated metric for a variant."""
+    if datatype in sp_helpers.boolean_value_types:
+        return variant % 2 == 0
+    if datatype in sp_helpers.string_value_types:
+        return f"value {variant}"
+    if datatype in sp_helpers.float_value_types + sp_helpers.double_value_types:
+        return variant / 2
+    return variant
+
+
+def _sim_metrics(count: int, variant: int, names: bool) -> list:
+    """Returns count simulated metrics, with names for births or with aliases only."""
+    payload = sparkplug_b_pb2.Payload()
+    for idx in range(count):
+        datatype = SIM_DATATYPES[idx % len(SIM_DATATYPES)]
+        metric = payload.metrics.add()
+        if names:
+            metric.name = f"metric_{idx}"
+        metric.alias = idx + 1
+        metric.datatype = datatype
+        sp_helpers.set_typed_value(datatype, metric, _sim_value(datatype, variant))
+    return list(payload.metrics)
+
+
+def _bd_seq_metric(bd_seq: int):
+    """Returns the bdSeq metric of an EoN birth/death certificate."""
+    metric = sparkplug_b_pb2.Payload.Metric()
+    metric.name = "bdSeq"
+    metric.datatype = MetricDataType.Int64
+    metric.long_value = bd_seq
+    return metric
+
+
+class SimNode:  # pylint: disable=too-few-public-methods
+    """A simulated EoN with its devices, keeping its Sparkplug sequence numbers."""
+
+    def __init__(self, group_id: str, eon_idx: int, devices: int):
+        self.eon_id = SPId(group_id, f"eon{eon_idx}")
+        self.dev_ids = [SPId(group_id, self.eon_id.eon_id, f"dev{idx}") for idx in range(devices)]
+        self.topics = {}
+        for sp_id in [self.eon_id] + self.dev_ids:
+            for msg_type in (MsgType.BIRTH, MsgType.DATA, MsgType.DEATH):
+                self.topics[(sp_id, msg_type)] = str(SPTopic(sp_id, msg_type))
+        self.seq = 0
+        self.bd_seq = 0
+
+    def next_seq(self) -> int:
+        """Returns the sequence number of the next message."""
+        seq = self.seq
+        self.seq = (seq + 1) % 256
+        return seq
+
+
+class SimReport:  # pylint: disable=too-few-public-methods
+    """Statistics about a simulation."""
+
+    def __init__(self, rate: Optional[float]):
+        self.target_rate = rate
+        self.sent = 0
+        self.size = 0
+        self.births = 0
+        self.deaths = 0
+        self.errors = 0
+        self.duration = 0.0
+
+    def get_rate(self) -> float:
+        """Returns the number of messages sent per second."""
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def __str__(self) -> str:
+        res = f"Sent {self.sent} messages ({self.size} bytes) in {self.duration:.3f}s: "
+        res += f"{self.get_rate():.0f} msg/s"
+        if self.target_rate is not None:
+            res += f" (target {self.target_rate:.0f} msg/s)"
+        res += f"\n\t{self.births} births, {self.deaths} deaths"
+        if self.errors:
+            res += f", {self.errors} publish errors"
+        return res
+
+
+# pylint: disable=too-many-instance-attributes
+class Simulator:
+    """
+    Publishes the births of a fleet of EoNs and devices then the DATA of the
+    devices in turn, optionally making EoNs die and rebirth.
+
+    Payloads are encoded once as templates: sending a message only encodes its
+    timestamp and sequence number.
+    """
+
+    def __init__(self, mqtt_if: MQTTInterface, eons: int, devices: int, metrics: int,
+                 group_id: str = DEFAULT_SIM_GROUP):
+        self.mqtt_if = mqtt_if
+        self.nodes = [SimNode(group_id, idx, devices) for idx in range(eons)]
+        self.eon_birth = PayloadTemplate([_bd_seq_metric(0)] + _sim_metrics(metrics, 0, True))
+        self.dev_birth = PayloadTemplate(_sim_metrics(metrics, 0, True))
+        self.dev_data = [PayloadTemplate(_sim_metrics(metrics, variant, False))
+                         for variant in range(SIM_VARIANTS)]
+        self.next_rebirth = 0
+
+    def iter_births(self, node: SimNode) -> Iterator[tuple[str, bytes]]:
+        """Yields the topics and payloads of the births of an EoN and its devices."""
+        node.seq = 0
+        self.eon_birth.set_value(0, node.bd_seq)
+        yield (node.topics[(node.eon_id, MsgType.BIRTH)],
+               self.eon_birth.encode(None, node.next_seq()))
+        for dev_id in node.dev_ids:
+            yield (node.topics[(dev_id, MsgType.BIRTH)],
+                   self.dev_birth.encode(None, node.next_seq()))
+
+    def get_death(self, node: SimNode) -> tuple[str, bytes]:
+        """Returns the topic and payload of the death of an EoN."""
+        payload = PayloadTemplate([_bd_seq_metric(node.bd_seq)], False).encode()
+        node.bd_seq = (node.bd_seq + 1) % 256
+        return (node.topics[(node.eon_id, MsgType.DEATH)], payload)
+
+    def iter_data(self) -> Iterator[tuple[str, bytes]]:
+        """Yields the DATA of all the devices in turn, forever."""
+        variant = 0
+        while True:
+            template = self.dev_data[variant]
+            for node in self.nodes:
+                for dev_id in node.dev_ids:
+                    yield (node.topics[(dev_id, MsgType.DATA)],
+                           template.encode(None, node.next_seq()))
+            variant = (variant + 1) % SIM_VARIANTS
+
+    def iter_rebirth(self) -> Iterator[tuple[str, bytes]]:
+        """Yields the death and births of the next EoN to rebirth."""
+        node = self.nodes[self.next_rebirth]
+        self.next_rebirth = (self.next_rebirth + 1) % len(self.nodes)
+        yield self.get_death(node)
+        yield from self.iter_births(node)
+
+    def _publish(self, report: SimReport, topic: str, payload: bytes, qos: int) -> None:
+        info = self.mqtt_if.publish(topic, payload, qos, False)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            report.errors += 1
+        report.sent += 1
+        report.size += len(payload)
+
+    def run(self, rate: Optional[float], duration: float, churn: Optional[float] = None,
+            qos: int = 0) -> SimReport:
+        """
+        Runs the simulation and returns its statistics.
+
+        :param rate: Messages per second to send, None to send as fast as possible.
+        :param duration: Duration of the simulation in seconds.
+        :param churn: Number of EoN rebirths per second, None for no rebirths.
+        """
+        report = SimReport(rate)
+        # Births and deaths are sent before DATA
+        lifecycle = deque(msg for node in self.nodes for msg in self.iter_births(node))
+        report.births = len(lifecycle)
+        data = self.iter_data()
+        start = time.monotonic()
+        next_churn = start + 1 / churn if churn else None
+        try:
+            while time.monotonic() - start < duration:
+                if next_churn is not None and time.monotonic() >= next_churn:
+                    lifecycle.extend(self.iter_rebirth())
+                    report.deaths += 1
+                    report.births += len(self.nodes[0].dev_ids) + 1
+                    next_churn += 1 / churn
+                (topic, payload) = lifecycle.popleft() if lifecycle else next(data)
+                if rate is not None:
+                    delay = start + report.sent / rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                self._publish(report, topic, payload, qos)
+        except KeyboardInterrupt:
+            print("Simulation interrupted")
+        report.duration = time.monotonic() - start
+        return report
@@ -0,0 +1,85 @@
+"""Columnar decoding of Sparkplug DataSet values."""
+import csv
+from array import array
+from typing import Iterator, Optional
+
+import sparkplug_b_pb2
+
+import sp_helpers
+
+# Whether DataSet elements have a null flag, depending on the Sparkplug version
+_HAS_NULL_FLAG = "is_null" in \
+    sparkplug_b_pb2.Payload.DataSet.DataSetValue.DESCRIPTOR.fields_by_name
+
+# Array typecode holding the raw values of each datatype, as stored in a DataSet element
+_RAW_TYPECODES = {
+    "int_value": "I",
+    "long_value": "Q",
+    "float_value": "f",
+    "double_value": "d",
+    "boolean_value": "B",
+}
+
+
+class DataSetColumns:
+    """
+    Values of a DataSet decoded column by column.
+
+    The rows are read in a single pass, numeric columns being stored in typed
+    arrays and converted to their datatype as a whole.
+    """
+
+    def __init__(self, dataset):
+        self.names = list(dataset.columns)
+        self.types = list(dataset.types)
+        fields = [sp_helpers.get_value_field(datatype) for datatype in self.types]
+        self.columns: list = [array(_RAW_TYPECODES[field]) if field in _RAW_TYPECODES else []
+                              for field in fields]
+        self.nulls = [bytearray() for _ in self.types]
+        self.row_count = len(dataset.rows)
+        defaults = [0 if isinstance(column, array) else None for column in self.columns]
+        decoders = list(zip(range(len(fields)), fields, self.columns, self.nulls, defaults))
+        for row in dataset.rows:
+            elements = row.elements
+            count = len(elements)
+            for (idx, field, column, nulls, default) in decoders:
+                if (idx < count and field is not None
+                        and not (_HAS_NULL_FLAG and elements[idx].is_null)):
+                    column.append(getattr(elements[idx], field))
+                    nulls.append(0)
+                else:
+                    column.append(default)
+                    nulls.append(1)
+        for (idx, datatype) in enumerate(self.types):
+            if datatype in sp_helpers.int_value_types + sp_helpers.long_value_types:
+                self.columns[idx] = sp_helpers.convert_values(datatype, self.columns[idx])
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def get_value(self, column: int, row: int):
+        """Returns the value of a cell, None if it is null."""
+        if self.nulls[column][row]:
+            return None
+        value = self.columns[column][row]
+        if self.types[column] in sp_helpers.boolean_value_types:
+            return bool(value)
+        return value
+
+    def iter_column(self, column: int) -> Iterator[Optional[object]]:
+        """Yields the values of a column, None for null values."""
+        values = self.columns[column]
+        if self.types[column] in sp_helpers.boolean_value_types:
+            values = map(bool, values)
+        for (value, null) in zip(values, self.nulls[column]):
+            yield None if null else value
+
+    def iter_rows(self) -> Iterator[tuple]:
+        """Yields the rows as tuples of values, None for null values."""
+        return zip(*(self.iter_column(column) for column in range(len(self.columns))))
+
+    def write_csv(self, file) -> None:
+        """Writes the DataSet to a CSV file, row by row, null values being left empty."""
+        writer = csv.writer(file)
+        writer.writerow(self.names)
+        writer.writerows(self.iter_rows())
@@ -1,16 +1,74 @@
 """Manages Edge Of Netork or Devices."""
+import threading
+import time
+from typing import Optional
+
 from sp_topic import SPTopic
 from sp_id import SPId
 from sp_helpers import MsgType
-import sp_helpers
-
-
+from metric_store import MetricStore
+from metric_history import MetricHistory
+
+# Number of attempts of a reader to read while the metrics are not written,
+# before it takes the write lock
+READ_RETRIES = 100
+
+
+def read_versioned(owner, lock, func, *args):
+    """
+    Calls func(*args) until it ran while the version of owner was even and
+    unchanged, and returns its result. After READ_RETRIES attempts, func is
+    called while holding the lock of the writers of owner.
+    """
+    for _ in range(READ_RETRIES):
+        version = owner.version
+        if not version & 1:
+            res = func(*args)
+            if owner.version == version:
+                return res
+        time.sleep(0)
+    with lock:
+        return func(*args)
+
+
+# pylint: disable=too-many-instance-attributes
 class SPDev:
-    """Base class for Edge of Network Nodes or Devices"""
+    """Base class for Edge of Network Nodes or Devices
+
+    Metrics are kept in a compact MetricStore whose slots are indexed by metric
+    name and alias, so that DATA messages are resolved without scanning the
+    metrics and written in place. Metric objects are only built on demand.
+
+    The version is incremented before and after the metrics are written, so
+    that readers in other threads can tell whether they read a consistent state
+    without locking the writer. Readers that keep seeing the metrics written
+    take the lock held by the writer, so that a busy writer cannot starve them.
+
+    The seq is the sequence number of the last BIRTH/DATA message received.
+    A restored EoN/Device was loaded from a persisted snapshot and has not
+    sent any message since.
+
+    The watches of each slot are replaced, never modified, when watches are
+    added or removed; slots without watches are not in the dict. The (slot,
+    watch) pairs whose value matched at the last update are kept apart, and
+    only modified by the thread handling received messages, which drops those
+    of the removed watches.
+    """
     def __init__(self, sp_id: SPId, metrics):
         self.sp_id = sp_id
         self.parent = None
-        self.metrics = list(metrics)
+        self.store = MetricStore(metrics)
+        for alias in self.store.schema.duplicate_aliases:
+            print(f"Alias {alias} of more than one metric in {self.get_handle()}, "
+                  "keeping the first one")
+        self.histories: dict[int, MetricHistory] = {}
+        self.version = 0
+        self.write_lock = threading.Lock()
+        self.seq: Optional[int] = None
+        self.restored = False
+        self.watches: dict[int, tuple] = {}
+        self.watch_matches: set[tuple] = set()
+        self.removed_watches: frozenset = frozenset()
 
     def __repr__(self):
         return f"{type(self).__name__}(\"{str(self.sp_id)}\")"
@@ -27,38 +85,103 @@ class SPDev:
         """Returns True if this is a device."""
         return self.sp_id.is_dev()
 
-    def add_metric(self, new_metric):
-        """Add a metric to a device
+    @property
+    def metrics(self) -> list:
+        """Returns metric objects built from all the slots."""
+        return list(self.iter_metrics())
+
+    def iter_metrics(self):
+        """Builds and yields the metric objects of all the slots one by one."""
+        for slot in range(len(self.store)):
+            yield self.store.build_metric(slot)
+
+    def build_metric(self, slot: int):
+        """Builds the metric object of a slot."""
+        return self.store.build_metric(slot)
+
+    def begin_write(self) -> None:
+        """Marks the metrics as being written."""
+        self.write_lock.acquire()  # pylint: disable=consider-using-with
+        self.version += 1
+
+    def end_write(self) -> None:
+        """Marks the metrics as written."""
+        self.version += 1
+        self.write_lock.release()
+
+    def read_consistent(self, func, *args):
+        """
+        Calls func(*args) until it ran while the metrics were not written and
+        returns its result. After READ_RETRIES attempts, func is called while
+        holding the write lock.
+        """
+        return read_versioned(self, self.write_lock, func, *args)
+
+    def read_metrics(self) -> list:
+        """Returns metric objects built from all the slots, consistent with each other."""
+        return self.read_consistent(lambda: self.metrics)
 
-        The alias of the added metric must not already exists in the metrics
-        attached to the Device
+    def read_metric(self, name, alias=None):
+        """Returns the metric object with the given name or alias, None if there is none."""
+        return self.read_consistent(self.get_metric, name, alias)
+
+    def get_slot_value(self, slot: int):
+        """
+        Returns the value of a slot, None if it is null. Numbers are converted
+        to their datatype, other values are returned as received.
         """
-        for metric in self.metrics:
-            assert metric.alias == new_metric.alias, \
-                f"Alias {metric.alias} already exists in device"
-        self.metrics.append(new_metric)
+        if self.store.is_numeric(slot):
+            return self.store.get_typed_value(slot)
+        return self.store.get_value(slot)
+
+    def get_metric_names(self) -> tuple:
+        """Returns the names of the metrics."""
+        return self.store.schema.names
 
-    def update_metric(self, new_metric):
+    def find_slot(self, metric) -> Optional[int]:
+        """Returns the slot of the registered metric matching a received metric.
+
+        The metric is looked up by name if present, or by alias otherwise.
+        """
+        schema = self.store.schema
+        if metric.name:
+            return schema.slots_by_name.get(metric.name)
+        if metric.HasField("alias"):
+            return schema.slots_by_alias.get(metric.alias)
+        return None
+
+    def update_metric(self, new_metric) -> Optional[int]:
         """Update a device metric.
-        
-        The registered metric's value is updated with a new value received from
-        the device.
+
+        The registered metric's value is updated in place with a new value
+        received from the device. Name, alias and datatype may be omitted from
+        the received metric, as in alias-only DATA.
+        Returns the slot of the updated metric or None if it is unknown.
         """
-        for idx, metric in enumerate(self.metrics):
-            if sp_helpers.is_same_metric(metric, new_metric):
-                self.metrics[idx] = new_metric
-                return
+        slot = self.find_slot(new_metric)
+        if slot is not None:
+            datatype = self.store.schema.datatypes[slot]
+            if ((not new_metric.HasField("datatype") or new_metric.datatype == datatype)
+                    and self.store.write(slot, new_metric)):
+                return slot
         print(f"No metric {new_metric.name}/{new_metric.alias} "
               f"in {self.get_handle()}")
+        return None
+
+    def get_slot(self, name, alias=None) -> Optional[int]:
+        """Get the slot of a metric from its name or alias"""
+        schema = self.store.schema
+        slot = schema.slots_by_name.get(name)
+        if slot is None and alias is not None:
+            slot = schema.slots_by_alias.get(alias)
+        return slot
 
     def get_metric(self, name, alias=None):
         """Get metric object from its name or alias"""
-        for metric in self.metrics:
-            if metric.name == name:
-                return metric
-            if alias is not None and metric.alias == alias:
-                return metric
-        return None
+        slot = self.get_slot(name, alias)
+        if slot is None:
+            return None
+        return self.store.build_metric(slot)
 
     def get_msg_topic(self, msg_type: MsgType) -> SPTopic:
         """Return message topic for SPDev's."""
@@ -73,18 +196,18 @@ class EdgeNode(SPDev):
     """Edge of Network Node."""
     def __init__(self, sp_id: SPId, metrics):
         super().__init__(sp_id, metrics)
-        self.devices: list[SPDev] = []
+        self.devices: dict[SPId, SPDev] = {}
 
     def add_dev(self, device: SPDev):
         """Adds a device to EdgeNode."""
-        if device in self.devices:
+        if device.get_id() in self.devices:
             print(f"Device {device.get_handle()} already exists")
         else:
-            self.devices.append(device)
+            self.devices[device.get_id()] = device
 
     def remove_dev(self, device: SPDev):
         """Removes a device from EdgeNode."""
-        self.devices.remove(device)
+        self.devices.pop(device.get_id(), None)
 
 class Device(SPDev):
     """Sparkplug device belonging to an EoN."""
@@ -1,6 +1,10 @@
 """Variables and helper functions to handle Sparkplug."""
 
-import ctypes
+import math
+import struct
+import sys
+from array import array
+from operator import attrgetter
 from typing import Optional
 from enum import Enum
 
@@ -41,9 +45,25 @@ _DATATYPES_STR = {
     MetricDataType.DataSet: "DataSet"
 }
 
-def ctype_converter(ctype):
-    """Returns a converter that transforms a value into a C-style variable value."""
-    return lambda value: ctype(value).value
+def int_converter(bits: int, signed: bool):
+    """
+    Returns a converter that truncates an integer to a C-style integer
+    of the given size, using bit masks.
+    """
+    mask = (1 << bits) - 1
+    if not signed:
+        return lambda value: value & mask
+    sign = 1 << (bits - 1)
+    return lambda value: ((value & mask) ^ sign) - sign
+
+_FLOAT_STRUCT = struct.Struct("f")
+
+def float_converter(value):
+    """Rounds a value to a C-style single precision float."""
+    try:
+        return _FLOAT_STRUCT.unpack(_FLOAT_STRUCT.pack(value))[0]
+    except OverflowError:
+        return math.copysign(math.inf, value)
 
 def string_value_converter(string):
     """Adds quotes and length to a string value."""
@@ -51,19 +71,19 @@ def string_value_converter(string):
 
 #Functions to convert a metric/property value to the appropriate type
 _FROM_DTYPE_CONVERTERS = {
-    MetricDataType.Int8: ctype_converter(ctypes.c_int8),
-    MetricDataType.Int16: ctype_converter(ctypes.c_int16),
-    MetricDataType.Int32: ctype_converter(ctypes.c_int32),
-    MetricDataType.Int64: ctype_converter(ctypes.c_int64),
-    MetricDataType.UInt8: ctype_converter(ctypes.c_uint8),
-    MetricDataType.UInt16: ctype_converter(ctypes.c_uint16),
-    MetricDataType.UInt32: ctype_converter(ctypes.c_uint32),
-    MetricDataType.UInt64: ctype_converter(ctypes.c_uint64),
-    MetricDataType.Float: ctype_converter(ctypes.c_float),
-    MetricDataType.Double: ctype_converter(ctypes.c_double),
+    MetricDataType.Int8: int_converter(8, True),
+    MetricDataType.Int16: int_converter(16, True),
+    MetricDataType.Int32: int_converter(32, True),
+    MetricDataType.Int64: int_converter(64, True),
+    MetricDataType.UInt8: int_converter(8, False),
+    MetricDataType.UInt16: int_converter(16, False),
+    MetricDataType.UInt32: int_converter(32, False),
+    MetricDataType.UInt64: int_converter(64, False),
+    MetricDataType.Float: float_converter,
+    MetricDataType.Double: float,
     MetricDataType.Boolean: bool,
     MetricDataType.String: string_value_converter,
-    MetricDataType.DateTime: ctype_converter(ctypes.c_uint64),
+    MetricDataType.DateTime: int_converter(64, False),
     MetricDataType.Text: string_value_converter,
     MetricDataType.UUID: string_value_converter,
     MetricDataType.Bytes: bytearray,
@@ -75,19 +95,19 @@ _FROM_DTYPE_CONVERTERS = {
 # for storage in a metric/property.
 #
 _TO_DTYPES_CONVERTERS = {
-    MetricDataType.Int8: ctype_converter(ctypes.c_uint32),
-    MetricDataType.Int16: ctype_converter(ctypes.c_uint32),
-    MetricDataType.Int32: ctype_converter(ctypes.c_uint32),
-    MetricDataType.Int64: ctype_converter(ctypes.c_uint64),
-    MetricDataType.UInt8: ctype_converter(ctypes.c_uint32),
-    MetricDataType.UInt16: ctype_converter(ctypes.c_uint32),
-    MetricDataType.UInt32: ctype_converter(ctypes.c_uint32),
-    MetricDataType.UInt64: ctype_converter(ctypes.c_uint64),
-    MetricDataType.Float: ctype_converter(ctypes.c_float),
-    MetricDataType.Double: ctype_converter(ctypes.c_double),
+    MetricDataType.Int8: int_converter(32, False),
+    MetricDataType.Int16: int_converter(32, False),
+    MetricDataType.Int32: int_converter(32, False),
+    MetricDataType.Int64: int_converter(64, False),
+    MetricDataType.UInt8: int_converter(32, False),
+    MetricDataType.UInt16: int_converter(32, False),
+    MetricDataType.UInt32: int_converter(32, False),
+    MetricDataType.UInt64: int_converter(64, False),
+    MetricDataType.Float: float_converter,
+    MetricDataType.Double: float,
     MetricDataType.Boolean: bool,
     MetricDataType.String: str,
-    MetricDataType.DateTime: ctype_converter(ctypes.c_uint64),
+    MetricDataType.DateTime: int_converter(64, False),
     MetricDataType.Text: str,
     MetricDataType.UUID: str,
     MetricDataType.Bytes: bytearray,
@@ -116,6 +136,55 @@ _DTYPE_TO_VAR = {
     MetricDataType.Template: "template_value"
 }
 
+
+def _make_getter(field: str, converter):
+    """Returns a function reading a value from a container and converting it."""
+    get = attrgetter(field)
+    if converter is None:
+        return get
+    return lambda container: converter(get(container))
+
+def _make_setter(field: str, converter):
+    """Returns a function converting a value and storing it in a container."""
+    if converter is None:
+        return lambda container, value: setattr(container, field, value)
+    return lambda container, value: setattr(container, field, converter(value))
+
+# Functions reading a metric/property value according to its datatype
+_GETTERS = {datatype: _make_getter(field, _FROM_DTYPE_CONVERTERS.get(datatype))
+            for (datatype, field) in _DTYPE_TO_VAR.items()}
+
+# Functions storing a value in a metric/property according to its datatype
+_SETTERS = {datatype: _make_setter(field, _TO_DTYPES_CONVERTERS.get(datatype))
+            for (datatype, field) in _DTYPE_TO_VAR.items()}
+
+def _reinterpret(raw: array, typecode: str, ratio: int) -> array:
+    """
+    Returns the least significant part of each raw value as an array of typecode,
+    ratio being the number of typecode items per raw value.
+    """
+    res = array(typecode, raw.tobytes())
+    if ratio == 1:
+        return res
+    low = 0 if sys.byteorder == "little" else ratio - 1
+    return res[low::ratio]
+
+#
+# Functions to convert arrays of raw integer values, with typecode I for
+# int_value and Q for long_value, to the appropriate type as a whole.
+#
+_ARRAY_CONVERTERS = {
+    MetricDataType.Int8: lambda raw: _reinterpret(raw, "b", 4),
+    MetricDataType.Int16: lambda raw: _reinterpret(raw, "h", 2),
+    MetricDataType.Int32: lambda raw: _reinterpret(raw, "i", 1),
+    MetricDataType.Int64: lambda raw: _reinterpret(raw, "q", 1),
+    MetricDataType.UInt8: lambda raw: _reinterpret(raw, "B", 4),
+    MetricDataType.UInt16: lambda raw: _reinterpret(raw, "H", 2),
+    MetricDataType.UInt32: lambda raw: _reinterpret(raw, "I", 2),
+    MetricDataType.UInt64: lambda raw: raw,
+    MetricDataType.DateTime: lambda raw: raw,
+}
+
 int_value_types = [MetricDataType.Int8,
                    MetricDataType.Int16,
                    MetricDataType.Int32,
@@ -184,22 +253,47 @@ def datatype_to_str(datatype) -> str:
     """Converts a Sparkplug datatype to a string."""
     return _DATATYPES_STR.get(datatype, "Unknown")
 
+def get_value_field(datatype) -> Optional[str]:
+    """Returns the name of the metric attribute holding a value of the given datatype."""
+    if datatype == MetricDataType.DataSet:
+        return "dataset_value"
+    return _DTYPE_TO_VAR.get(datatype)
+
+def _get_none(_container):
+    return None
+
 def get_typed_value(datatype, container):
     """Returns the value with the given datatype from a container."""
-    if datatype in _DTYPE_TO_VAR:
-        value = getattr(container, _DTYPE_TO_VAR[datatype])
-        if datatype in _FROM_DTYPE_CONVERTERS:
-            converter = _FROM_DTYPE_CONVERTERS[datatype]
-            value = converter(value)
+    return _GETTERS.get(datatype, _get_none)(container)
+
+def convert_value(datatype, value):
+    """Converts a raw metric/property value to the given datatype."""
+    converter = _FROM_DTYPE_CONVERTERS.get(datatype)
+    if converter is None:
         return value
-    return None
+    return converter(value)
+
+def convert_values(datatype, values):
+    """
+    Converts raw metric/property values, such as a DataSet column, to the given datatype.
+
+    Arrays of raw integer values are converted as a whole and an array is
+    returned, other values are returned as a list.
+    """
+    if isinstance(values, array):
+        array_converter = _ARRAY_CONVERTERS.get(datatype)
+        if array_converter is not None:
+            return array_converter(values)
+    converter = _FROM_DTYPE_CONVERTERS.get(datatype)
+    if converter is None:
+        return list(values)
+    return list(map(converter, values))
 
 def set_typed_value(datatype, container, value):
     """Sets the appropriate container attribute according to the datatype."""
-    if datatype in _DTYPE_TO_VAR:
-        if datatype in _TO_DTYPES_CONVERTERS:
-            value = _TO_DTYPES_CONVERTERS[datatype](value)
-        setattr(container, _DTYPE_TO_VAR[datatype], value)
+    setter = _SETTERS.get(datatype)
+    if setter is not None:
+        setter(container, value)
 
 def is_same_metric(metric_a, metric_b):
     """Helper function to compare metrics.
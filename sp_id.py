@@ -1,19 +1,22 @@
 """Sparkplug ID management."""
 
+from dataclasses import dataclass
 from typing import Optional
 
 import sp_helpers
 
+@dataclass(frozen=True)
 class SPId:
-    """Handles the ID of a Sparkplug EoN/device."""
+    """Handles the ID of a Sparkplug EoN/device.
 
-    def __init__(self, group_id: str, eon_id: str, dev_id: Optional[str] = None):
-        self.group_id = group_id
-        self.eon_id = eon_id
-        self.dev_id = dev_id
+    Ids are immutable and hashable so they can be used as keys of the fleet index.
+    """
+    group_id: str
+    eon_id: str
+    dev_id: Optional[str] = None
 
     @staticmethod
-    def from_str(topic: str) -> Optional[str]:
+    def from_str(topic: str) -> Optional["SPId"]:
         """Create a SPId object from a topic string"""
         tokens = topic.split("/")
         if (len(tokens) == 4 or len(tokens) == 5) and tokens[0] == sp_helpers.SP_NAMESPACE:
@@ -21,14 +24,23 @@ class SPId:
             return SPId(*tokens[1:])
         return None
 
+    @staticmethod
+    def from_handle(handle: str) -> Optional["SPId"]:
+        """Create a SPId object from a handle as returned by __str__()"""
+        tokens = handle.split("/")
+        if len(tokens) == 2 or len(tokens) == 3:
+            return SPId(*tokens)
+        return None
+
     def __str__(self) -> str:
         """Returns a string representation of the Id."""
         return f"{self.group_id}/{self.eon_id}{sp_helpers.get_dev_id_str(self.dev_id)}"
 
-    def __eq__(self, other) -> bool:
-        return ((self.group_id == other.group_id)
-                and (self.eon_id == other.eon_id)
-                and (self.dev_id == other.dev_id))
+    def get_eon_id(self) -> "SPId":
+        """Returns the Id of the EoN this Id belongs to."""
+        if self.dev_id is None:
+            return self
+        return SPId(self.group_id, self.eon_id)
 
     def is_eon(self) -> bool:
         """Returns True if this Id belongs to an EoN."""
@@ -1,14 +1,49 @@
 """Sparkplug Nodes and Devices Management."""
 
-from copy import copy
+import re
+import threading
+import time
+from contextlib import contextmanager
+from fnmatch import translate
 from typing import Optional
 
-from sp_dev import SPDev, EdgeNode, Device
+from sp_dev import SPDev, EdgeNode, Device, read_versioned
 from sp_id import SPId
 from ui import UI, UIStub
+from metric_history import HistoryStore
+from metric_index import MetricIndex
+from metric_watch import Watch, WatchHooks
+from sp_snapshot import NetSnapshot
 
-class SPNet():
-    """Manage a fleet of Sparkplug Nodes and devices."""
+# Metric update notification modes
+NOTIFY_EACH = "each"
+NOTIFY_COALESCED = "coalesced"
+NOTIFY_MODES = [NOTIFY_EACH, NOTIFY_COALESCED]
+
+class SPNet():  # pylint: disable=too-many-instance-attributes, too-many-public-methods
+    """Manage a fleet of Sparkplug Nodes and devices.
+
+    EoNs and devices are indexed by their Sparkplug Id so that lookups, births
+    and deaths do not depend on the size of the fleet.
+
+    Metric updates are either notified to the UI one by one, or marked dirty
+    and notified in batches when flush_updates() is called.
+
+    Readers in other threads than the one handling received messages use
+    get_snapshot(): the version is incremented before and after each change of
+    the fleet, so that a snapshot is only taken while the fleet is not changing.
+    Readers that keep seeing the fleet changing take the lock held during the
+    changes.
+
+    The metrics of the EoNs/devices are indexed by name when they are born, so
+    that find_metrics() answers in time proportional to the number of matches.
+
+    Watches are attached to the slots of the metrics they apply to, so that
+    DATA messages only evaluate the watches of the metrics they update.
+    Watches are added and removed by copying the dicts they are kept in, while
+    holding watch_lock, so that the thread handling received messages reads
+    them without locking.
+    """
     __instance = None
 
     def __new__(cls):
@@ -18,88 +53,391 @@ class SPNet():
 
     def __init__(self):
         if "eon_nodes" not in self.__dict__:
-            self.eon_nodes = []
+            self.eon_nodes: dict[SPId, EdgeNode] = {}
+            self.index: dict[SPId, SPDev] = {}
             self.ui: UI = UIStub()
+            self.notify_mode = NOTIFY_EACH
+            self.dirty: dict[SPDev, dict[int, int]] = {}
+            self.dirty_lock = threading.Lock()
+            self.history = HistoryStore()
+            self.version = 0
+            self.changes = 0
+            self.change_lock = threading.RLock()
+            self.change_events: list = []
+            self.snapshot: Optional[NetSnapshot] = None
+            self.metric_index = MetricIndex()
+            self.watches: dict[int, Watch] = {}
+            self.next_watch_id = 1
+            self.watch_lock = threading.Lock()
+            self.watch_hooks = WatchHooks()
 
     def set_ui(self, ui: UI) -> None:
         """Sets the user interface object to send events to."""
         if self.ui is not None:
             self.ui = ui
 
+    def set_notify_mode(self, mode: str) -> None:
+        """Sets how metric updates are notified to the UI.
+
+        Pending updates are flushed when leaving the coalesced mode.
+        """
+        assert mode in NOTIFY_MODES, f"Unknown notification mode {mode}"
+        self.notify_mode = mode
+        if mode == NOTIFY_EACH:
+            self.flush_updates()
+
+    @contextmanager
+    def changing(self):
+        """
+        Context in which the fleet is changed, nested changes are seen as a single one.
+        The UI is notified of the added and removed EoNs/devices once the change is done.
+        """
+        self.change_lock.acquire()  # pylint: disable=consider-using-with
+        self.changes += 1
+        if self.changes == 1:
+            self.version += 1
+        try:
+            yield
+        finally:
+            self.changes -= 1
+            done = not self.changes
+            if done:
+                self.version += 1
+            self.change_lock.release()
+            if done:
+                events, self.change_events = self.change_events, []
+                for (callback, sp_dev) in events:
+                    callback(sp_dev)
+
+    def get_snapshot(self) -> NetSnapshot:
+        """
+        Returns a consistent view of the EoNs and devices of the fleet, taken
+        without blocking the changes unless the fleet keeps changing. A new view
+        is only taken if the fleet changed since the last one.
+        """
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+        (version, items) = self.read_consistent(lambda: (self.version,
+                                                         tuple(self.index.items())))
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.version != version:
+            snapshot = NetSnapshot(version, items)
+            self.snapshot = snapshot
+        return snapshot
+
+    def get_counts(self) -> tuple[int, int]:
+        """Returns the number of EoNs and devices of the fleet, without walking it."""
+        (eons, entries) = self.read_consistent(lambda: (len(self.eon_nodes), len(self.index)))
+        return (eons, entries - eons)
+
+    def read_consistent(self, func, *args):
+        """
+        Calls func(*args) until it ran while the fleet was not changing and
+        returns its result. After READ_RETRIES attempts, func is called while
+        holding the change lock.
+        """
+        return read_versioned(self, self.change_lock, func, *args)
+
+    def flush_updates(self) -> None:
+        """Notifies the UI of the metrics updated since the last flush.
+
+        For each metric, only its latest value is notified along with the
+        number of updates that were suppressed.
+        """
+        with self.dirty_lock:
+            dirty, self.dirty = self.dirty, {}
+        if dirty:
+            updates = {sp_dev: [(sp_dev.read_consistent(sp_dev.build_metric, slot), count - 1)
+                                for (slot, count) in slots.items()]
+                       for (sp_dev, slots) in dirty.items()}
+            self.ui.on_metrics_updated(updates)
+
     def __str__(self):
         display = ""
-        for eon in self.eon_nodes:
+        for eon in self.eon_nodes.values():
             display += str(eon)
         return display
 
     def find_handle(self, handle: str) -> Optional[SPDev]:
         """Returns an EoN or Device from its handle."""
-        tokens = handle.split("/")
-        if len(tokens) == 2 or len(tokens) == 3:
-            sp_id = SPId(*tokens)
-            if sp_id:
-                return self.find_id(sp_id)
-        return None
+        sp_id = SPId.from_handle(handle)
+        return self.find_id(sp_id) if sp_id is not None else None
+
+    def find_handles(self, pattern: str, regex: bool = False) -> list[SPDev]:
+        """
+        Returns the EoNs and Devices whose handle matches a pattern.
+
+        :param pattern: A glob pattern, or a regular expression matched against
+        the whole handle if regex is True. Raises re.error if it is invalid.
+        """
+        matcher = re.compile(pattern if regex else translate(pattern)).fullmatch
+        return [sp_dev for (sp_id, sp_dev) in self.get_snapshot().index.items()
+                if matcher(str(sp_id))]
+
+    def find_metrics(self, pattern: str, regex: bool = False) -> list[tuple[SPDev, int]]:
+        """
+        Returns the (EoN/Device, slot) of the metrics whose name matches a pattern,
+        taken while the fleet is not changing.
+
+        :param pattern: A glob pattern, or a regular expression matched against
+        the whole name if regex is True. Raises re.error if it is invalid.
+        """
+        return self.read_consistent(self.metric_index.find, pattern, regex)
 
     def find_id(self, sp_id: SPId) -> Optional[SPDev]:
         """Find an EoN or a device from its Id"""
-        eon: Optional[EdgeNode] = self.find_eon(sp_id)
-        if eon is None or sp_id.is_eon():
-            return eon
-        return next((dev for dev in eon.devices
-                     if dev.get_id() == sp_id), None)
+        return self.index.get(sp_id)
 
     def find_eon(self, sp_id: SPId) -> Optional[EdgeNode]:
         """Find the EoN from a sparkplug Id while ignoring the device Id part."""
-        tmp = copy(sp_id)
-        tmp.dev_id = None
-        return next((eon for eon in self.eon_nodes
-                     if eon.get_id() == tmp), None)
+        return self.eon_nodes.get(sp_id.get_eon_id())
 
-    def add_from_birth(self, sp_id: SPId, metrics) -> None:
+    def add_from_birth(self, sp_id: SPId, metrics, seq: Optional[int] = None) -> bool:
         """
         Adds an EoN/Device from a BIRTH message.
 
+        A device or EoN that is born again replaces the previous instance.
+        Returns False if the EoN of a device is unknown.
+
         :param sp_id: The ID used in the BIRTH message/
         :param metrics: The metrics in the BIRTH message's payload.
+        :param seq: The sequence number of the BIRTH message, if any.
         """
-        eon = self.find_eon(sp_id)
-        if sp_id.is_eon():
-            if eon is not None:
-                self.remove_by_dev(eon)
-            eon = EdgeNode(sp_id, metrics)
-            self.eon_nodes.append(eon)
-            self.ui.on_device_added(eon)
-        elif eon is not None:
-            dev = Device(sp_id, metrics, eon)
-            eon.add_dev(dev)
-            self.ui.on_device_added(dev)
-        else:
-            print(f"Device birth ({sp_id}) with unknown EoN")
+        # The new instance is indexed before the previous one is removed, so
+        # that a schema they share is not unindexed and indexed again
+        with self.changing():
+            eon = self.find_eon(sp_id)
+            if sp_id.is_eon():
+                new_eon = EdgeNode(sp_id, metrics)
+                new_eon.seq = seq
+                self.metric_index.add(new_eon)
+                if eon is not None:
+                    self.remove_by_dev(eon)
+                self.eon_nodes[sp_id] = new_eon
+                self.index[sp_id] = new_eon
+                if self.watches:
+                    self.attach_watches(new_eon)
+                self.change_events.append((self.ui.on_device_added, new_eon))
+            elif eon is not None:
+                dev = Device(sp_id, metrics, eon)
+                dev.seq = seq
+                self.metric_index.add(dev)
+                old_dev = eon.devices.get(sp_id)
+                if old_dev is not None:
+                    self.remove_by_dev(old_dev)
+                eon.add_dev(dev)
+                self.index[sp_id] = dev
+                if self.watches:
+                    self.attach_watches(dev)
+                self.change_events.append((self.ui.on_device_added, dev))
+            else:
+                print(f"Device birth ({sp_id}) with unknown EoN")
+                return False
+        return True
+
+    def restore(self, sp_id: SPId, metrics, seq: Optional[int] = None) -> bool:
+        """
+        Adds an EoN/Device loaded from a persisted snapshot. It is marked as
+        restored until it sends a DATA message, or replaced when it is born again.
+        Returns False if the EoN of a device is unknown.
+        """
+        with self.changing():
+            if not self.add_from_birth(sp_id, metrics, seq):
+                return False
+            self.index[sp_id].restored = True
+        return True
 
     def remove_by_dev(self, sp_dev: SPDev) -> None:
-        """Removes the given EoN/Device from the fleet."""
-        if sp_dev.is_eon():
-            self.eon_nodes.remove(sp_dev)
-            self.ui.on_device_removed(sp_dev)
-        else:
-            eon = self.find_eon(sp_dev.get_id())
-            if eon:
-                eon.devices.remove(sp_dev)
-                self.ui.on_device_removed(sp_dev)
+        """Removes the given EoN/Device from the fleet.
+
+        Removing an EoN also removes its devices.
+        """
+        with self.changing():
+            sp_id = sp_dev.get_id()
+            if self.index.get(sp_id) is not sp_dev:
+                return
+            del self.index[sp_id]
+            self.metric_index.remove(sp_dev)
+            self.release_history(sp_dev)
+            if sp_dev.is_eon():
+                del self.eon_nodes[sp_id]
+                for (dev_id, dev) in sp_dev.devices.items():
+                    self.index.pop(dev_id, None)
+                    self.metric_index.remove(dev)
+                    self.release_history(dev)
+            else:
+                sp_dev.parent.remove_dev(sp_dev)
+            self.change_events.append((self.ui.on_device_removed, sp_dev))
 
-    def remove_by_id(self, sp_id: SPId) -> None:
-        """Removes the EoN/Device with the given ID from the fleet."""
+    def remove_by_id(self, sp_id: SPId) -> bool:
+        """
+        Removes the EoN/Device with the given ID from the fleet.
+        Returns False if it is unknown.
+        """
         sp_dev = self.find_id(sp_id)
-        if sp_dev:
-            self.remove_by_dev(sp_dev)
-
-    def update_metrics(self, sp_id: SPId, metrics) -> None:
-        """Updates the metrics of the device with the given Id."""
-        sp_dev: Optional[SPDev] = SPNet().find_id(sp_id)
-        if sp_dev is not None:
-            for metric in metrics:
-                sp_dev.update_metric(metric)
-                self.ui.on_metric_updated(sp_dev, metric)
-        else:
+        if sp_dev is None:
+            return False
+        self.remove_by_dev(sp_dev)
+        return True
+
+    def update_metrics(self, sp_id: SPId, metrics, seq: Optional[int] = None) -> bool:
+        """
+        Updates the metrics of the device with the given Id.
+        Returns False if it is unknown.
+        """
+        sp_dev: Optional[SPDev] = self.find_id(sp_id)
+        if sp_dev is None:
             print(f"DATA from unknown device {sp_id}")
+            return False
+        sp_dev.begin_write()
+        try:
+            if seq is not None:
+                sp_dev.seq = seq
+            sp_dev.restored = False
+            slots = [sp_dev.update_metric(metric) for metric in metrics]
+        finally:
+            sp_dev.end_write()
+        if sp_dev.histories or self.history.is_enabled():
+            self.record_history(sp_dev, slots)
+        if sp_dev.watches or sp_dev.removed_watches:
+            self.check_watches(sp_dev, slots)
+        if self.notify_mode == NOTIFY_EACH:
+            for slot in slots:
+                if slot is not None:
+                    self.ui.on_metric_updated(sp_dev, slot)
+        else:
+            updated = [slot for slot in slots if slot is not None]
+            if updated:
+                with self.dirty_lock:
+                    dirty = self.dirty.setdefault(sp_dev, {})
+                    for slot in updated:
+                        dirty[slot] = dirty.get(slot, 0) + 1
+        return True
+
+    def record_history(self, sp_dev: SPDev, slots) -> None:
+        """Appends the values of the updated numeric slots to their history.
+
+        History buffers are allocated on the first update of a slot, as long
+        as the memory budget allows it.
+        """
+        store = sp_dev.store
+        for slot in slots:
+            if slot is None:
+                continue
+            history = sp_dev.histories.get(slot)
+            if history is None:
+                if not store.is_numeric(slot):
+                    continue
+                history = self.history.allocate()
+                if history is None:
+                    continue
+                sp_dev.histories[slot] = history
+            value = store.get_typed_value(slot)
+            if value is not None:
+                history.append(store.timestamps[slot] or int(time.time() * 1000), value)
+
+    def release_history(self, sp_dev: SPDev) -> None:
+        """Releases the history buffers of an EoN/Device."""
+        for history in sp_dev.histories.values():
+            self.history.release(history)
+        sp_dev.histories = {}
+
+    def add_watch(self, watch: Watch) -> int:
+        """Attaches a watch to the metrics it applies to, now and once born, returns its Id."""
+        with self.watch_lock:
+            watch.watch_id = self.next_watch_id
+            self.next_watch_id += 1
+            self.watches = {**self.watches, watch.watch_id: watch}
+        # EoNs/devices born from now on attach the watch themselves
+        found = self.find_metrics(watch.metric_pattern, watch.regex)
+        slots: dict[SPDev, list[int]] = {}
+        for (sp_dev, slot) in found:
+            if watch.applies_to(sp_dev):
+                slots.setdefault(sp_dev, []).append(slot)
+        with self.watch_lock:
+            for (sp_dev, dev_slots) in slots.items():
+                self._attach_watch(sp_dev, watch, dev_slots)
+        return watch.watch_id
+
+    def remove_watch(self, watch_id: int) -> bool:
+        """Detaches a watch from the metrics of the fleet. Returns False if it is unknown."""
+        with self.watch_lock:
+            watch = self.watches.get(watch_id)
+            if watch is None:
+                return False
+            self.watches = {key: value for (key, value) in self.watches.items()
+                            if key != watch_id}
+        found = self.find_metrics(watch.metric_pattern, watch.regex)
+        # The matches of the watch are dropped by the thread handling received
+        # messages, on the next update of each EoN/Device
+        with self.watch_lock:
+            for sp_dev in {sp_dev for (sp_dev, _slot) in found}:
+                if not watch.applies_to(sp_dev):
+                    continue
+                sp_dev.removed_watches = sp_dev.removed_watches | {watch}
+                watches = {}
+                for (slot, slot_watches) in sp_dev.watches.items():
+                    slot_watches = tuple(key for key in slot_watches if key is not watch)
+                    if slot_watches:
+                        watches[slot] = slot_watches
+                sp_dev.watches = watches
+        return True
+
+    def get_watches(self) -> list[Watch]:
+        """Returns the watches, ordered by Id."""
+        return list(self.watches.values())
+
+    def attach_watches(self, sp_dev: SPDev) -> None:
+        """Attaches the watches that apply to a newly born EoN/Device."""
+        with self.watch_lock:
+            for watch in self.watches.values():
+                if watch.applies_to(sp_dev):
+                    self._attach_watch(sp_dev, watch, watch.get_slots(sp_dev))
+
+    @staticmethod
+    def _attach_watch(sp_dev: SPDev, watch: Watch, slots: list[int]) -> None:
+        watches = dict(sp_dev.watches)
+        for slot in slots:
+            slot_watches = watches.get(slot, ())
+            if watch not in slot_watches:
+                watches[slot] = slot_watches + (watch,)
+        sp_dev.watches = watches
+
+    def check_watches(self, sp_dev: SPDev, slots) -> None:
+        """
+        Evaluates the watches of the updated slots, and triggers those the
+        value starts matching: the UI is notified and their hook is called.
+        """
+        matches = sp_dev.watch_matches
+        if sp_dev.removed_watches:
+            with self.watch_lock:
+                removed = sp_dev.removed_watches
+                sp_dev.removed_watches = frozenset()
+            if matches:
+                matches.difference_update([key for key in matches if key[1] in removed])
+        watches = sp_dev.watches
+        for slot in slots:
+            slot_watches = watches.get(slot)
+            if slot_watches is None:
+                continue
+            value = sp_dev.get_slot_value(slot)
+            for watch in slot_watches:
+                key = (slot, watch)
+                if watch.matches(value):
+                    if key not in matches:
+                        matches.add(key)
+                        self.trigger_watch(watch, sp_dev, slot, value)
+                else:
+                    matches.discard(key)
+
+    def trigger_watch(self, watch: Watch, sp_dev: SPDev, slot: int, value) -> None:
+        """
+        Notifies the UI that a watch is triggered and queues the call of its
+        hook, which runs in the thread of the watch hooks.
+        """
+        watch.triggered += 1
+        metric = sp_dev.build_metric(slot)
+        self.ui.on_watch_triggered(watch, sp_dev, metric)
+        if watch.hook is not None:
+            self.watch_hooks.submit(watch.hook, sp_dev, metric, value)
@@ -0,0 +1,49 @@
+"""Immutable views of the fleet of EoNs and devices."""
+from types import MappingProxyType
+from typing import Iterator, Optional
+
+from sp_dev import SPDev
+from sp_id import SPId
+
+
+class NetSnapshot:
+    """
+    Consistent and immutable view of the EoNs and devices of the fleet at a version.
+
+    EoN/Device objects are shared with the live fleet, their metrics are read
+    consistently with SPDev.read_metrics().
+    """
+    __slots__ = ("version", "index", "eons")
+
+    def __init__(self, version: int, items: tuple[tuple[SPId, SPDev], ...]):
+        self.version = version
+        index = dict(items)
+        devices: dict[SPId, list[SPDev]] = {sp_id: [] for (sp_id, sp_dev) in items
+                                            if sp_dev.parent is None}
+        for (_sp_id, sp_dev) in items:
+            if sp_dev.parent is not None:
+                devices[sp_dev.parent.sp_id].append(sp_dev)
+        self.index = MappingProxyType(index)
+        self.eons = MappingProxyType({sp_id: (index[sp_id], tuple(devs))
+                                      for (sp_id, devs) in devices.items()})
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def find_id(self, sp_id: SPId) -> Optional[SPDev]:
+        """Find an EoN or a device from its Id."""
+        return self.index.get(sp_id)
+
+    def find_handle(self, handle: str) -> Optional[SPDev]:
+        """Returns an EoN or Device from its handle."""
+        sp_id = SPId.from_handle(handle)
+        return self.find_id(sp_id) if sp_id is not None else None
+
+    def iter_eons(self) -> Iterator[tuple[SPDev, tuple[SPDev, ...]]]:
+        """Yields the EoNs along with their devices."""
+        yield from self.eons.values()
+
+    def get_handles(self, include_eon: bool = True, include_dev: bool = True) -> list[str]:
+        """Returns the handles of the EoNs and/or devices."""
+        return [str(sp_id) for sp_id in self.index
+                if (include_eon and sp_id.is_eon()) or (include_dev and sp_id.is_dev())]
@@ -1,30 +1,44 @@
 #!/usr/bin/env python
 """Sparkplug Topic management tools."""
 
-from typing import Optional
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Union
 import sp_helpers
 from sp_helpers import MsgType
 from sp_id import SPId
 
+# Maximum number of distinct topics kept in the parse cache
+TOPIC_CACHE_SIZE = 65536
 
+
+@dataclass(frozen=True)
 class SPTopic:
-    """Handles a Sparkplug Topic."""
+    """Handles a Sparkplug Topic.
+
+    Topics are immutable so that parsed topics can be shared through the parse cache.
+    """
+    sp_id: SPId
+    msg_type: MsgType
 
     @staticmethod
-    def from_str(topic: str) -> Optional[str]:
-        """Create Sparkplug Topic from a string"""
-        tokens = topic.split("/")
-        sp_id = SPId.from_str(topic)
-        msg_type: Optional[MsgType] = sp_helpers.msg_type_from_str(tokens[2])
-        if sp_id and msg_type:
-            return SPTopic(sp_id, msg_type)
-        return None
+    def from_str(topic: Union[str, bytes]) -> Optional["SPTopic"]:
+        """Create Sparkplug Topic from a string
 
-    def __init__(self,
-                 sp_id: SPId,
-                 msg_type: MsgType):
-        self.sp_id = sp_id
-        self.msg_type = msg_type
+        Parsed topics are cached so a topic that was already seen is neither
+        split nor allocated again.
+        """
+        return _parse_topic(topic)
+
+    @staticmethod
+    def cache_info():
+        """Returns the hits, misses, maxsize and currsize of the parse cache."""
+        return _parse_topic.cache_info()
+
+    @staticmethod
+    def cache_clear() -> None:
+        """Empties the parse cache and resets its statistics."""
+        _parse_topic.cache_clear()
 
     def get_id(self) -> SPId:
         """Returns the Sparplug Id."""
@@ -44,3 +58,17 @@ class SPTopic:
         topic += "/" + self.sp_id.eon_id
         topic += sp_helpers.get_dev_id_str(self.sp_id.dev_id)
         return topic
+
+
+@lru_cache(maxsize=TOPIC_CACHE_SIZE)
+def _parse_topic(topic: Union[str, bytes]) -> Optional[SPTopic]:
+    """Parses a topic string in a single split."""
+    if isinstance(topic, bytes):
+        topic = topic.decode()
+    tokens = topic.split("/")
+    if len(tokens) not in (4, 5) or tokens[0] != sp_helpers.SP_NAMESPACE:
+        return None
+    msg_type: Optional[MsgType] = sp_helpers.msg_type_from_str(tokens[2])
+    if msg_type is None:
+        return None
+    return SPTopic(SPId(tokens[1], tokens[3], *tokens[4:]), msg_type)
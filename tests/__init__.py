@@ -0,0 +1,10 @@
+"""
+Unit tests of Enki.
+
+The modules of Enki are at the root of the repository, and Sparkplug ones in
+tahu/python/core, which has to be in PYTHONPATH.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,92 @@
+"""Tests of the recording and reading of raw traffic captures."""
+import os
+import tempfile
+import unittest
+
+from capture import CaptureWriter, CaptureReader, CAPTURE_MAGIC, INDEX_SUFFIX
+
+# (timestamp, topic, payload) of the recorded messages, in time order
+MESSAGES = [
+    (1000, "spBv1.0/g/NBIRTH/e", b"birth"),
+    (2000, "spBv1.0/g/DBIRTH/e/d", b""),
+    (2000, "spBv1.0/g/NDATA/e", b"\x00" * 300),
+    (3500, "spBv1.0/g/DDATA/e/d", bytes(range(256))),
+    (4000, "spBv1.0/g/NDATA/e", b"data"),
+]
+
+
+class TestCapture(unittest.TestCase):
+    """Captures written then read back."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.tmp_dir.name, "capture")
+        writer = CaptureWriter(self.path)
+        for message in MESSAGES:
+            writer.write(*message)
+        writer.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        """Records are read back in the order they were written."""
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(list(reader.iter_records()), MESSAGES)
+
+    def test_index(self):
+        """The index has an entry per record pointing to it."""
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(reader.get_index_len(), len(MESSAGES))
+            self.assertEqual(reader.topics, ["spBv1.0/g/NBIRTH/e", "spBv1.0/g/DBIRTH/e/d",
+                                             "spBv1.0/g/NDATA/e", "spBv1.0/g/DDATA/e/d"])
+            for (idx, (timestamp, topic, payload)) in enumerate(MESSAGES):
+                (entry_timestamp, offset, topic_id) = reader.get_index_entry(idx)
+                self.assertEqual((entry_timestamp, reader.topics[topic_id]), (timestamp, topic))
+                self.assertEqual(reader.read(offset)[:3], (timestamp, topic, payload))
+
+    def test_find_time(self):
+        """The first record at or after a time is found with the index."""
+        with CaptureReader(self.path) as reader:
+            offsets = [reader.get_index_entry(idx)[1] for idx in range(len(MESSAGES))]
+            self.assertEqual(reader.find_time(0), offsets[0])
+            self.assertEqual(reader.find_time(1000), offsets[0])
+            self.assertEqual(reader.find_time(1001), offsets[1])
+            self.assertEqual(reader.find_time(2000), offsets[1])
+            self.assertEqual(reader.find_time(3000), offsets[3])
+            self.assertEqual(reader.find_time(5000), reader.get_size())
+
+    def test_topic_offsets(self):
+        """The records of a topic are found with the index."""
+        with CaptureReader(self.path) as reader:
+            self.assertEqual([reader.read(offset)[2] for offset
+                              in reader.iter_topic_offsets("spBv1.0/g/NDATA/e")],
+                             [b"\x00" * 300, b"data"])
+            self.assertEqual(list(reader.iter_topic_offsets("spBv1.0/g/NDATA/x")), [])
+
+    def test_truncated(self):
+        """A truncated last record, as left by a crash, is ignored."""
+        with open(self.path, "r+b") as capture:
+            capture.truncate(os.path.getsize(self.path) - 1)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(len(list(reader.iter_records())), len(MESSAGES) - 1)
+
+    def test_without_index(self):
+        """A capture without index is still read."""
+        os.remove(self.path + INDEX_SUFFIX)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(reader.get_index_len(), 0)
+            self.assertEqual(len(list(reader.iter_records())), len(MESSAGES))
+
+    def test_empty(self):
+        """An empty capture holds its header only."""
+        path = os.path.join(self.tmp_dir.name, "empty")
+        CaptureWriter(path).close()
+        with CaptureReader(path) as reader:
+            self.assertEqual(reader.get_size(), len(CAPTURE_MAGIC))
+            self.assertEqual(list(reader.iter_records()), [])
+            self.assertEqual(reader.find_time(0), len(CAPTURE_MAGIC))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+"""Tests of the persistence of the fleet to warm start Enki."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import fleet_store
+from fleet_store import FleetStore
+from sp_id import SPId
+from sp_network import SPNet
+
+from tests.test_metric_store import make_payload
+
+EON_ID = SPId("stored", "eon")
+DEV_IDS = [SPId("stored", "eon", f"dev{idx}") for idx in range(3)]
+
+
+def clear_fleet() -> None:
+    """Removes all the EoNs/devices of the fleet."""
+    sp_net = SPNet()
+    for sp_id in list(sp_net.eon_nodes):
+        sp_net.remove_by_id(sp_id)
+
+
+def birth_fleet() -> None:
+    """Births an EoN and its devices."""
+    sp_net = SPNet()
+    sp_net.add_from_birth(EON_ID, make_payload().metrics, 0)
+    for (idx, dev_id) in enumerate(DEV_IDS):
+        sp_net.add_from_birth(dev_id, make_payload(offset=idx).metrics, idx)
+
+
+def get_fleet() -> dict:
+    """Returns the metrics and seq of each EoN/Device of the fleet."""
+    return {str(sp_id): (sp_dev.read_metrics(), sp_dev.seq)
+            for (sp_id, sp_dev) in SPNet().get_snapshot().index.items()}
+
+
+class TestFleetStore(unittest.TestCase):
+    """Fleets written to a store and loaded back."""
+
+    def setUp(self):
+        clear_fleet()
+        self.tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.tmp_dir.name, "fleet")
+
+    def tearDown(self):
+        clear_fleet()
+        self.tmp_dir.cleanup()
+
+    def reload(self) -> FleetStore:
+        """Clears the fleet and loads it from the store, returns the loading store."""
+        clear_fleet()
+        store = FleetStore(self.path)
+        store.load()
+        return store
+
+    def test_replay(self):
+        """The fleet loaded from the store is the written one, marked as restored."""
+        birth_fleet()
+        fleet = get_fleet()
+        store = FleetStore(self.path)
+        store.start()
+        store.stop()
+        self.assertEqual(self.reload().written.keys(), {EON_ID, *DEV_IDS})
+        self.assertEqual(get_fleet(), fleet)
+        self.assertTrue(all(sp_dev.restored for sp_dev in SPNet().get_snapshot().index.values()))
+
+    def test_changes(self):
+        """Only changes are appended, the last record of each EoN/Device wins."""
+        birth_fleet()
+        store = FleetStore(self.path)
+        store.start()
+        self.assertEqual(store.write(), 4)
+        self.assertEqual(store.write(), 0)
+        sp_net = SPNet()
+        sp_net.update_metrics(DEV_IDS[0], make_payload(offset=10).metrics, 5)
+        sp_net.remove_by_id(DEV_IDS[1])
+        self.assertEqual(store.write(), 2)
+        fleet = get_fleet()
+        store.stop()
+        self.reload()
+        self.assertEqual(get_fleet(), fleet)
+        self.assertIsNone(sp_net.find_id(DEV_IDS[1]))
+        self.assertEqual(sp_net.find_id(DEV_IDS[0]).seq, 5)
+
+    def test_truncated(self):
+        """A truncated last record is ignored when loading, and dropped when writing."""
+        birth_fleet()
+        store = FleetStore(self.path)
+        store.start()
+        store.write()
+        SPNet().update_metrics(DEV_IDS[0], make_payload(offset=10).metrics)
+        store.stop()
+        with open(self.path, "r+b") as file:
+            file.truncate(os.path.getsize(self.path) - 1)
+        store = self.reload()
+        self.assertEqual(SPNet().find_id(DEV_IDS[0]).read_metrics(),
+                         list(make_payload(offset=0).metrics))
+        store.start()
+        self.assertEqual(store.write(), 0)
+        store.stop()
+        self.assertEqual(os.path.getsize(self.path), store.size)
+
+    def test_compact(self):
+        """A compacted store holds the live records only and is appended to afterwards."""
+        birth_fleet()
+        store = FleetStore(self.path)
+        store.start()
+        store.write()
+        for offset in range(1, 10):
+            SPNet().update_metrics(DEV_IDS[0], make_payload(offset=offset).metrics)
+            store.write()
+        SPNet().remove_by_id(DEV_IDS[2])
+        size = os.path.getsize(self.path)
+        with mock.patch.object(fleet_store, "COMPACT_MIN_SIZE", 0):
+            self.assertEqual(store.write(), 3)
+        self.assertLess(os.path.getsize(self.path), size)
+        self.assertEqual(os.path.getsize(self.path), store.size)
+        self.assertEqual(store.size - len(fleet_store.STORE_MAGIC), store.live_size)
+        SPNet().update_metrics(DEV_IDS[1], make_payload(offset=20).metrics)
+        self.assertEqual(store.write(), 1)
+        fleet = get_fleet()
+        store.stop()
+        self.assertEqual(self.reload().written.keys(), {EON_ID, DEV_IDS[0], DEV_IDS[1]})
+        self.assertEqual(get_fleet(), fleet)
+
+    def test_compact_failure(self):
+        """A failed compaction leaves the store as it was."""
+        birth_fleet()
+        store = FleetStore(self.path)
+        store.start()
+        store.write()
+        for offset in range(1, 10):
+            SPNet().update_metrics(DEV_IDS[0], make_payload(offset=offset).metrics)
+            store.write()
+        state = (dict(store.written), store.size, store.live_size)
+        SPNet().update_metrics(DEV_IDS[0], make_payload(offset=10).metrics)
+        with mock.patch.object(fleet_store, "COMPACT_MIN_SIZE", 0), \
+                mock.patch("os.replace", side_effect=OSError("replace")):
+            self.assertRaises(OSError, store.write)
+        self.assertEqual((store.written, store.size, store.live_size), state)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        self.assertEqual(store.write(), 1)
+        fleet = get_fleet()
+        store.stop()
+        self.reload()
+        self.assertEqual(get_fleet(), fleet)
+
+
+if __name__ == "__main__":
+    unittest.main()
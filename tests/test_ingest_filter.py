@@ -0,0 +1,96 @@
+"""Tests of the filtering of received messages on their topic."""
+import unittest
+from types import SimpleNamespace
+
+from sparkplug_b_pb2 import Payload
+
+import enki
+from ingest_filter import IngestFilter, FilterRule, FILTER_INCLUDE, FILTER_EXCLUDE
+from sp_helpers import MsgType
+from sp_network import SPNet
+from sp_topic import SPTopic
+
+# Not a valid payload: decoding it raises an error
+UNDECODABLE = b"\xff\xff\xff"
+
+
+def topic(topic_str: str) -> SPTopic:
+    """Returns a parsed topic."""
+    return SPTopic.from_str("spBv1.0/" + topic_str)
+
+
+class TestIngestFilter(unittest.TestCase):
+    """Decisions of the ingest filter."""
+
+    def setUp(self):
+        self.ingest_filter = IngestFilter()
+        while self.ingest_filter.rules:
+            self.ingest_filter.remove_rule(0)
+        self.ingest_filter.reset_counters()
+
+    tearDown = setUp
+
+    def test_no_rules(self):
+        """Messages are accepted when there are no rules."""
+        self.assertTrue(self.ingest_filter.accepts(topic("g/NDATA/e")))
+        self.assertTrue(self.ingest_filter.accepts(topic("g/DDATA/e/d")))
+
+    def test_exclude(self):
+        """Exclude rules skip the messages of matching EoNs and of their devices."""
+        self.ingest_filter.add_rule(FilterRule(FILTER_EXCLUDE, "g/e1"))
+        self.assertFalse(self.ingest_filter.accepts(topic("g/NDATA/e1")))
+        self.assertFalse(self.ingest_filter.accepts(topic("g/DDATA/e1/d")))
+        self.assertTrue(self.ingest_filter.accepts(topic("g/NDATA/e2")))
+
+    def test_include(self):
+        """Only the messages matching an include rule are accepted, unless excluded."""
+        self.ingest_filter.add_rule(FilterRule(FILTER_INCLUDE, "g/*"))
+        self.ingest_filter.add_rule(FilterRule(FILTER_EXCLUDE, "g/e1/d2"))
+        self.assertTrue(self.ingest_filter.accepts(topic("g/NDATA/e1")))
+        self.assertTrue(self.ingest_filter.accepts(topic("g/DDATA/e1/d1")))
+        self.assertFalse(self.ingest_filter.accepts(topic("g/DDATA/e1/d2")))
+        self.assertFalse(self.ingest_filter.accepts(topic("h/NDATA/e1")))
+
+    def test_msg_type(self):
+        """Include rules of a message type also accept BIRTH and DEATH."""
+        self.ingest_filter.add_rule(FilterRule(FILTER_INCLUDE, "g/e", MsgType.DATA))
+        self.ingest_filter.add_rule(FilterRule(FILTER_EXCLUDE, "g/e/d", MsgType.DATA))
+        self.assertTrue(self.ingest_filter.accepts(topic("g/NDATA/e")))
+        self.assertTrue(self.ingest_filter.accepts(topic("g/NBIRTH/e")))
+        self.assertTrue(self.ingest_filter.accepts(topic("g/NDEATH/e")))
+        self.assertFalse(self.ingest_filter.accepts(topic("g/NCMD/e")))
+        self.assertTrue(self.ingest_filter.accepts(topic("g/DBIRTH/e/d")))
+        self.assertFalse(self.ingest_filter.accepts(topic("g/DDATA/e/d")))
+
+    def test_cached_decisions(self):
+        """Cached decisions are dropped when the rules change."""
+        self.assertTrue(self.ingest_filter.accepts(topic("g/NDATA/e")))
+        self.ingest_filter.add_rule(FilterRule(FILTER_EXCLUDE, "g/e"))
+        self.assertFalse(self.ingest_filter.accepts(topic("g/NDATA/e")))
+        self.ingest_filter.remove_rule(0)
+        self.assertTrue(self.ingest_filter.accepts(topic("g/NDATA/e")))
+
+    def test_skipped_not_decoded(self):
+        """Filtered out messages are counted and their payload is not decoded."""
+        self.ingest_filter.add_rule(FilterRule(FILTER_EXCLUDE, "filtered/*"))
+        enki.on_message(None, SimpleNamespace(topic="spBv1.0/filtered/NDATA/e",
+                                              payload=UNDECODABLE))
+        enki.on_message(None, SimpleNamespace(topic="spBv1.0/filtered/NBIRTH/e",
+                                              payload=UNDECODABLE))
+        self.assertEqual((self.ingest_filter.decoded, self.ingest_filter.skipped), (0, 2))
+        self.assertIsNone(SPNet().find_handle("filtered/e"))
+
+    def test_tracked_lifecycle(self):
+        """BIRTH and DEATH of tracked EoNs are handled even when filtered out."""
+        enki.on_message(None, SimpleNamespace(topic="spBv1.0/tracked/NBIRTH/e",
+                                              payload=Payload().SerializeToString()))
+        self.assertIsNotNone(SPNet().find_handle("tracked/e"))
+        self.ingest_filter.add_rule(FilterRule(FILTER_EXCLUDE, "tracked/*"))
+        enki.on_message(None, SimpleNamespace(topic="spBv1.0/tracked/NDEATH/e",
+                                              payload=Payload().SerializeToString()))
+        self.assertIsNone(SPNet().find_handle("tracked/e"))
+        self.assertEqual((self.ingest_filter.decoded, self.ingest_filter.skipped), (2, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
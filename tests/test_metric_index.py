@@ -0,0 +1,87 @@
+"""Tests of the index of the metrics of the fleet by name."""
+import re
+import unittest
+
+from sparkplug_b_pb2 import Payload
+from sparkplug_b import MetricDataType
+
+from metric_index import MetricIndex
+from sp_dev import EdgeNode
+from sp_id import SPId
+from sp_network import SPNet
+
+from tests.test_metric_store import add_metric
+
+
+def make_metrics(*names):
+    """Returns Int32 metrics with the given names."""
+    payload = Payload()
+    for (idx, name) in enumerate(names):
+        add_metric(payload, name, None, MetricDataType.Int32, idx)
+    return payload.metrics
+
+
+class TestMetricIndex(unittest.TestCase):
+    """Metrics found by name in the index."""
+
+    def setUp(self):
+        self.index = MetricIndex()
+        self.eon_a = EdgeNode(SPId("index", "a"), make_metrics("temp", "pressure", "dir/level"))
+        self.eon_b = EdgeNode(SPId("index", "b"), make_metrics("temp", "pressure", "dir/level"))
+        self.eon_c = EdgeNode(SPId("index", "c"), make_metrics("dir/level", "temp2"))
+        for sp_dev in (self.eon_a, self.eon_b, self.eon_c):
+            self.index.add(sp_dev)
+
+    def test_shared_schema(self):
+        """EoNs/devices with the same metrics are indexed by their shared schema."""
+        self.assertIs(self.eon_a.store.schema, self.eon_b.store.schema)
+        self.assertEqual(len(self.index.devices), 2)
+        self.assertEqual(len(self.index.slots["temp"]), 1)
+        self.assertEqual(len(self.index.slots["dir/level"]), 2)
+
+    def test_find(self):
+        """Names are found exactly, with glob patterns or regular expressions."""
+        self.assertCountEqual(self.index.find("temp"), [(self.eon_a, 0), (self.eon_b, 0)])
+        self.assertCountEqual(self.index.find("dir/level"),
+                              [(self.eon_a, 2), (self.eon_b, 2), (self.eon_c, 0)])
+        self.assertCountEqual(self.index.find("temp*"),
+                              [(self.eon_a, 0), (self.eon_b, 0), (self.eon_c, 1)])
+        self.assertCountEqual(self.index.find("temp[0-9]"), [(self.eon_c, 1)])
+        self.assertCountEqual(self.index.find("p.*|temp2", regex=True),
+                              [(self.eon_a, 1), (self.eon_b, 1), (self.eon_c, 1)])
+        self.assertEqual(self.index.find("emp", regex=True), [])
+        self.assertEqual(self.index.find("unknown"), [])
+        self.assertRaises(re.error, self.index.find, "(", regex=True)
+
+    def test_remove(self):
+        """Names are unindexed once the last EoN/Device having them is removed."""
+        self.index.remove(self.eon_a)
+        self.assertCountEqual(self.index.find("temp"), [(self.eon_b, 0)])
+        self.index.remove(self.eon_b)
+        self.assertEqual(self.index.find("temp"), [])
+        self.assertCountEqual(self.index.get_names(), ("dir/level", "temp2"))
+        self.index.remove(self.eon_b)
+        self.index.remove(self.eon_c)
+        self.assertEqual((self.index.slots, self.index.devices), ({}, {}))
+
+
+class TestFindMetrics(unittest.TestCase):
+    """Metrics of the fleet found by name."""
+
+    def test_birth_death(self):
+        """The index follows the births, rebirths and deaths of the fleet."""
+        sp_net = SPNet()
+        eon_id = SPId("find_metrics", "eon")
+        dev_id = SPId("find_metrics", "eon", "dev")
+        sp_net.add_from_birth(eon_id, make_metrics("find_eon"))
+        sp_net.add_from_birth(dev_id, make_metrics("find_a", "find_b"))
+        self.assertEqual(sp_net.find_metrics("find_b"), [(sp_net.find_id(dev_id), 1)])
+        sp_net.add_from_birth(dev_id, make_metrics("find_b"))
+        self.assertEqual(sp_net.find_metrics("find_b"), [(sp_net.find_id(dev_id), 0)])
+        self.assertEqual(sp_net.find_metrics("find_a"), [])
+        sp_net.remove_by_id(eon_id)
+        self.assertEqual(sp_net.find_metrics("find_*"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
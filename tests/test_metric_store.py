@@ -0,0 +1,149 @@
+"""Tests of the columnar storage of the metrics of EoNs/devices."""
+import io
+import unittest
+from contextlib import redirect_stdout
+
+from sparkplug_b_pb2 import Payload
+from sparkplug_b import MetricDataType
+
+import sp_helpers
+from metric_store import MetricStore
+from sp_id import SPId
+from sp_network import SPNet
+
+from tests.test_sp_helpers import LIMIT_VALUES
+
+# A value of each datatype stored in the columns of the store
+VALUES = LIMIT_VALUES + [
+    (MetricDataType.Text, "value"),
+    (MetricDataType.Bytes, b"\x00\xff"),
+]
+
+
+def add_metric(payload, name, alias, datatype, value):
+    """Adds a metric with a value to a payload, returns it."""
+    metric = payload.metrics.add()
+    metric.name = name
+    if alias is not None:
+        metric.alias = alias
+    metric.datatype = datatype
+    if datatype in sp_helpers.bytes_value_types:
+        metric.bytes_value = value
+    else:
+        sp_helpers.set_typed_value(datatype, metric, value)
+    return metric
+
+
+def make_payload(offset=0):
+    """Returns a payload with a metric of each datatype, with a timestamp and an alias."""
+    payload = Payload()
+    for (idx, (datatype, value)) in enumerate(VALUES):
+        if isinstance(value, int) and not isinstance(value, bool) and offset:
+            value = value - offset if value > 0 else value + offset
+        metric = add_metric(payload, f"metric_{idx}", idx, datatype, value)
+        metric.timestamp = 1000 + idx + offset
+    return payload
+
+
+class TestMetricStore(unittest.TestCase):
+    """Metrics written to a store and built back."""
+
+    def test_round_trip(self):
+        """The metrics built from the store are equal to the ones of the BIRTH."""
+        payload = make_payload()
+        store = MetricStore(payload.metrics)
+        self.assertEqual(len(store), len(payload.metrics))
+        for (slot, metric) in enumerate(payload.metrics):
+            self.assertEqual(store.build_metric(slot), metric)
+
+    def test_write(self):
+        """Written metrics replace the value and timestamp of their slot only."""
+        birth = make_payload()
+        store = MetricStore(birth.metrics)
+        data = make_payload(offset=1)
+        for (slot, metric) in enumerate(data.metrics):
+            self.assertTrue(store.write(slot, metric))
+            self.assertEqual(store.build_metric(slot), metric)
+            if slot + 1 < len(store):
+                self.assertEqual(store.build_metric(slot + 1), birth.metrics[slot + 1])
+
+    def test_typed_values(self):
+        """Numbers are returned converted to their datatype, other values as received."""
+        store = MetricStore(make_payload().metrics)
+        for (slot, (datatype, value)) in enumerate(VALUES):
+            with self.subTest(datatype=sp_helpers.datatype_to_str(datatype)):
+                if store.is_numeric(slot):
+                    self.assertEqual(store.get_typed_value(slot), value)
+                else:
+                    self.assertEqual(store.get_value(slot), value)
+
+    def test_null(self):
+        """Null metrics are stored as such and may get a value afterwards."""
+        payload = make_payload()
+        for metric in payload.metrics:
+            metric.ClearField(metric.WhichOneof("value"))
+            metric.is_null = True
+        store = MetricStore(payload.metrics)
+        for (slot, metric) in enumerate(payload.metrics):
+            self.assertIsNone(store.get_value(slot))
+            self.assertEqual(store.build_metric(slot), metric)
+        data = make_payload()
+        for (slot, metric) in enumerate(data.metrics):
+            self.assertTrue(store.write(slot, metric))
+            self.assertEqual(store.build_metric(slot), metric)
+
+    def test_wrong_kind(self):
+        """A value that cannot be stored in a slot is rejected, the slot is unchanged."""
+        payload = Payload()
+        add_metric(payload, "number", None, MetricDataType.Int32, 1).timestamp = 1
+        store = MetricStore(payload.metrics)
+        data = Payload()
+        add_metric(data, "number", None, MetricDataType.String, "one")
+        self.assertFalse(store.write(0, data.metrics[0]))
+        self.assertEqual(store.build_metric(0), payload.metrics[0])
+
+    def test_properties(self):
+        """Properties are kept in the schema, shared by identical BIRTHs."""
+        payload = make_payload()
+        prop = payload.metrics[0].properties
+        prop.keys.append("unit")
+        prop.values.add(type=MetricDataType.String, string_value="m")
+        store = MetricStore(payload.metrics)
+        self.assertEqual(store.build_metric(0), payload.metrics[0])
+        self.assertIs(MetricStore(make_payload(offset=1).metrics).schema,
+                      MetricStore(make_payload().metrics).schema)
+        self.assertIsNot(store.schema, MetricStore(make_payload().metrics).schema)
+
+
+class TestDuplicateAliases(unittest.TestCase):
+    """BIRTH messages whose metrics repeat an alias."""
+
+    def test_birth(self):
+        """The EoN is registered, the first metric of a repeated alias is kept."""
+        payload = Payload()
+        add_metric(payload, "first", 1, MetricDataType.Int32, 10)
+        add_metric(payload, "second", 1, MetricDataType.Int32, 20)
+        add_metric(payload, "third", 2, MetricDataType.Int32, 30)
+        sp_net = SPNet()
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertTrue(sp_net.add_from_birth(SPId("dup_alias", "eon"), payload.metrics))
+        self.assertIn("Alias 1", out.getvalue())
+        self.assertIn("dup_alias/eon", out.getvalue())
+        sp_dev = sp_net.find_handle("dup_alias/eon")
+        self.assertIsNotNone(sp_dev)
+        self.assertEqual(sp_dev.get_metric("", 1).name, "first")
+        self.assertEqual(sp_dev.get_metric("second").int_value, 20)
+
+        # Alias-only DATA update the first metric of the alias
+        data = Payload()
+        metric = data.metrics.add()
+        metric.alias = 1
+        metric.int_value = 11
+        self.assertTrue(sp_net.update_metrics(sp_dev.get_id(), data.metrics))
+        self.assertEqual(sp_dev.get_metric("first").int_value, 11)
+        self.assertEqual(sp_dev.get_metric("second").int_value, 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Tests of the watches of metric values evaluated as DATA messages are received."""
+import threading
+import unittest
+
+from sparkplug_b_pb2 import Payload
+from sparkplug_b import MetricDataType
+
+from metric_watch import Watch
+from sp_id import SPId
+from sp_network import SPNet
+
+from tests.test_metric_store import add_metric
+
+EON_ID = SPId("watched", "eon")
+DEV_ID = SPId("watched", "eon", "dev")
+
+
+def make_metrics(level, state="idle"):
+    """Returns the metrics of a watched device."""
+    payload = Payload()
+    add_metric(payload, "level", 1, MetricDataType.Int32, level)
+    add_metric(payload, "state", 2, MetricDataType.String, state)
+    return payload.metrics
+
+
+class TestWatch(unittest.TestCase):
+    """Watches triggered by the updates of the fleet."""
+
+    def setUp(self):
+        self.sp_net = SPNet()
+        self.sp_net.add_from_birth(EON_ID, Payload().metrics)
+        self.sp_net.add_from_birth(DEV_ID, make_metrics(0))
+        self.calls = []
+
+    def tearDown(self):
+        for watch in self.sp_net.get_watches():
+            self.sp_net.remove_watch(watch.watch_id)
+        self.sp_net.remove_by_id(EON_ID)
+
+    def add_watch(self, handle_pattern, metric_pattern, expr, regex=False) -> Watch:
+        """Adds a watch recording the calls of its hook, returns it."""
+        def hook(sp_dev, metric, value):
+            self.calls.append((threading.current_thread().name, sp_dev.get_handle(),
+                               metric.name, value))
+        watch = Watch(handle_pattern, metric_pattern, expr, regex, hook)
+        self.sp_net.add_watch(watch)
+        return watch
+
+    def update(self, level, state="idle", sp_id=DEV_ID) -> None:
+        """Updates the metrics of a device and waits for the hooks to run."""
+        self.sp_net.update_metrics(sp_id, make_metrics(level, state))
+        self.sp_net.watch_hooks.wait_empty()
+
+    def test_edge_triggered(self):
+        """A watch is triggered when a value starts matching, not while it keeps matching."""
+        watch = self.add_watch("watched/*", "level", "value > 10")
+        for level in (5, 11, 12, 13, 4, 20, 20, 3):
+            self.update(level)
+        self.assertEqual(watch.triggered, 2)
+        self.assertEqual(self.calls, [("enki-watch-hooks", "watched/eon/dev", "level", 11),
+                                      ("enki-watch-hooks", "watched/eon/dev", "level", 20)])
+
+    def test_patterns(self):
+        """Watches only apply to the metrics and EoNs/devices matching their patterns."""
+        self.add_watch("watched/eon", "level", "value > 10")
+        self.add_watch("watched/*/dev", "lev*", "value > 10")
+        self.add_watch("watched/eon/d.v", "state|level", "value == 'running'", regex=True)
+        self.update(11, "running")
+        self.assertCountEqual([call[2:] for call in self.calls],
+                              [("level", 11), ("state", "running")])
+
+    def test_later_birth(self):
+        """Watches apply to the EoNs/devices born after them, with a fresh state."""
+        watch = self.add_watch("watched/*", "level", "value > 10")
+        self.update(11)
+        self.sp_net.add_from_birth(DEV_ID, make_metrics(11))
+        self.update(12)
+        new_id = SPId("watched", "eon", "other")
+        self.sp_net.add_from_birth(new_id, make_metrics(0))
+        self.update(30, sp_id=new_id)
+        self.assertEqual(watch.triggered, 3)
+
+    def test_remove(self):
+        """Removed watches are no longer triggered and their matches are dropped."""
+        watch = self.add_watch("watched/*", "level", "value > 10")
+        kept = self.add_watch("watched/*", "level", "value > 0")
+        self.update(11)
+        sp_dev = self.sp_net.find_id(DEV_ID)
+        self.assertEqual(len(sp_dev.watch_matches), 2)
+        self.assertTrue(self.sp_net.remove_watch(watch.watch_id))
+        self.assertFalse(self.sp_net.remove_watch(watch.watch_id))
+        self.update(3)
+        self.update(12)
+        self.assertEqual(sp_dev.watch_matches, {(0, kept)})
+        self.assertEqual((watch.triggered, kept.triggered), (1, 1))
+        self.assertEqual(self.sp_net.get_watches(), [kept])
+
+    def test_ui(self):
+        """The UI is notified with the metric that triggered the watch."""
+        notified = []
+        ui = self.sp_net.ui
+
+        class RecordingUI:  # pylint: disable=too-few-public-methods
+            """UI recording the triggered watches."""
+            def on_watch_triggered(self, watch, sp_dev, metric):
+                """Records a triggered watch."""
+                notified.append((watch, sp_dev.get_handle(), metric.int_value))
+
+            def __getattr__(self, name):
+                return getattr(ui, name)
+
+        watch = self.add_watch("watched/*", "level", "value > 10")
+        self.sp_net.set_ui(RecordingUI())
+        try:
+            self.update(11)
+        finally:
+            self.sp_net.set_ui(ui)
+        self.assertEqual(notified, [(watch, "watched/eon/dev", 11)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Tests of the payloads encoded once and sent repeatedly."""
+import unittest
+
+from sparkplug_b_pb2 import Payload
+from sparkplug_b import MetricDataType
+
+import sp_helpers
+from payload_template import PayloadTemplate
+
+from tests.test_metric_store import make_payload, add_metric
+
+TIMESTAMPS = [0, 1, 127, 128, 1700000000000, 2**64 - 1]
+SEQS = [None, 0, 1, 255]
+
+
+def expected_payload(metrics, timestamp, seq, metric_timestamps=True) -> Payload:
+    """Returns the payload a template of the metrics is expected to encode."""
+    payload = Payload()
+    payload.timestamp = timestamp
+    for metric in metrics:
+        copy = payload.metrics.add()
+        copy.CopyFrom(metric)
+        if metric_timestamps:
+            copy.timestamp = timestamp
+        else:
+            copy.ClearField("timestamp")
+    if seq is not None:
+        payload.seq = seq
+    return payload
+
+
+class TestPayloadTemplate(unittest.TestCase):
+    """Payloads encoded by templates compared to the encoding of protobuf."""
+
+    def assert_encodes(self, template, metrics, metric_timestamps=True):
+        """Asserts the template encodes the metrics as protobuf does."""
+        for timestamp in TIMESTAMPS:
+            for seq in SEQS:
+                with self.subTest(timestamp=timestamp, seq=seq):
+                    payload = expected_payload(metrics, timestamp, seq, metric_timestamps)
+                    self.assertEqual(template.encode(timestamp, seq),
+                                     payload.SerializeToString())
+
+    def test_encode(self):
+        """Payloads are byte-equal to the ones of protobuf."""
+        metrics = make_payload().metrics
+        self.assert_encodes(PayloadTemplate(metrics), metrics)
+
+    def test_without_metric_timestamps(self):
+        """Metrics have no timestamp unless requested."""
+        metrics = make_payload().metrics
+        self.assert_encodes(PayloadTemplate(metrics, False), metrics, False)
+
+    def test_names_and_aliases(self):
+        """Metrics with a name only, an alias only, both or none are encoded."""
+        payload = Payload()
+        add_metric(payload, "name_only", None, MetricDataType.Int32, 1)
+        add_metric(payload, "", 2, MetricDataType.Int32, 2).ClearField("name")
+        add_metric(payload, "both", 3, MetricDataType.Int32, 3)
+        add_metric(payload, "", None, MetricDataType.Int32, 4).ClearField("name")
+        prop = payload.metrics[0].properties
+        prop.keys.append("unit")
+        prop.values.add(type=MetricDataType.String, string_value="m")
+        self.assert_encodes(PayloadTemplate(payload.metrics), payload.metrics)
+
+    def test_set_value(self):
+        """Changed values are encoded as protobuf does."""
+        for metric_timestamps in (True, False):
+            metrics = list(make_payload().metrics)
+            template = PayloadTemplate(metrics, metric_timestamps)
+            template.encode(0)
+            for (name, value) in (("metric_0", 5), ("metric_9", 2.5), ("metric_11", "changed"),
+                                  ("metric_7", 0)):
+                idx = template.find_metric(name)
+                template.set_value(idx, value)
+                metric = Payload.Metric()
+                metric.CopyFrom(metrics[idx])
+                sp_helpers.set_typed_value(metric.datatype, metric, value)
+                metrics[idx] = metric
+            with self.subTest(metric_timestamps=metric_timestamps):
+                self.assert_encodes(template, metrics, metric_timestamps)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Tests of the predicates on metric values."""
+import unittest
+
+from predicate import compile_predicate
+
+
+class TestPredicate(unittest.TestCase):
+    """Compilation and evaluation of predicates."""
+
+    def test_evaluate(self):
+        """Predicates match the values they are true for."""
+        cases = [
+            ("value > 10", [(11, True), (10, False), (10.5, True)]),
+            ("value > 10 and value != 42", [(42, False), (43, True)]),
+            ("not value or value in (1, 2)", [(0, True), (2, True), (3, False)]),
+            ("abs(value - 5) <= 1", [(4, True), (6.5, False)]),
+            ("value % 2 == 0 if value > 0 else False", [(4, True), (3, False), (-2, False)]),
+            ("len(value) > 3", [("long", True), ("abc", False)]),
+            ("value is None", [(None, True), (0, False)]),
+            ("max(value, 0) // 3 == round(1.4)", [(4, True), (-10, False)]),
+        ]
+        for (expr, values) in cases:
+            matches = compile_predicate(expr)
+            for (value, expected) in values:
+                with self.subTest(expr=expr, value=value):
+                    self.assertIs(matches(value), expected)
+
+    def test_evaluation_errors(self):
+        """Values a predicate does not apply to do not match."""
+        cases = [("value > 10", "text"), ("value / 0 > 1", 1), ("len(value) > 1", 5),
+                 ("value - 1 > 0", None)]
+        for (expr, value) in cases:
+            with self.subTest(expr=expr, value=value):
+                self.assertFalse(compile_predicate(expr)(value))
+
+    def test_repetition(self):
+        """Sequences are not repeated, whatever the size of the repetition."""
+        cases = [("value * 10000000000 != ''", "text"), ("[0] * 10000000000 == value", 1),
+                 ("len((value,) * 10000000000) > 0", 1), ("10000000000 * 'x' == value", "x")]
+        for (expr, value) in cases:
+            with self.subTest(expr=expr, value=value):
+                self.assertFalse(compile_predicate(expr)(value))
+        self.assertTrue(compile_predicate("value * 2 * 1.5 == 6")(2))
+        self.assertTrue(compile_predicate("-value * True == -2")(2))
+
+    def test_rejected(self):
+        """Expressions with anything else than the allowed nodes are rejected."""
+        exprs = [
+            "value.real > 0",                    # attribute
+            "value[0] == 1",                     # subscript
+            "__import__('os')",                  # unknown name
+            "__multiply(value, 2) > 1",          # internal name
+            "open('file')",                      # call of an unknown function
+            "other > 1",                         # unknown name
+            "(lambda: 1)()",                     # lambda
+            "[x for x in value]",                # comprehension
+            "(x := value) > 1",                  # assignment
+            "f'{value}' == '1'",                 # formatted string
+            "max(value, default=0) > 1",         # keyword argument
+            "abs.__call__(value)",               # call of an attribute
+            "{value: 1}",                        # dict
+            "value ** 2 > 1",                    # power
+            "value << 2 > 1",                    # shift
+            "value >",                           # syntax error
+            "value = 1",                         # statement
+            "",                                  # empty
+        ]
+        for expr in exprs:
+            with self.subTest(expr=expr):
+                self.assertRaises(ValueError, compile_predicate, expr)
+
+
+if __name__ == "__main__":
+    unittest.main()
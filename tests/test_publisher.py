@@ -0,0 +1,72 @@
+"""Tests of the bulk publishing of messages."""
+import unittest
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+
+from publisher import Publisher
+
+
+class FakeMQTTInterface:
+    """MQTT interface acknowledging each message as soon as it is published."""
+
+    def __init__(self):
+        self.max_inflight = 20
+        self.publish_callback = None
+        self.next_mid = 1
+
+    def get_max_inflight(self):
+        """Returns the maximum number of messages in flight."""
+        return self.max_inflight
+
+    def set_max_inflight(self, count):
+        """Sets the maximum number of messages in flight."""
+        self.max_inflight = count
+
+    def publish(self, _topic, _payload, _qos, _retain):
+        """Publishes a message and acknowledges it, before returning its Id."""
+        mid = self.next_mid
+        self.next_mid += 1
+        if self.publish_callback is not None:
+            self.publish_callback(mid)
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=mid)
+
+
+class TestPublisher(unittest.TestCase):
+    """Publishers and the state of the MQTT interface they use."""
+
+    def test_report(self):
+        """Acknowledged messages are accounted for."""
+        mqtt_if = FakeMQTTInterface()
+        publisher = Publisher(mqtt_if, 1, window=5)
+        for _ in range(10):
+            publisher.publish("topic", b"payload")
+        report = publisher.finish()
+        self.assertEqual((report.sent, len(report.latencies), report.failed, report.timed_out),
+                         (10, 10, [], []))
+
+    def test_restore(self):
+        """The window and publish callback of the interface are restored by finish()."""
+        mqtt_if = FakeMQTTInterface()
+        publisher = Publisher(mqtt_if, 1, window=5)
+        publisher.publish("topic", b"payload")
+        self.assertEqual(mqtt_if.max_inflight, 5)
+        publisher.finish()
+        self.assertEqual(mqtt_if.max_inflight, 20)
+        self.assertIsNone(mqtt_if.publish_callback)
+        Publisher(mqtt_if, 1).finish()
+        self.assertEqual(mqtt_if.max_inflight, 20)
+
+    def test_foreign_acks(self):
+        """Acknowledgements of messages published by others are dropped by finish()."""
+        mqtt_if = FakeMQTTInterface()
+        publisher = Publisher(mqtt_if, 1)
+        publisher.publish("topic", b"payload")
+        publisher.on_publish(1000)
+        self.assertEqual(list(publisher.early_acks), [1000])
+        publisher.finish()
+        self.assertEqual(publisher.early_acks, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Tests of the typed value converters against the ctypes conversions they replace,
+at the limits of the C integer and float types.
+"""
+import ctypes
+import math
+import unittest
+from array import array
+
+from sparkplug_b_pb2 import Payload
+from sparkplug_b import MetricDataType
+
+import sp_helpers
+
+# Reference conversions with ctypes, as done by the original value converters:
+# from a received value, and to a value to send
+CTYPES = {
+    MetricDataType.Int8: (ctypes.c_int8, ctypes.c_uint32),
+    MetricDataType.Int16: (ctypes.c_int16, ctypes.c_uint32),
+    MetricDataType.Int32: (ctypes.c_int32, ctypes.c_uint32),
+    MetricDataType.Int64: (ctypes.c_int64, ctypes.c_uint64),
+    MetricDataType.UInt8: (ctypes.c_uint8, ctypes.c_uint32),
+    MetricDataType.UInt16: (ctypes.c_uint16, ctypes.c_uint32),
+    MetricDataType.UInt32: (ctypes.c_uint32, ctypes.c_uint32),
+    MetricDataType.UInt64: (ctypes.c_uint64, ctypes.c_uint64),
+    MetricDataType.DateTime: (ctypes.c_uint64, ctypes.c_uint64),
+    MetricDataType.Float: (ctypes.c_float, ctypes.c_float),
+    MetricDataType.Double: (ctypes.c_double, ctypes.c_double),
+}
+
+# Values at the limits of each C integer and float type
+INT_VALUES = sorted({sign * ((1 << bits) + delta) for bits in (0, 7, 8, 15, 16, 31, 32, 63)
+                     for delta in (-1, 0, 1) for sign in (-1, 1)} | {0, 2**64 - 1, True})
+FLOAT_VALUES = [0.0, -0.0, 0.1, -1.5, 1 / 3, 3.4028234663852886e38, 3.4028235e38, 1e39,
+                -1e39, 1e-46, 2.5, 1e300, float("inf"), float("-inf"), float("nan"),
+                16777217, -3]
+
+# A value at the limits of each simple datatype
+LIMIT_VALUES = [
+    (MetricDataType.Int8, -128),
+    (MetricDataType.Int16, 32767),
+    (MetricDataType.Int32, -2**31),
+    (MetricDataType.Int64, 2**63 - 1),
+    (MetricDataType.UInt8, 255),
+    (MetricDataType.UInt16, 65535),
+    (MetricDataType.UInt32, 2**32 - 1),
+    (MetricDataType.UInt64, 2**64 - 1),
+    (MetricDataType.Float, -0.5),
+    (MetricDataType.Double, 1e300),
+    (MetricDataType.Boolean, False),
+    (MetricDataType.String, ""),
+    (MetricDataType.DateTime, 0),
+]
+
+
+def convert_to(datatype, value):
+    """Returns the value of the field set by set_typed_value()."""
+    metric = Payload.Metric()
+    sp_helpers.set_typed_value(datatype, metric, value)
+    return getattr(metric, sp_helpers.get_value_field(datatype))
+
+
+def make_payload():
+    """Returns a payload with a metric of each simple datatype, at its limits."""
+    payload = Payload()
+    for (idx, (datatype, value)) in enumerate(LIMIT_VALUES):
+        metric = payload.metrics.add()
+        metric.name = f"metric_{idx}"
+        metric.datatype = datatype
+        sp_helpers.set_typed_value(datatype, metric, value)
+    return payload
+
+
+class TestConverters(unittest.TestCase):
+    """Typed value converters compared to their ctypes reference."""
+
+    def assert_same(self, actual, expected):
+        """Asserts both values are equal and of the same type, NaN being equal to NaN."""
+        self.assertIs(type(actual), type(expected))
+        if isinstance(expected, float) and math.isnan(expected):
+            self.assertTrue(math.isnan(actual))
+        else:
+            self.assertEqual(actual, expected)
+
+    def test_single_values(self):
+        """Values are converted from and to each datatype as with ctypes."""
+        for (datatype, (from_ctype, to_ctype)) in CTYPES.items():
+            is_float = datatype in sp_helpers.float_value_types + sp_helpers.double_value_types
+            for value in FLOAT_VALUES if is_float else INT_VALUES:
+                with self.subTest(datatype=sp_helpers.datatype_to_str(datatype), value=value):
+                    self.assert_same(sp_helpers.convert_value(datatype, value),
+                                     from_ctype(value).value)
+                    self.assert_same(convert_to(datatype, value), to_ctype(value).value)
+
+    def test_columns(self):
+        """Integer columns, as lists or arrays, are converted as with ctypes."""
+        for datatype in sp_helpers.int_value_types + sp_helpers.long_value_types:
+            typecode = "I" if sp_helpers.get_value_field(datatype) == "int_value" else "Q"
+            mask = 0xFFFFFFFF if typecode == "I" else 0xFFFFFFFFFFFFFFFF
+            raw = [value & mask for value in INT_VALUES]
+            expected = [CTYPES[datatype][0](value).value for value in raw]
+            for column in (raw, array(typecode, raw)):
+                with self.subTest(datatype=sp_helpers.datatype_to_str(datatype),
+                                  column=type(column).__name__):
+                    self.assertEqual(list(sp_helpers.convert_values(datatype, column)), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Tests of the matching of MQTT topics against topic filters."""
+import unittest
+
+from paho.mqtt.client import topic_matches_sub
+
+from topic_trie import TopicTrie
+
+FILTERS = ["#", "+", "a", "a/#", "a/+", "a/b", "a/b/c", "a/+/c", "+/+/+", "+/b/#", "a//c",
+           "a/+/+/#", "/a", "+/", "$SYS/#", "$SYS/+", "spBv1.0/+/NDATA/#", "spBv1.0/g1/+/e1"]
+TOPICS = ["a", "b", "a/b", "a/c", "a/b/c", "a/d/c", "a/b/c/d", "a//c", "/a", "a/", "/",
+          "$SYS", "$SYS/x", "$SYS/x/y", "x/$SYS", "spBv1.0/g1/NDATA/e1", "spBv1.0/g1/NBIRTH/e1",
+          "spBv1.0/g2/NDATA/e1/d1"]
+
+
+class TestTopicTrie(unittest.TestCase):
+    """Topic trie compared to the matching of paho."""
+
+    def test_match(self):
+        """Each topic matches the same filters as with topic_matches_sub()."""
+        trie = TopicTrie()
+        for topic_filter in FILTERS:
+            trie.add(topic_filter, topic_filter)
+        for topic in TOPICS:
+            with self.subTest(topic=topic):
+                self.assertCountEqual(trie.match(topic),
+                                      [topic_filter for topic_filter in FILTERS
+                                       if topic_matches_sub(topic_filter, topic)])
+
+    def test_remove(self):
+        """Removed filters no longer match and their nodes are pruned."""
+        trie = TopicTrie()
+        for topic_filter in FILTERS:
+            trie.add(topic_filter, topic_filter)
+        for (idx, topic_filter) in enumerate(FILTERS):
+            self.assertEqual(trie.remove(topic_filter), topic_filter)
+            remaining = FILTERS[idx + 1:]
+            for topic in TOPICS:
+                with self.subTest(removed=topic_filter, topic=topic):
+                    self.assertCountEqual(trie.match(topic),
+                                          [topic_filter for topic_filter in remaining
+                                           if topic_matches_sub(topic_filter, topic)])
+        self.assertEqual(trie.root.children, {})
+
+    def test_remove_unknown(self):
+        """Removing a filter without a value raises KeyError."""
+        trie = TopicTrie()
+        trie.add("a/b/c", 1)
+        for topic_filter in ("a/b", "a/b/c/d", "x"):
+            with self.subTest(topic_filter=topic_filter):
+                self.assertRaises(KeyError, trie.remove, topic_filter)
+        self.assertEqual(trie.match("a/b/c"), [1])
+
+    def test_replace(self):
+        """Adding a filter again replaces its value."""
+        trie = TopicTrie()
+        trie.add("a/+", 1)
+        trie.add("a/+", 2)
+        self.assertEqual(trie.match("a/b"), [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Matching of MQTT topics against a set of topic filters."""
+from typing import Any
+
+
+class _TrieNode:  # pylint: disable=too-few-public-methods
+    """One level of a topic filter."""
+    __slots__ = ("children", "has_value", "value")
+
+    def __init__(self):
+        self.children: dict[str, "_TrieNode"] = {}
+        self.has_value = False
+        self.value = None
+
+
+class TopicTrie:
+    """
+    Stores values under MQTT topic filters, one level of the filter per node.
+
+    A topic is matched against all the filters at once, in a time that depends on
+    the number of levels of the topic rather than on the number of filters.
+    The '+' and '#' wildcards follow the MQTT specification: wildcards at the
+    first level do not match topics starting with '$'.
+    """
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def add(self, topic_filter: str, value: Any) -> None:
+        """Stores a value under a topic filter, replacing any previous value."""
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _TrieNode())
+        node.has_value = True
+        node.value = value
+
+    def remove(self, topic_filter: str) -> Any:
+        """
+        Removes the value stored under a topic filter and returns it.
+        Raises KeyError if no value is stored under the filter.
+        """
+        levels = topic_filter.split("/")
+        path = [self.root]
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                raise KeyError(topic_filter)
+            path.append(node)
+        node = path[-1]
+        if not node.has_value:
+            raise KeyError(topic_filter)
+        value = node.value
+        node.has_value = False
+        node.value = None
+        # Prune the nodes that no longer lead to any value
+        for idx in range(len(levels), 0, -1):
+            if path[idx].has_value or path[idx].children:
+                break
+            del path[idx - 1].children[levels[idx - 1]]
+        return value
+
+    def match(self, topic: str) -> list:
+        """Returns the values of all the filters matching a topic."""
+        res = []
+        levels = topic.split("/")
+        nodes = [self.root]
+        for (idx, level) in enumerate(levels):
+            wildcards = idx != 0 or not level.startswith("$")
+            next_nodes = []
+            for node in nodes:
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                if wildcards:
+                    child = node.children.get("+")
+                    if child is not None:
+                        next_nodes.append(child)
+                    child = node.children.get("#")
+                    if child is not None and child.has_value:
+                        res.append(child.value)
+            if not next_nodes:
+                return res
+            nodes = next_nodes
+        for node in nodes:
+            if node.has_value:
+                res.append(node.value)
+            # 'a/#' also matches 'a'
+            child = node.children.get("#")
+            if child is not None and child.has_value:
+                res.append(child.value)
+        return res
@@ -1,6 +1,9 @@
 """Protocol that defines how to interact with the User Interface."""
+import time
 from typing import Protocol, Optional
 from sp_dev import SPDev
+from metric_watch import Watch
+from ingest_stats import IngestStats, STAGE_UI
 
 
 class UI(Protocol):
@@ -20,8 +23,22 @@ class UI(Protocol):
     def on_device_removed(self, sp_dev: SPDev) -> None:
         """Called when a device is removed."""
 
-    def on_metric_updated(self, sp_dev: SPDev, metric) -> None:
-        """Called when a metric is updated."""
+    def on_metric_updated(self, sp_dev: SPDev, slot: int) -> None:
+        """
+        Called when a metric is updated, with the slot of the metric in the
+        EoN/Device: the metric object is only built with build_metric() if needed.
+        """
+
+    def on_metrics_updated(self, updates: dict[SPDev, list[tuple]]) -> None:
+        """
+        Called with a batch of metric updates when they are coalesced.
+        For each device, the list holds (metric, suppressed) tuples where metric
+        is the latest value of the metric and suppressed is the number of
+        updates received before it since the previous batch.
+        """
+
+    def on_watch_triggered(self, watch: Watch, sp_dev: SPDev, metric) -> None:
+        """Called when the updated value of a metric starts matching a watch."""
 
     def run(self) -> Optional[int]:
         """
@@ -48,9 +65,67 @@ class UIStub:
     def on_device_removed(self, sp_dev: SPDev) -> None:
         """Does nothing."""
 
-    def on_metric_updated(self, sp_dev: SPDev, metric) -> None:
+    def on_metric_updated(self, sp_dev: SPDev, slot: int) -> None:
+        """Does nothing."""
+
+    def on_metrics_updated(self, updates: dict[SPDev, list[tuple]]) -> None:
+        """Does nothing."""
+
+    def on_watch_triggered(self, watch: Watch, sp_dev: SPDev, metric) -> None:
         """Does nothing."""
 
     def run(self) -> Optional[int]:
         """Does nothing."""
         return 0
+
+
+class TimedUI:
+    """
+    Forwards the events to a UI, accounting for the time spent handling
+    them in the ingest statistics.
+    """
+    def __init__(self, ui: UI):
+        self.ui = ui
+        self.stats = IngestStats()
+
+    def _timed(self, callback, *args) -> None:
+        start = time.perf_counter_ns()
+        try:
+            callback(*args)
+        finally:
+            self.stats.add_stage_time(STAGE_UI, time.perf_counter_ns() - start)
+
+    def on_broker_connected(self) -> None:
+        """Forwards the event to the UI."""
+        self.ui.on_broker_connected()
+
+    def on_broker_disconnected(self) -> None:
+        """Forwards the event to the UI."""
+        self.ui.on_broker_disconnected()
+
+    def on_device_added(self, sp_dev: SPDev) -> None:
+        """Forwards the event to the UI."""
+        self._timed(self.ui.on_device_added, sp_dev)
+
+    def on_device_removed(self, sp_dev: SPDev) -> None:
+        """Forwards the event to the UI."""
+        self._timed(self.ui.on_device_removed, sp_dev)
+
+    def on_metric_updated(self, sp_dev: SPDev, slot: int) -> None:
+        """Forwards the event to the UI."""
+        self._timed(self.ui.on_metric_updated, sp_dev, slot)
+
+    def on_metrics_updated(self, updates: dict[SPDev, list[tuple]]) -> None:
+        """
+        Forwards the event to the UI, without timing it: coalesced updates are
+        flushed by another thread than the one handling received messages.
+        """
+        self.ui.on_metrics_updated(updates)
+
+    def on_watch_triggered(self, watch: Watch, sp_dev: SPDev, metric) -> None:
+        """Forwards the event to the UI."""
+        self._timed(self.ui.on_watch_triggered, watch, sp_dev, metric)
+
+    def run(self) -> Optional[int]:
+        """Runs the UI loop."""
+        return self.ui.run()